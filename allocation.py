@@ -0,0 +1,175 @@
+import heapq
+from collections import namedtuple
+
+
+"""
+    Motor de atribuição de mandatos pelo método de Hondt e pelos outros
+    métodos de METHODS (Sainte-Laguë, Sainte-Laguë modificado, maiores
+    restos com as quotas de Hare e de Droop).
+
+    Em vez de recalcular todos os quocientes a cada mandato, cada grupo tem
+    apenas o seu próximo quociente numa fila de prioridade (heap), o que
+    reduz o custo por círculo de O(mandatos × grupos) para
+    O(grupos + mandatos × log grupos). Nos métodos de maiores restos o
+    k-ésimo mandato de um grupo vale votos / quota - (k - 1): as quotas
+    inteiras passam à frente e depois os maiores restos, com o mesmo heap.
+
+"""
+
+# Groups that take part in the count but never receive mandates
+EXCLUDED_GROUPS = ('Votos em branco', 'Votos nulos')
+
+# One entry of the ordered quotient list
+Quotient = namedtuple('Quotient', ['group', 'divisor', 'quotient'])
+
+
+class HondtAllocation:
+    """
+    Result of an allocation in one district (D'Hondt or any method of METHODS).
+
+    Attributes:
+        mandatos (dict): {group: mandates won}, in the input order
+        ranking (list): Quotient entries in the order they were awarded; the
+                        first `seats` entries won a mandate, the remaining
+                        ones are the best losing quotients
+        seats (int): number of mandates allocated
+    """
+
+    def __init__(self, mandatos, ranking, seats):
+        self.mandatos = mandatos
+        self.ranking = ranking
+        self.seats = seats
+
+    @property
+    def last_seat(self):
+        """Quotient that won the last mandate (None if no mandates)"""
+        if self.seats == 0 or len(self.ranking) < self.seats:
+            return None
+        return self.ranking[self.seats - 1]
+
+    @property
+    def next_seat(self):
+        """Best losing quotient, i.e. the one that would win one more mandate"""
+        if len(self.ranking) <= self.seats:
+            return None
+        return self.ranking[self.seats]
+
+    def first(self, seats):
+        """
+        Mandates of the first `seats` quotients (at most self.seats).
+
+        With a divisor method the priorities do not depend on the number
+        of mandates, so this is the allocation of the same votes in a
+        smaller district, without a new heap.
+        """
+        mandatos = dict.fromkeys(self.mandatos, 0)
+        for quotient in self.ranking[:seats]:
+            mandatos[quotient.group] += 1
+        return mandatos
+
+
+def dhondt(total, seats):
+    """Divisors 1, 2, 3, ..."""
+    return lambda votes, k: votes / k
+
+
+def sainte_lague(total, seats):
+    """Divisors 1, 3, 5, ..."""
+    return lambda votes, k: votes / (2 * k - 1)
+
+
+def modified_sainte_lague(total, seats):
+    """Divisors 1.4, 3, 5, ...: a first mandate costs more"""
+    return lambda votes, k: votes / (1.4 if k == 1 else 2 * k - 1)
+
+
+def _largest_remainder(quota):
+    # The k-th mandate of a group ranks by the votes it has left after k - 1
+    # quotas: whole quotas first, then the largest remainders
+    return lambda votes, k: votes / quota - (k - 1)
+
+
+def hare(total, seats):
+    """Largest remainder with the Hare quota, total / seats"""
+    return _largest_remainder(total / seats if total and seats else 1)
+
+
+def droop(total, seats):
+    """Largest remainder with the Droop quota, floor(total / (seats + 1)) + 1"""
+    return _largest_remainder(total // (seats + 1) + 1)
+
+
+# Apportionment methods: (total votes, seats) -> priority(votes, k) of the
+# k-th mandate of a group, decreasing in k
+METHODS = {
+    'dhondt': dhondt,
+    'sainte-lague': sainte_lague,
+    'sainte-lague-modificado': modified_sainte_lague,
+    'hare': hare,
+    'droop': droop
+}
+
+# Methods whose priorities depend on the number of mandates (through the quota)
+QUOTA_METHODS = ('hare', 'droop')
+
+
+def allocate(votes, seats, method='dhondt', lookahead=1, won=None, total_seats=None):
+    """
+    Allocates mandates with any method of METHODS using a priority queue.
+
+    Every method ranks the k-th mandate of each group by a priority that
+    falls with k, so the mandates go to the `seats` largest priorities:
+    each group only keeps its next priority in the heap. Ties are broken in
+    favour of the group that comes first in `votes`, which gives the same
+    result as running max() over the priorities of each round.
+
+    Args:
+        votes (dict): {group: votes}; the iteration order decides ties
+        seats (int): number of mandates to allocate
+        method (str): key of METHODS
+        lookahead (int): number of losing quotients to keep in the ranking
+        won (dict): {group: mandates already won in another tier}; each
+                    group's priorities start after them (compensation seats)
+        total_seats (int): mandates of all the tiers, for the quota of the
+                           largest remainder methods (by default `seats`)
+
+    Returns:
+        HondtAllocation: the new mandates per group and the ordered quotient
+            list; a Quotient's divisor is the mandate number k of its group
+    """
+    won = won or {}
+    priority = METHODS[method](sum(votes.values()), total_seats or seats)
+    mandatos = {group: 0 for group in votes}
+    heap = [
+        (-priority(group_votes, won.get(group, 0) + 1), position, won.get(group, 0) + 1, group)
+        for position, (group, group_votes) in enumerate(votes.items())
+    ]
+    heapq.heapify(heap)
+
+    ranking = []
+    for _ in range(seats + lookahead):
+        if not heap:
+            break
+        negative_quotient, position, divisor, group = heap[0]
+        ranking.append(Quotient(group, divisor, -negative_quotient))
+        if len(ranking) <= seats:
+            mandatos[group] += 1
+        # Replace the top entry with the group's next quotient
+        heapq.heapreplace(heap, (-priority(votes[group], divisor + 1), position, divisor + 1, group))
+
+    return HondtAllocation(mandatos, ranking, seats)
+
+
+def allocate_hondt(votes, seats, lookahead=1):
+    """
+    Allocates mandates using the D'Hondt method with a priority queue.
+
+    Args:
+        votes (dict): {group: votes}; the iteration order decides ties
+        seats (int): number of mandates to allocate
+        lookahead (int): number of losing quotients to keep in the ranking
+
+    Returns:
+        HondtAllocation: mandates per group and the ordered quotient list
+    """
+    return allocate(votes, seats, 'dhondt', lookahead)
@@ -1,19 +1,50 @@
 import requests
-from google.cloud import bigquery
-from google.oauth2 import service_account
+from requests.adapters import HTTPAdapter
+import argparse
+import hashlib
+import json
+import os
+import random
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, UTC
 
+from escritores import make_writer, WRITERS
+
 """
 
 Este script obtém dados das eleições AR25 por distrito
 em https://www.legislativas2025.mai.gov.pt/frontend/data/TerritoryResults"
 e guarda-os numa tabela BigQuery.
 
+Por omissão os 22 territórios são pedidos em paralelo (--workers), numa
+sessão HTTP com keep-alive, com um limite de pedidos por segundo (--rate,
+token bucket) e novas tentativas com backoff exponencial. --sequential
+repõe o ciclo original com time.sleep(0.5).
+
+Só se inserem os territórios cujos resultados mudaram: cada pedido leva
+If-None-Match / If-Modified-Since com os validadores da passagem anterior
+(um 304 conta como inalterado) e, quando o servidor não os suporta, compara-se
+um hash do conteúdo de currentResults. Os hashes e validadores ficam no
+ficheiro de estado (--state-file) e só são actualizados depois de a inserção
+correr bem. --force insere todos os territórios.
+
+Para testar sem rede: python arquivo/stubservidor.py e depois
+python arquivo/250530pescadados.py --base-url http://localhost:8081/frontend/data/TerritoryResults --dry-run
+(ou --writer duckdb / --writer sqlite para gravar num ficheiro local).
+
+As linhas são gravadas de uma vez por um escritor de escritores.py: por
+omissão um load job BigQuery (--writer load), em vez do streaming com
+insert_rows_json (--writer stream).
+
 """
 
 # Configuration
-BASE_URL = "https://www.legislativas2025.mai.gov.pt/frontend/data/TerritoryResults"
+BASE_URL = os.environ.get(
+    "TERRITORY_RESULTS_URL",
+    "https://www.legislativas2025.mai.gov.pt/frontend/data/TerritoryResults"
+)
 # District mapping
 DISTRICT_MAPPING = {
     "LOCAL-010000": "Aveiro",
@@ -45,19 +76,173 @@ BQ_DATASET = "AR25"
 BQ_TABLE = "resultadosporcirculo"
 # SERVICE_ACCOUNT_FILE = "path/to/your/service-account.json"
 
-def fetch_territory_data(territory_code):
-    """Fetch election data for a specific territory"""
+# Concurrent fetching
+MAX_WORKERS = 8           # Territories fetched at the same time
+REQUESTS_PER_SECOND = 10  # Token bucket rate (replaces the fixed 0.5 s sleep)
+MAX_RETRIES = 3
+BACKOFF_SECONDS = 0.5     # Doubles on each retry, plus jitter
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+# Change detection
+STATE_FILE = os.environ.get(
+    "SCRAPER_STATE_FILE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "pescadados_estado.json")
+)
+NOT_MODIFIED = object()   # fetch_territory_data() result for an HTTP 304
+
+
+class TokenBucket:
+    """Allows `rate` requests per second on average, with bursts up to `capacity`"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1, int(rate))
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until a token is available"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def make_session(pool_size=MAX_WORKERS):
+    """HTTP session whose connections are kept alive and shared by the threads"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def conditional_headers(validators):
+    """If-None-Match / If-Modified-Since from the validators of the last sweep"""
+    headers = {}
+    if validators and validators.get("etag"):
+        headers["If-None-Match"] = validators["etag"]
+    if validators and validators.get("last_modified"):
+        headers["If-Modified-Since"] = validators["last_modified"]
+    return headers
+
+
+def fetch_territory_data(territory_code, session=None, bucket=None, retries=MAX_RETRIES, validators=None):
+    """
+    Fetch election data for a specific territory, retrying transient errors.
+
+    Args:
+        validators (dict or None): {'etag', 'last_modified'} of the last sweep,
+            sent as a conditional request; updated in place from the response
+
+    Returns:
+        data (dict), NOT_MODIFIED if the server answered 304, or None on error
+    """
+    http = session or requests
+    for attempt in range(retries + 1):
+        if bucket is not None:
+            bucket.acquire()
+        try:
+            response = http.get(
+                BASE_URL,
+                params={"territoryKey": territory_code, "electionId": "AR"},
+                headers=conditional_headers(validators),
+                timeout=10
+            )
+            if response.status_code == 304:
+                return NOT_MODIFIED
+            if response.status_code not in RETRY_STATUS:
+                response.raise_for_status()
+                data = response.json()
+                if validators is not None:
+                    validators["etag"] = response.headers.get("ETag")
+                    validators["last_modified"] = response.headers.get("Last-Modified")
+                return data
+            error = f"HTTP {response.status_code}"
+        except requests.exceptions.HTTPError as e:
+            # 4xx other than 429: retrying will not help
+            print(f"Error fetching {territory_code}: {e}")
+            return None
+        except (requests.exceptions.RequestException, ValueError) as e:
+            error = e
+        if attempt < retries:
+            time.sleep(BACKOFF_SECONDS * 2 ** attempt * (1 + random.random()))
+    print(f"Error fetching {territory_code}: {error} (after {retries + 1} attempts)")
+    return None
+
+
+def fetch_status(data):
+    if data is NOT_MODIFIED:
+        return "not modified"
+    return "ok" if data else "Failed"
+
+
+def fetch_all_territories(territory_codes, workers=MAX_WORKERS, rate=REQUESTS_PER_SECOND, validators=None):
+    """
+    Fetches all territories concurrently.
+
+    Args:
+        validators (dict or None): {territory_code: {'etag', 'last_modified'}},
+            see fetch_territory_data
+
+    Returns:
+        results (dict): {territory_code: data, NOT_MODIFIED or None}, in the order of territory_codes
+    """
+    session = make_session(workers)
+    bucket = TokenBucket(rate)
+    validators = validators if validators is not None else {}
+    results = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(
+                fetch_territory_data, code, session, bucket,
+                validators=validators.setdefault(code, {})
+            ): code
+            for code in territory_codes
+        }
+        for future in as_completed(futures):
+            code = futures[future]
+            results[code] = future.result()
+            print(f"{DISTRICT_MAPPING.get(code)}: {fetch_status(results[code])}", flush=True)
+    session.close()
+    return {code: results[code] for code in territory_codes}
+
+def content_hash(data):
+    """Hash of a territory's currentResults, independent of key order"""
+    canonical = json.dumps(data.get("currentResults"), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def load_state(path):
+    """
+    Last inserted state of each territory.
+
+    Returns:
+        state (dict): {territory_code: {'hash', 'etag', 'last_modified'}};
+                      empty if the file is missing or unreadable
+    """
     try:
-        response = requests.get(
-            BASE_URL,
-            params={"territoryKey": territory_code, "electionId": "AR"},
-            timeout=10
-        )
-        response.raise_for_status()
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        print(f"Error fetching {territory_code}: {e}")
-        return None
+        with open(path, encoding="utf-8") as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return state if isinstance(state, dict) else {}
+
+
+def save_state(path, state):
+    """Writes the state file atomically (temporary file + rename)"""
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
 
 def process_territory_data(territory_code, data):
     """Process territory data into rows for BigQuery"""
@@ -102,59 +287,81 @@ def process_territory_data(territory_code, data):
 
     return rows
 
-def save_to_bigquery(rows):
-    """Save all data to BigQuery in one operation"""
-    """ credentials = service_account.Credentials.from_service_account_file(
-        SERVICE_ACCOUNT_FILE,
-        scopes=["https://www.googleapis.com/auth/cloud-platform"],
-    ) """
-    
-    client = bigquery.Client(project=BQ_PROJECT)
-    table_ref = client.dataset(BQ_DATASET).table(BQ_TABLE)
-    
-    # Create table if needed (schema will be auto-detected)
-    try:
-        client.get_table(table_ref)
-    except Exception:
-        schema = [
-            bigquery.SchemaField("codigo", "STRING"),
-            bigquery.SchemaField("distrito", "STRING", description="District name (e.g., Aveiro)"),
-            bigquery.SchemaField("partido", "STRING"),
-            bigquery.SchemaField("votos", "INTEGER"),
-            bigquery.SchemaField("mandatos", "INTEGER"),
-            bigquery.SchemaField("timestamp", "TIMESTAMP"),
-        ]
-        table = bigquery.Table(table_ref, schema=schema)
-        client.create_table(table)
-    
-    errors = client.insert_rows_json(table_ref, rows)
-    if errors:
-        print(f"Encountered errors: {errors}")
-    else:
-        print(f"Successfully loaded {len(rows)} rows")
-
 def main():
+    global BASE_URL
+    parser = argparse.ArgumentParser(description="Fetch AR results per territory and save them to BigQuery")
+    parser.add_argument("--sequential", action="store_true", help="one territory at a time (original loop)")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS)
+    parser.add_argument("--rate", type=float, default=REQUESTS_PER_SECOND, help="requests per second")
+    parser.add_argument("--base-url", default=BASE_URL, help="e.g. a local stub server")
+    parser.add_argument("--dry-run", action="store_true", help="do not write to BigQuery")
+    parser.add_argument("--state-file", default=STATE_FILE, help="hashes and validators of the last insert")
+    parser.add_argument("--force", action="store_true", help="insert every territory, changed or not")
+    parser.add_argument("--writer", choices=WRITERS, default="load",
+                        help="BigQuery load job or streaming insert, or a local sqlite/duckdb file")
+    parser.add_argument("--format", choices=["ndjson", "parquet"], default="ndjson",
+                        help="buffer file of the load job")
+    parser.add_argument("--local-db", help="file of the sqlite/duckdb writers")
+    args = parser.parse_args()
+    BASE_URL = args.base_url
+
+    state = {} if args.force else load_state(args.state_file)
+    # Validators sent with this sweep; only committed to the state with the hash
+    validators = {code: {
+        "etag": state.get(code, {}).get("etag"),
+        "last_modified": state.get(code, {}).get("last_modified")
+    } for code in TERRITORY_CODES}
+
     all_rows = []
+    changed = {}  # territory_code -> content hash of the rows in all_rows
+    unchanged = []
+    started = time.perf_counter()
     
     print(f"Processing {len(TERRITORY_CODES)} districts...")
-    for territory_code in TERRITORY_CODES:
-        print(f"Fetching {DISTRICT_MAPPING.get(territory_code)}...", end=" ", flush=True)
-        data = fetch_territory_data(territory_code)
-        if data:
-            rows = process_territory_data(territory_code, data)
-            # print(rows)
-            all_rows.extend(rows)
-            print(f"Found {len(rows)} parties")
-        else:
-            print("Failed")
-        time.sleep(0.5)  # Respectful delay
+    if args.sequential:
+        fetched = {}
+        for territory_code in TERRITORY_CODES:
+            print(f"Fetching {DISTRICT_MAPPING.get(territory_code)}...", end=" ", flush=True)
+            fetched[territory_code] = fetch_territory_data(territory_code, validators=validators[territory_code])
+            print(fetch_status(fetched[territory_code]))
+            time.sleep(0.5)  # Respectful delay
+    else:
+        fetched = fetch_all_territories(TERRITORY_CODES, args.workers, args.rate, validators)
+
+    for territory_code, data in fetched.items():
+        if data is NOT_MODIFIED:
+            unchanged.append(territory_code)
+        elif data:
+            digest = content_hash(data)
+            if digest == state.get(territory_code, {}).get("hash"):
+                unchanged.append(territory_code)
+                # Same content under new validators: keep them for the next sweep
+                state[territory_code].update(validators[territory_code])
+                continue
+            all_rows.extend(process_territory_data(territory_code, data))
+            changed[territory_code] = digest
+
+    print(f"Sweep took {time.perf_counter() - started:.2f} s")
+    print(f"Changed: {len(changed)}, unchanged: {len(unchanged)}, "
+          f"failed: {len(TERRITORY_CODES) - len(changed) - len(unchanged)}")
     
-    if all_rows:
+    if all_rows and args.dry_run:
+        print(f"\nTotal rows (dry run, not inserted): {len(all_rows)}")
+        return
+    elif all_rows:
         print(f"\nTotal rows to insert: {len(all_rows)}")
         print(all_rows)
-        save_to_bigquery(all_rows)
+        writer = make_writer(args.writer, BQ_PROJECT, BQ_DATASET, BQ_TABLE, args.local_db, args.format)
+        writer.write(all_rows)
+        if not writer.flush():
+            return  # Keep the old state so these territories are retried
+        for territory_code, digest in changed.items():
+            state[territory_code] = dict(validators[territory_code], hash=digest)
+    elif unchanged:
+        print("No changes since the last sweep")
     else:
         print("No data collected")
+    save_state(args.state_file, state)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,261 @@
+import io
+import json
+import sqlite3
+import tempfile
+import threading
+
+try:
+    import duckdb
+except ImportError:  # Only needed for the DuckDB backend
+    duckdb = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Only needed to buffer rows as Parquet
+    pa = None
+
+"""
+
+Escritores das linhas do scraper (250530pescadados.py).
+
+Todos têm a mesma interface: write(rows) acumula as linhas e flush()
+grava-as de uma vez, devolvendo True se correu bem (se falhar, as linhas
+ficam no buffer). Há três destinos:
+
+- "load": BigQuery por load job. As linhas vão para um ficheiro local
+  (NDJSON ou Parquet) que é carregado num único job WRITE_APPEND, que
+  cria a tabela se for preciso. Sai mais barato do que o streaming e as
+  linhas não ficam no streaming buffer.
+- "stream": o insert_rows_json original.
+- "sqlite" / "duckdb": um ficheiro local com a mesma tabela, para testar
+  o caminho todo sem rede.
+
+O cliente BigQuery é criado uma vez por processo e reutilizado, e a
+existência da tabela fica em cache.
+
+"""
+
+COLUMNS = ["codigo", "distrito", "partido", "votos", "mandatos", "timestamp"]
+
+_clients = {}
+_known_tables = set()
+_lock = threading.Lock()
+
+
+def bigquery_client(project):
+    """Long-lived BigQuery client, one per project"""
+    with _lock:
+        if project not in _clients:
+            from google.cloud import bigquery
+            _clients[project] = bigquery.Client(project=project)
+        return _clients[project]
+
+
+def bigquery_schema():
+    from google.cloud import bigquery
+    return [
+        bigquery.SchemaField("codigo", "STRING"),
+        bigquery.SchemaField("distrito", "STRING", description="District name (e.g., Aveiro)"),
+        bigquery.SchemaField("partido", "STRING"),
+        bigquery.SchemaField("votos", "INTEGER"),
+        bigquery.SchemaField("mandatos", "INTEGER"),
+        bigquery.SchemaField("timestamp", "TIMESTAMP"),
+    ]
+
+
+class RowWriter:
+    """
+    Buffers rows and writes them in one go.
+
+    Subclasses implement _write(rows) and raise on failure.
+    """
+
+    def __init__(self):
+        self.rows = []
+
+    def write(self, rows):
+        self.rows.extend(rows)
+
+    def flush(self):
+        """
+        Returns:
+            ok (bool): False if the write failed; the rows stay buffered
+        """
+        if not self.rows:
+            return True
+        try:
+            self._write(self.rows)
+        except Exception as e:
+            print(f"Encountered errors: {e}")
+            return False
+        print(f"Successfully loaded {len(self.rows)} rows ({self.describe()})")
+        self.rows = []
+        return True
+
+    def describe(self):
+        return type(self).__name__
+
+
+class BigQueryStreamingWriter(RowWriter):
+    """The original path: insert_rows_json into the streaming buffer"""
+
+    def __init__(self, project, dataset, table):
+        super().__init__()
+        self.project = project
+        self.table_id = f"{project}.{dataset}.{table}"
+
+    def describe(self):
+        return f"streaming insert into {self.table_id}"
+
+    def _ensure_table(self, client):
+        if self.table_id in _known_tables:
+            return
+        from google.cloud import bigquery
+        from google.api_core.exceptions import NotFound
+        try:
+            client.get_table(self.table_id)
+        except NotFound:
+            client.create_table(bigquery.Table(self.table_id, schema=bigquery_schema()))
+        _known_tables.add(self.table_id)
+
+    def _write(self, rows):
+        client = bigquery_client(self.project)
+        self._ensure_table(client)
+        errors = client.insert_rows_json(self.table_id, rows)
+        if errors:
+            raise RuntimeError(errors)
+
+
+class BigQueryLoadWriter(RowWriter):
+    """
+    Buffers rows to a local file and appends them with a single load job.
+
+    Args:
+        file_format (str): 'ndjson' or 'parquet' (needs pyarrow)
+        spool_dir (str or None): where the buffer file lives (default: temp dir)
+    """
+
+    def __init__(self, project, dataset, table, file_format="ndjson", spool_dir=None):
+        super().__init__()
+        if file_format == "parquet" and pa is None:
+            raise RuntimeError("the parquet format needs pyarrow")
+        self.project = project
+        self.table_id = f"{project}.{dataset}.{table}"
+        self.file_format = file_format
+        self.spool_dir = spool_dir
+
+    def describe(self):
+        return f"load job ({self.file_format}) into {self.table_id}"
+
+    def _spool(self, rows, f):
+        """Writes the rows to the open binary file f"""
+        if self.file_format == "parquet":
+            table = pa.Table.from_pylist(rows).select(COLUMNS)
+            table = table.set_column(
+                COLUMNS.index("timestamp"), "timestamp",
+                table.column("timestamp").cast(pa.timestamp("s"))
+            )
+            pq.write_table(table, f)
+        else:
+            text = io.TextIOWrapper(f, encoding="utf-8", newline="\n")
+            for row in rows:
+                text.write(json.dumps(row, ensure_ascii=False))
+                text.write("\n")
+            text.flush()
+            text.detach()
+
+    def _write(self, rows):
+        from google.cloud import bigquery
+        client = bigquery_client(self.project)
+        job_config = bigquery.LoadJobConfig(
+            source_format=(bigquery.SourceFormat.PARQUET if self.file_format == "parquet"
+                           else bigquery.SourceFormat.NEWLINE_DELIMITED_JSON),
+            schema=bigquery_schema(),
+            write_disposition=bigquery.WriteDisposition.WRITE_APPEND,
+            create_disposition=bigquery.CreateDisposition.CREATE_IF_NEEDED,
+        )
+        with tempfile.TemporaryFile(dir=self.spool_dir) as f:
+            self._spool(rows, f)
+            f.seek(0)
+            job = client.load_table_from_file(f, self.table_id, job_config=job_config)
+            job.result()  # Raises if the job failed
+        _known_tables.add(self.table_id)
+
+
+class SQLiteWriter(RowWriter):
+    """Appends the rows to a table in a local SQLite file"""
+
+    def __init__(self, path, table):
+        super().__init__()
+        self.path = path
+        self.table = table
+
+    def describe(self):
+        return f"{self.table} in {self.path}"
+
+    def _write(self, rows):
+        con = sqlite3.connect(self.path)
+        try:
+            with con:
+                con.execute(
+                    f"CREATE TABLE IF NOT EXISTS {self.table} (codigo TEXT, distrito TEXT, partido TEXT, "
+                    "votos INTEGER, mandatos INTEGER, timestamp TEXT)"
+                )
+                con.executemany(
+                    f"INSERT INTO {self.table} VALUES (?, ?, ?, ?, ?, ?)",
+                    [tuple(row[column] for column in COLUMNS) for row in rows]
+                )
+        finally:
+            con.close()
+
+
+class DuckDBWriter(RowWriter):
+    """Appends the rows to a table in a local DuckDB file"""
+
+    def __init__(self, path, table):
+        super().__init__()
+        if duckdb is None:
+            raise RuntimeError("the duckdb backend needs the duckdb package")
+        self.path = path
+        self.table = table
+
+    def describe(self):
+        return f"{self.table} in {self.path}"
+
+    def _write(self, rows):
+        con = duckdb.connect(self.path)
+        try:
+            con.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.table} (codigo VARCHAR, distrito VARCHAR, partido VARCHAR, "
+                "votos BIGINT, mandatos BIGINT, timestamp TIMESTAMP)"
+            )
+            con.execute("BEGIN TRANSACTION")
+            con.executemany(
+                f"INSERT INTO {self.table} VALUES (?, ?, ?, ?, ?, ?)",
+                [tuple(row[column] for column in COLUMNS) for row in rows]
+            )
+            con.execute("COMMIT")
+        finally:
+            con.close()
+
+
+WRITERS = ["load", "stream", "sqlite", "duckdb"]
+
+
+def make_writer(kind, project, dataset, table, local_path=None, file_format="ndjson"):
+    """
+    Args:
+        kind (str): one of WRITERS
+        local_path (str or None): file of the sqlite/duckdb backends
+            (default: <dataset>.sqlite / <dataset>.duckdb)
+    """
+    if kind == "load":
+        return BigQueryLoadWriter(project, dataset, table, file_format)
+    if kind == "stream":
+        return BigQueryStreamingWriter(project, dataset, table)
+    if kind == "sqlite":
+        return SQLiteWriter(local_path or f"{dataset}.sqlite", table)
+    if kind == "duckdb":
+        return DuckDBWriter(local_path or f"{dataset}.duckdb", table)
+    raise ValueError(f"unknown writer: {kind!r} (expected one of {WRITERS})")
@@ -0,0 +1,126 @@
+import argparse
+import hashlib
+import json
+import os
+import random
+import time
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+"""
+
+Servidor local que imita https://www.legislativas2025.mai.gov.pt/frontend/data/TerritoryResults
+para testar o scraper (250530pescadados.py) sem rede.
+
+Responde a /frontend/data/TerritoryResults?territoryKey=LOCAL-010000&electionId=AR
+com um JSON TerritoryResults: o ficheiro <territoryKey>.json de --dir, se
+existir, ou resultados sintéticos fixos para cada território.
+--delay e --fail-rate simulam um servidor lento ou instável.
+As respostas levam ETag e Last-Modified (a data de modificação do ficheiro,
+ou o arranque do servidor) e os pedidos condicionais recebem 304;
+--no-validators imita um servidor sem suporte para eles.
+
+python arquivo/stubservidor.py --port 8081 --delay 0.3 --fail-rate 0.1
+
+"""
+
+PARTIES = ["PPD/PSD.CDS-PP", "PS", "CH", "IL", "L", "B.E.", "PCP-PEV", "PAN", "ADN", "JPP"]
+
+
+def canned_results(territory_key):
+    """Synthetic TerritoryResults, always the same for the same territory"""
+    rng = random.Random(territory_key)
+    return {
+        "currentResults": {
+            "blankVotes": rng.randint(500, 5000),
+            "nullVotes": rng.randint(500, 5000),
+            "resultsParty": [
+                {"acronym": party, "votes": rng.randint(100, 200000), "mandates": rng.randint(0, 5)}
+                for party in PARTIES
+            ]
+        }
+    }
+
+
+class TerritoryResultsHandler(BaseHTTPRequestHandler):
+    directory = None
+    delay = 0.0
+    fail_rate = 0.0
+    validators = True
+    started = time.time()
+
+    def not_modified(self, etag, last_modified):
+        """Whether the conditional headers of the request still match"""
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match is not None:  # Takes precedence over If-Modified-Since
+            return etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*"
+        if_modified_since = self.headers.get("If-Modified-Since")
+        if if_modified_since:
+            try:
+                return int(last_modified) <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != "/frontend/data/TerritoryResults":
+            self.send_error(404)
+            return
+        territory_key = parse_qs(url.query).get("territoryKey", [""])[0]
+
+        time.sleep(random.uniform(0, self.delay))
+        if random.random() < self.fail_rate:
+            self.send_error(503)
+            return
+
+        path = os.path.join(self.directory, f"{territory_key}.json") if self.directory else None
+        if path and os.path.exists(path):
+            with open(path, "rb") as f:
+                body = f.read()
+            last_modified = os.path.getmtime(path)
+        else:
+            body = json.dumps(canned_results(territory_key)).encode("utf-8")
+            last_modified = self.started
+        etag = '"' + hashlib.sha256(body).hexdigest()[:16] + '"'
+
+        if self.validators and self.not_modified(etag, last_modified):
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        if self.validators:
+            self.send_header("ETag", etag)
+            self.send_header("Last-Modified", formatdate(last_modified, usegmt=True))
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Keep the console quiet
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stub of the TerritoryResults endpoint")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--dir", help="directory with <territoryKey>.json files")
+    parser.add_argument("--delay", type=float, default=0.0, help="maximum random delay per request (s)")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="fraction of requests answered with 503")
+    parser.add_argument("--no-validators", action="store_true", help="no ETag/Last-Modified, never 304")
+    args = parser.parse_args()
+
+    TerritoryResultsHandler.directory = args.dir
+    TerritoryResultsHandler.delay = args.delay
+    TerritoryResultsHandler.fail_rate = args.fail_rate
+    TerritoryResultsHandler.validators = not args.no_validators
+    server = ThreadingHTTPServer(("localhost", args.port), TerritoryResultsHandler)
+    print(f"Serving TerritoryResults on http://localhost:{args.port}/frontend/data/TerritoryResults")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
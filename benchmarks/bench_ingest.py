@@ -0,0 +1,73 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import DISTRITOS, PARTIDOS
+from ingest import ingest_rows, ingest_columnar
+
+
+"""
+    Compara o ciclo iterrows() com a ingestão colunar em tabelas sintéticas
+    com o formato de resultadosporcirculo.
+
+    python benchmarks/bench_ingest.py --sizes 10000 100000 1000000
+
+"""
+
+
+def make_election_data(n_rows, seed=0):
+    """Random rows with the columns of resultadosporcirculo"""
+    rng = np.random.default_rng(seed)
+    parties = list(PARTIDOS)
+    return pd.DataFrame({
+        'codigo': 'LOCAL-000000',
+        'distrito': np.array(DISTRITOS, dtype=object)[rng.integers(0, len(DISTRITOS), n_rows)],
+        'partido': np.array(parties, dtype=object)[rng.integers(0, len(parties), n_rows)],
+        'votos': pd.array(rng.integers(0, 200000, n_rows), dtype='Int64'),
+        'mandatos': pd.array(rng.integers(0, 5, n_rows), dtype='Int64'),
+        'timestamp': pd.Timestamp('2025-05-18 20:00', tz='UTC')
+    })
+
+
+def as_plain(results):
+    """Nested lists with Python ints, to compare both modes (order included)"""
+    return [
+        (district, [(name, int(data['votos']), int(data['mandatos'])) for name, data in names.items()])
+        for district, names in results.items()
+    ]
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the ingestion modes")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    args = parser.parse_args()
+
+    party_to_group = {party: groups[0] for party, groups in PARTIDOS.items()}
+
+    print(f"{'rows':>10} | {'iterrows (s)':>12} | {'columnar (s)':>12} | {'speedup':>8}")
+    print("-" * 52)
+    for n_rows in args.sizes:
+        election_data = make_election_data(n_rows)
+        rows_time, rows_result = timed(ingest_rows, election_data, party_to_group)
+        columnar_time, columnar_result = timed(ingest_columnar, election_data, party_to_group)
+
+        for rows_table, columnar_table in zip(rows_result, columnar_result):
+            assert as_plain(rows_table) == as_plain(columnar_table), "modes disagree"
+
+        print(f"{n_rows:>10,} | {rows_time:>12.3f} | {columnar_time:>12.4f} | {rows_time / columnar_time:>7.0f}x")
+
+
+if __name__ == '__main__':
+    main()
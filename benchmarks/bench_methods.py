@@ -0,0 +1,73 @@
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from allocation import METHODS, allocate
+from bench_scenarios import make_matrix
+
+
+"""
+    Os métodos de allocation.METHODS no motor comum (heap) contra o ciclo
+    ingénuo de um mandato de cada vez, que recalcula o quociente seguinte
+    de todos os grupos (como allocate_mandates_hondt em
+    arquivo/250601hondtgrp.py e applyDHondt em static/js/coligs.js).
+
+    Mede distritos sintéticos com os mandatos multiplicados por --scale,
+    para ver o custo com círculos grandes, e confirma que as duas versões
+    dão os mesmos mandatos.
+
+    python benchmarks/bench_methods.py --scale 1 10 100
+
+"""
+
+
+def naive(votes, seats, method):
+    """One max() over the priorities of every group per mandate"""
+    priority = METHODS[method](sum(votes.values()), seats)
+    mandatos = {group: 0 for group in votes}
+    for _ in range(seats):
+        winner = max(votes, key=lambda group: priority(votes[group], mandatos[group] + 1))
+        mandatos[winner] += 1
+    return mandatos
+
+
+def districts(scale):
+    matrix = make_matrix()
+    return [
+        ({party: int(votos) for party, votos in zip(matrix.parties, row)}, int(seats) * scale)
+        for row, seats in zip(matrix.votes, matrix.seats)
+    ]
+
+
+def measure(function, data, method, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        allocations = [function(votes, seats, method) for votes, seats in data]
+    return (time.perf_counter() - start) / repeat, allocations
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the apportionment methods")
+    parser.add_argument('--scale', type=int, nargs='+', default=[1, 10, 100], help="mandates multiplier")
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'method':>24} | {'scale':>5} | {'mandates':>8} | {'heap (ms)':>9} | {'loop (ms)':>9} | {'mandates/s':>11}")
+    print("-" * 82)
+    for scale in args.scale:
+        data = districts(scale)
+        total = sum(seats for _, seats in data)
+        for method in METHODS:
+            heap_time, heap = measure(lambda votes, seats, method: allocate(votes, seats, method).mandatos,
+                                      data, method, args.repeat)
+            loop_time, loop = measure(naive, data, method, 1)
+            assert heap == loop, f"{method}: the heap and the loop disagree"
+            print(f"{method:>24} | {scale:>5} | {total:>8,} | {heap_time * 1000:>9.2f} | "
+                  f"{loop_time * 1000:>9.2f} | {total / heap_time:>11,.0f}")
+
+
+if __name__ == '__main__':
+    main()
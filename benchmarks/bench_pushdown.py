@@ -0,0 +1,141 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import DISTRITOS, PARTIDOS
+from datasource import make_source, copy_to
+from incremental import IncrementalResults
+from pushdown import aggregate_pushdown
+from results import build_results, finish_results, party_to_group_mapping
+
+
+"""
+    Compara a consulta que descarrega todas as linhas (QUERY_MODE 'rows')
+    com a agregação na consulta (QUERY_MODE 'pushdown'): tempo total,
+    linhas e bytes transferidos (tamanho Arrow IPC do resultado) e bytes
+    lidos pela consulta, quando a origem os indica (BigQuery).
+
+    Por omissão usa tabelas sintéticas com o formato das passagens do
+    scraper (22 distritos x todos os partidos em cada passagem) em DuckDB,
+    SQLite e Parquet; --configured mede a origem configurada (DATA_SOURCE).
+
+    python benchmarks/bench_pushdown.py --sweeps 10 100 1000
+    DATA_SOURCE=bigquery python benchmarks/bench_pushdown.py --configured
+
+"""
+
+
+def make_sweeps(n_sweeps, seed=0):
+    """n_sweeps copies of every (district, party), as the scraper appends them"""
+    rng = np.random.default_rng(seed)
+    parties = list(PARTIDOS)
+    n_pairs = len(DISTRITOS) * len(parties)
+    sweep = np.repeat(np.arange(n_sweeps), n_pairs)
+    return pd.DataFrame({
+        'codigo': np.tile(np.repeat([f'LOCAL-{i:02d}0000' for i in range(len(DISTRITOS))], len(parties)), n_sweeps),
+        'distrito': np.tile(np.repeat(np.array(DISTRITOS, dtype=object), len(parties)), n_sweeps),
+        'partido': np.tile(np.array(parties, dtype=object), len(DISTRITOS) * n_sweeps),
+        # Counts grow with every sweep, so the latest row is the largest
+        'votos': pd.array(rng.integers(0, 2000, len(sweep)) * (sweep + 1), dtype='Int64'),
+        'mandatos': pd.array(rng.integers(0, 5, len(sweep)), dtype='Int64'),
+        'timestamp': pd.Timestamp('2025-05-18 20:00', tz='UTC') + pd.to_timedelta(sweep * 60, unit='s')
+    })
+
+
+def make_ties(seed=0):
+    """
+    Two sweeps in shuffled order where every party of the first district
+    has the same votes: its mandates are decided by the order of the table.
+    """
+    election_data = make_sweeps(2, seed)
+    tied = (election_data['distrito'] == DISTRITOS[0]) & (election_data['timestamp'] == election_data['timestamp'].max())
+    election_data.loc[tied, 'votos'] = 1000
+    return election_data.sample(frac=1, random_state=seed).reset_index(drop=True)
+
+
+def wire_bytes(frame):
+    """Size of a result as an Arrow IPC stream, a stand-in for what crosses the wire"""
+    sink = pa.BufferOutputStream()
+    table = pa.Table.from_pandas(frame, preserve_index=False)
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().size
+
+
+def as_plain(results):
+    """Comparable form of the results, with the order of districts and parties"""
+    return (
+        [(district, list(parties.items())) for district, parties in results['raw_district_results'].items()],
+        [(district, list(groups.items())) for district, groups in results['grouped_district_results'].items()],
+        sorted((party['name'], party['votos'], party['mandatos']) for party in results['sorted_parties']),
+        sorted((group['name'], group['votos'], group['mandatos']) for group in results['sorted_groups']),
+    )
+
+
+def run_rows(source):
+    start = time.perf_counter()
+    election_data = source.fetch_all()
+    results = build_results(election_data)
+    return time.perf_counter() - start, election_data, results
+
+
+def run_pushdown(source):
+    start = time.perf_counter()
+    aggregated = source.fetch_aggregated(party_to_group_mapping())
+    results = finish_results(*aggregate_pushdown(aggregated))
+    return time.perf_counter() - start, aggregated, results
+
+
+def measure(label, source):
+    rows_time, election_data, rows_results = run_rows(source)
+    rows_scanned = source.bytes_processed
+    pushdown_time, aggregated, pushdown_results = run_pushdown(source)
+    pushdown_scanned = source.bytes_processed
+    # Same totals and mandates from every path before any timing is reported
+    assert as_plain(rows_results) == as_plain(pushdown_results), f"{label}: modes disagree"
+    # REFRESH_MODE 'incremental' loads the same rows: it must publish the same results
+    assert as_plain(IncrementalResults().load(election_data)) == as_plain(rows_results), \
+        f"{label}: full and incremental disagree"
+
+    for mode, seconds, frame, scanned in [
+        ('rows', rows_time, election_data, rows_scanned),
+        ('pushdown', pushdown_time, aggregated, pushdown_scanned)
+    ]:
+        scanned = f"{scanned:,}" if scanned is not None else '-'
+        print(f"{label:>22} | {mode:>8} | {seconds:>8.3f} | {len(frame):>10,} | {wire_bytes(frame):>12,} | {scanned:>12}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the 'rows' and 'pushdown' query modes")
+    parser.add_argument('--sweeps', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--formats', nargs='+', default=['duckdb', 'sqlite', 'parquet'])
+    parser.add_argument('--configured', action='store_true', help="measure DATA_SOURCE instead")
+    args = parser.parse_args()
+
+    print(f"{'source':>22} | {'mode':>8} | {'wall (s)':>8} | {'rows sent':>10} | {'bytes sent':>12} | {'bytes read':>12}")
+    print("-" * 89)
+    if args.configured:
+        source = make_source()
+        measure(source.name, source)
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        tables = [(f'{n_sweeps}', make_sweeps(n_sweeps), 'rows') for n_sweeps in args.sweeps]
+        tables.append(('ties', make_ties(), 'tied'))
+        for name, election_data, rows in tables:
+            for file_format in args.formats:
+                path = os.path.join(directory, f'{name}.{file_format}')
+                copy_to(election_data, path)
+                measure(f"{file_format} {len(election_data):,} {rows}", make_source(file_format, path))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from allocation import EXCLUDED_GROUPS
+from config import DISTRITOS, PARTIDOS
+from scenarios import VoteMatrix, evaluate_scenarios, merge_labels, party_merges
+from simulation import NATIONAL_KEY, simulate
+
+
+"""
+    Cenários por segundo: o motor em lote de scenarios.py contra um ciclo
+    de simulate() (um cenário de cada vez, com allocate_hondt).
+
+    Usa votos sintéticos com os distritos e partidos de config.py e os
+    cenários de todas as fusões de 2 ou 3 partidos; o ciclo só corre
+    sobre os primeiros --loop cenários e os resultados das duas versões
+    são comparados.
+
+    python benchmarks/bench_scenarios.py --sizes 2 3 --chunk-sizes 64 256 1024
+
+"""
+
+
+def make_matrix(seed=0):
+    """Random votes of every (district, party), 2 to 48 mandates per district"""
+    rng = np.random.default_rng(seed)
+    parties = list(PARTIDOS)
+    weights = rng.pareto(1.2, len(parties)) + 0.05
+    votes = (rng.poisson(weights * 20000, (len(DISTRITOS), len(parties)))).astype(np.int64)
+    seats = rng.integers(2, 49, len(DISTRITOS)).astype(np.int64)
+    return VoteMatrix(list(DISTRITOS), parties, votes, seats)
+
+
+def nested(matrix):
+    """The {district: {party: ...}} simulate() reads, with the mandates on the first party"""
+    return {
+        district: {
+            party: {'votos': int(matrix.votes[row, column]), 'mandatos': int(matrix.seats[row]) if column == 0 else 0}
+            for column, party in enumerate(matrix.parties)
+        }
+        for row, district in enumerate(matrix.districts)
+    }
+
+
+def run_loop(matrix, merges):
+    raw = nested(matrix)
+    start = time.perf_counter()
+    national = []
+    for merged in merges:
+        party_to_group = {party: merged[0] for party in merged}
+        national.append(simulate(raw, party_to_group)[NATIONAL_KEY])
+    return time.perf_counter() - start, national
+
+
+def run_batched(matrix, labels, chunk_size):
+    start = time.perf_counter()
+    national = [chunk.seats.sum(axis=1) for chunk in evaluate_scenarios(matrix, labels, chunk_size)]
+    return time.perf_counter() - start, np.concatenate(national)
+
+
+def check(matrix, merges, labels, loop_national, batched_national):
+    for row, merged in enumerate(merges[:len(loop_national)]):
+        expected = {name: data['mandatos'] for name, data in loop_national[row].items() if name not in EXCLUDED_GROUPS}
+        got = {
+            merged[0] if party in merged else party: int(batched_national[row, labels[row, column]])
+            for column, party in enumerate(matrix.parties)
+            if party not in EXCLUDED_GROUPS
+        }
+        assert expected == got, f"{merged}: {expected} != {got}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the batched scenario engine")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[2, 3], help="parties per merge")
+    parser.add_argument('--chunk-sizes', type=int, nargs='+', default=[64, 256, 1024])
+    parser.add_argument('--loop', type=int, default=500, help="scenarios run through simulate()")
+    args = parser.parse_args()
+
+    matrix = make_matrix()
+    merges = party_merges(matrix.parties, args.sizes)
+    labels = merge_labels(matrix.parties, merges)
+    print(f"{len(merges):,} scenarios x {len(matrix.districts)} districts x {len(matrix.parties)} parties, "
+          f"{int(matrix.seats.sum())} mandates\n")
+
+    loop_time, loop_national = run_loop(matrix, merges[:args.loop])
+    print(f"{'engine':>16} | {'scenarios':>9} | {'wall (s)':>8} | {'scenarios/s':>11}")
+    print("-" * 54)
+    print(f"{'simulate() loop':>16} | {len(loop_national):>9,} | {loop_time:>8.3f} | {len(loop_national) / loop_time:>11,.0f}")
+
+    for chunk_size in args.chunk_sizes:
+        batched_time, batched_national = run_batched(matrix, labels, chunk_size)
+        check(matrix, merges, labels, loop_national, batched_national)
+        label = f"batched {chunk_size}"
+        print(f"{label:>16} | {len(merges):>9,} | {batched_time:>8.3f} | {len(merges) / batched_time:>11,.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_scenarios import make_matrix
+from scenarios import merge_labels, national_seats, party_merges
+from sweeps import Sweeper
+
+
+"""
+    Escalamento dos varrimentos de cenários com o número de processos
+    (sweeps.py), contra o motor em lote num só processo.
+
+    Cada pool é aquecido com um primeiro varrimento, por isso os tempos não
+    incluem o arranque dos processos; incluem a cópia das matrizes para a
+    memória partilhada e a junção dos resultados.
+
+    python benchmarks/bench_sweeps.py --sizes 2 3 4 --workers 1 2 4 8
+
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the process pool sweeps")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[2, 3, 4], help="parties per merge")
+    parser.add_argument('--workers', type=int, nargs='+',
+                        default=sorted({1, 2, 4, os.cpu_count() or 1}))
+    parser.add_argument('--chunk-size', type=int, default=256)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    matrix = make_matrix()
+    labels = merge_labels(matrix.parties, party_merges(matrix.parties, args.sizes))
+    print(f"{len(labels):,} scenarios x {len(matrix.districts)} districts, {os.cpu_count()} CPUs\n")
+
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        expected = national_seats(matrix, labels, args.chunk_size)
+    single = (time.perf_counter() - start) / args.repeat
+
+    print(f"{'engine':>14} | {'wall (s)':>8} | {'scenarios/s':>11} | {'speedup':>7}")
+    print("-" * 50)
+    print(f"{'in-process':>14} | {single:>8.3f} | {len(labels) / single:>11,.0f} | {1:>7.2f}")
+
+    for workers in args.workers:
+        sweeper = Sweeper(workers)
+        try:
+            sweeper.national_seats(matrix, labels, args.chunk_size)  # starts the pool
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                national = sweeper.national_seats(matrix, labels, args.chunk_size)
+            elapsed = (time.perf_counter() - start) / args.repeat
+        finally:
+            sweeper.shutdown()
+        assert (national == expected).all(), f"{workers} workers: results differ"
+        label = f"{workers} workers"
+        print(f"{label:>14} | {elapsed:>8.3f} | {len(labels) / elapsed:>11,.0f} | {single / elapsed:>7.2f}")
+
+
+if __name__ == '__main__':
+    main()
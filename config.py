@@ -0,0 +1,131 @@
+import json
+import os
+
+
+"""
+    Configuração partilhada pela aplicação e pelos scripts auxiliares.
+
+"""
+
+# Configuração
+PROJECTO = "apps-448519"
+DATASET = "AR25"
+TABELA = "resultadosporcirculo"
+
+DISTRITOS = [
+    "Aveiro",
+    "Beja",
+    "Braga",
+    "Bragança",
+    "Castelo Branco",
+    "Coimbra",
+    "Évora",
+    "Faro",
+    "Guarda",
+    "Leiria",
+    "Lisboa",
+    "Portalegre",
+    "Porto",
+    "Santarém",
+    "Setúbal",
+    "Viana do Castelo",
+    "Vila Real",
+    "Viseu",
+    "Madeira",
+    "Açores",
+    "Europa",
+    "Resto do Mundo"
+]
+
+PARTIDOS = {
+    "Votos em branco": ['Votos em branco'],
+    "Votos nulos": ['Votos nulos'],
+    "PPD/PSD.CDS-PP": ['PPD+CDS+IL'],
+    "PS": ['PS'],
+    "CH": ['CH'],
+    "IL": ['PPD+CDS+IL'],
+    "L": ['L+BE+PCP+PAN'],
+    "B.E.": ['L+BE+PCP+PAN'],
+    "ADN": ['ADN'],
+    "PAN": ['L+BE+PCP+PAN'],
+    "PCP-PEV": ['L+BE+PCP+PAN'],
+    "PCTP/MRPP": ['PCTP/MRPP'],
+    "R.I.R.": ['R.I.R.'],
+    "VP": ['VP'],
+    "E": ['E'],
+    "ND": ['ND'],
+    "NC": ['NC'],
+    "PPM": ['PPM'],
+    "JPP": ['JPP'],
+    "PLS": ['PLS'],
+    "PTP": ['PTP'],
+    "MPT": ['MPT'],
+    "PPD/PSD.CDS-PP.PPM": ['PPD+CDS+IL']
+}
+
+# Where the rows come from (see datasource.py): 'bigquery', 'duckdb', 'sqlite',
+# 'parquet' or 'csv'; DATA_PATH is the file of the local sources
+DATA_SOURCE = os.environ.get('DATA_SOURCE', 'bigquery')
+DATA_PATH = os.environ.get('DATA_PATH', '')
+
+# 'rows': download the rows and aggregate them in Python; 'pushdown': the
+# query returns the latest (district, party) rows already aggregated (see pushdown.py)
+QUERY_MODE = os.environ.get('QUERY_MODE', 'rows')
+
+# Ingestion of the BigQuery rows: 'columnar' (pandas/NumPy) or 'rows' (iterrows loop)
+INGEST_MODE = os.environ.get('INGEST_MODE', 'columnar')
+
+# 'eager': load the results while importing main.py (blocks until BigQuery answers)
+# 'background': load in a thread of each worker; /_ah/health answers at once
+STARTUP_MODE = os.environ.get('STARTUP_MODE', 'eager')
+
+# Local snapshot of the results table (see snapshot_cache.py); /tmp is the
+# only writable directory on App Engine standard
+SNAPSHOT_CACHE = os.environ.get('SNAPSHOT_CACHE', '1') == '1'
+SNAPSHOT_DIR = os.environ.get('SNAPSHOT_DIR', '/tmp/ar25')
+SNAPSHOT_TTL = int(os.environ.get('SNAPSHOT_TTL', 3600))  # seconds
+SNAPSHOT_OFFLINE = os.environ.get('SNAPSHOT_OFFLINE', '0') == '1'
+
+# How the loaded results are brought up to date: 'incremental' (only rows
+# newer than the last timestamp, see incremental.py) or 'full'
+REFRESH_MODE = os.environ.get('REFRESH_MODE', 'incremental')
+REFRESH_SECONDS = int(os.environ.get('REFRESH_SECONDS', 60))  # 0 disables refreshing
+
+# LRU cache of coalition simulations (see simulation.py)
+SIMULATION_CACHE_ENTRIES = int(os.environ.get('SIMULATION_CACHE_ENTRIES', 256))
+SIMULATION_CACHE_BYTES = int(os.environ.get('SIMULATION_CACHE_BYTES', 32 * 1024 * 1024))
+
+# Process pool of the scenario sweeps (see sweeps.py); 'forkserver' keeps the
+# workers from forking a multi-threaded gunicorn worker
+SWEEP_WORKERS = int(os.environ.get('SWEEP_WORKERS', os.cpu_count() or 1))
+SWEEP_START_METHOD = os.environ.get('SWEEP_START_METHOD', 'forkserver')
+SWEEP_MAX_SCENARIOS = int(os.environ.get('SWEEP_MAX_SCENARIOS', 50000))  # per POST /api/sweep
+
+# Monte-Carlo projection from partial counts (see projection.py): draws per
+# projection and Dirichlet concentration of the uncounted votes
+PROJECTION_DRAWS = int(os.environ.get('PROJECTION_DRAWS', 10000))
+PROJECTION_CONCENTRATION = float(os.environ.get('PROJECTION_CONCENTRATION', 300))
+PROJECTION_CACHE_ENTRIES = int(os.environ.get('PROJECTION_CACHE_ENTRIES', 32))
+# Fixed magnitude of the districts, as JSON {district: mandates} (the official
+# map of the election): until a district is declared its 'mandatos' in the
+# data are incomplete or zero. A district left out takes the sum in its data
+PROJECTION_SEATS = json.loads(os.environ.get('PROJECTION_SEATS', '{}'))
+
+# Historical store of several elections (see history.py): one directory per
+# election with Arrow segments by snapshot time, opened on the first query.
+# HISTORY_CACHE_BYTES bounds the indexes of the open segments and
+# HISTORY_RESULTS_ENTRIES the "as of" results kept
+HISTORY_DIR = os.environ.get('HISTORY_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'historico'))
+HISTORY_CACHE_BYTES = int(os.environ.get('HISTORY_CACHE_BYTES', 64 * 1024 * 1024))
+HISTORY_RESULTS_ENTRIES = int(os.environ.get('HISTORY_RESULTS_ENTRIES', 64))
+
+# Server-Sent Events of /api/eventos (see events.py): a stream ends after
+# SSE_MAX_SECONDS and the browser reconnects; SSE_MAX_CLIENTS streams per
+# process, below the gunicorn threads so requests are always served; the
+# other clients get what they missed and reconnect after about
+# SSE_RETRY_SECONDS; SSE_EVENTS deltas kept for the clients that reconnect
+SSE_MAX_SECONDS = int(os.environ.get('SSE_MAX_SECONDS', 60))
+SSE_HEARTBEAT_SECONDS = int(os.environ.get('SSE_HEARTBEAT_SECONDS', 15))
+SSE_MAX_CLIENTS = int(os.environ.get('SSE_MAX_CLIENTS', 8))
+SSE_EVENTS = int(os.environ.get('SSE_EVENTS', 32))
+SSE_RETRY_SECONDS = int(os.environ.get('SSE_RETRY_SECONDS', 15))
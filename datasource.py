@@ -0,0 +1,387 @@
+import argparse
+import os
+import sqlite3
+import threading
+
+import pandas as pd
+
+try:
+    import duckdb
+except ImportError:  # Only needed for the 'duckdb' source
+    duckdb = None
+
+from config import PROJECTO, DATASET, TABELA, DATA_SOURCE, DATA_PATH
+from pushdown import aggregate_query
+from timing import phase
+
+
+"""
+    Origem das linhas da tabela resultadosporcirculo.
+
+    Todas as origens devolvem um DataFrame com as colunas e os tipos do
+    download do BigQuery (votos/mandatos Int64, timestamp em UTC), por isso
+    o resto da aplicação não sabe de onde vêm os dados. A origem escolhe-se
+    com DATA_SOURCE:
+
+    - 'bigquery': a tabela PROJECTO.DATASET.TABELA (por omissão)
+    - 'duckdb' / 'sqlite': a mesma tabela num ficheiro local, e.g. o que o
+      scraper grava com --writer duckdb / --writer sqlite
+    - 'parquet' / 'csv': um ficheiro com as linhas da tabela
+
+    DATA_PATH indica o ficheiro das origens locais. Assim a aplicação corre,
+    e pode ser medida, sem acesso ao GCP, ou serve de uma réplica local
+    quando o BigQuery está lento ou em baixo.
+
+    python datasource.py                      (linhas e último timestamp da origem)
+    python datasource.py --copy-to ar25.duckdb  (réplica local: .duckdb, .sqlite, .parquet ou .csv)
+
+"""
+
+COLUMNS = ['codigo', 'distrito', 'partido', 'votos', 'mandatos', 'timestamp']
+
+
+def normalise(election_data):
+    """Columns and dtypes of the BigQuery download, whatever the source"""
+    election_data = election_data[COLUMNS].copy()
+    for column in ['codigo', 'distrito', 'partido']:
+        election_data[column] = election_data[column].astype(object)
+    for column in ['votos', 'mandatos']:
+        election_data[column] = election_data[column].astype('Int64')
+    election_data['timestamp'] = pd.to_datetime(election_data['timestamp'], utc=True, format='mixed')
+    return election_data
+
+
+def normalise_aggregated(aggregated):
+    """Dtypes of the BigQuery download for the result of pushdown.aggregate_query()"""
+    aggregated = aggregated.copy()
+    for column in ['votos', 'mandatos', 'votos_grupo', 'votos_distrito', 'mandatos_distrito']:
+        aggregated[column] = aggregated[column].astype('Int64')
+    aggregated['timestamp'] = pd.to_datetime(aggregated['timestamp'], utc=True, format='mixed')
+    return aggregated
+
+
+def utc_naive(timestamp):
+    """A timestamp as naive UTC, for sources without time zones"""
+    timestamp = pd.Timestamp(timestamp)
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.tz_convert('UTC').tz_localize(None)
+    return timestamp.to_pydatetime()
+
+
+class DataSource:
+    """
+    Where the election rows come from.
+
+    Attributes:
+        name (str): shown in the logs and in /api/status
+        remote (bool): whether reads are worth caching locally (see snapshot_cache.py)
+        bytes_processed (int or None): bytes scanned by the last query, if the source reports it
+    """
+    name = None
+    remote = False
+    bytes_processed = None
+
+    def fetch_all(self, timings=None):
+        """
+        All the rows of the table.
+
+        Args:
+            timings (dict): optional, receives the 'query' and 'to_dataframe' times
+
+        Returns:
+            election_data (pd.DataFrame)
+        """
+        raise NotImplementedError
+
+    def fetch_since(self, since, timings=None):
+        """Only the rows with timestamp > since (the high-water mark)"""
+        raise NotImplementedError
+
+    def fetch_max_timestamp(self):
+        """MAX(timestamp) of the table, or None if it is empty"""
+        raise NotImplementedError
+
+    def fetch_aggregated(self, party_to_group, timings=None):
+        """
+        The latest (district, party) rows aggregated by the query itself.
+
+        Returns:
+            aggregated (pd.DataFrame): see pushdown.aggregate_query()
+        """
+        raise NotImplementedError
+
+    def describe(self):
+        return self.name
+
+
+class BigQuerySource(DataSource):
+    """The table in BigQuery, through one client per process"""
+    name = 'bigquery'
+    remote = True
+
+    def __init__(self, project=PROJECTO, dataset=DATASET, table=TABELA):
+        self.project = project
+        self.table_id = f'{project}.{dataset}.{table}'
+        self._client = None
+        self._lock = threading.Lock()
+
+    def describe(self):
+        return f'bigquery {self.table_id}'
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                from google.cloud import bigquery
+                self._client = bigquery.Client(project=self.project)
+            return self._client
+
+    def _query(self, query, timings=None, job_config=None):
+        with phase(timings, 'query'):
+            job = self.client.query(query, job_config=job_config)
+            job.result()  # Wait for the query itself
+        self.bytes_processed = job.total_bytes_processed
+        with phase(timings, 'to_dataframe'):
+            return job.to_dataframe()
+
+    def fetch_all(self, timings=None):
+        return self._query(f"""
+            SELECT codigo, distrito, partido, votos, mandatos, timestamp
+            FROM {self.table_id}
+        """, timings)
+
+    def fetch_since(self, since, timings=None):
+        from google.cloud import bigquery
+        job_config = bigquery.QueryJobConfig(query_parameters=[
+            bigquery.ScalarQueryParameter('since', 'TIMESTAMP', since)
+        ])
+        return self._query(f"""
+            SELECT codigo, distrito, partido, votos, mandatos, timestamp
+            FROM {self.table_id}
+            WHERE timestamp > @since
+        """, timings, job_config)
+
+    def fetch_max_timestamp(self):
+        for row in self.client.query(f"SELECT MAX(timestamp) AS timestamp FROM {self.table_id}").result():
+            return row['timestamp']
+        return None
+
+    def fetch_aggregated(self, party_to_group, timings=None):
+        return self._query(aggregate_query(self.table_id, party_to_group), timings)
+
+
+class DuckDBSource(DataSource):
+    """The table in a local DuckDB file, opened read-only for each query"""
+    name = 'duckdb'
+
+    def __init__(self, path, table=TABELA):
+        if duckdb is None:
+            raise RuntimeError("DATA_SOURCE 'duckdb' needs the duckdb package")
+        self.path = path
+        self.table = table
+
+    def describe(self):
+        return f'duckdb {self.path}'
+
+    def _query(self, query, parameters=(), timings=None):
+        # Read-only, so the scraper can keep appending between refreshes
+        con = duckdb.connect(self.path, read_only=True)
+        try:
+            with phase(timings, 'query'):
+                result = con.execute(query, list(parameters))
+            with phase(timings, 'to_dataframe'):
+                return result.df()
+        finally:
+            con.close()
+
+    def fetch_all(self, timings=None):
+        return normalise(self._query(f"SELECT {', '.join(COLUMNS)} FROM {self.table}", timings=timings))
+
+    def fetch_since(self, since, timings=None):
+        return normalise(self._query(
+            f"SELECT {', '.join(COLUMNS)} FROM {self.table} WHERE timestamp > ?",
+            [utc_naive(since)], timings
+        ))
+
+    def fetch_max_timestamp(self):
+        timestamp = self._query(f"SELECT MAX(timestamp) AS timestamp FROM {self.table}")['timestamp'][0]
+        return None if pd.isna(timestamp) else pd.Timestamp(timestamp, tz='UTC')
+
+    def fetch_aggregated(self, party_to_group, timings=None):
+        return normalise_aggregated(self._query(
+            aggregate_query(self.table, party_to_group, position='rowid'), timings=timings
+        ))
+
+
+class SQLiteSource(DataSource):
+    """The table in a local SQLite file (timestamps stored as UTC text)"""
+    name = 'sqlite'
+
+    def __init__(self, path, table=TABELA):
+        self.path = path
+        self.table = table
+
+    def describe(self):
+        return f'sqlite {self.path}'
+
+    def _query(self, query, parameters=(), timings=None):
+        con = sqlite3.connect(f'file:{self.path}?mode=ro', uri=True)
+        try:
+            with phase(timings, 'query'):
+                cursor = con.execute(query, list(parameters))
+                rows = cursor.fetchall()
+            with phase(timings, 'to_dataframe'):
+                return pd.DataFrame(rows, columns=[column[0] for column in cursor.description])
+        finally:
+            con.close()
+
+    def fetch_all(self, timings=None):
+        return normalise(self._query(f"SELECT {', '.join(COLUMNS)} FROM {self.table}", timings=timings))
+
+    def fetch_since(self, since, timings=None):
+        # julianday() compares the text timestamps whatever their precision
+        return normalise(self._query(
+            f"SELECT {', '.join(COLUMNS)} FROM {self.table} WHERE julianday(timestamp) > julianday(?)",
+            [utc_naive(since).isoformat(sep=' ')], timings
+        ))
+
+    def fetch_max_timestamp(self):
+        con = sqlite3.connect(f'file:{self.path}?mode=ro', uri=True)
+        try:
+            (timestamp,) = con.execute(
+                f"SELECT timestamp FROM {self.table} ORDER BY julianday(timestamp) DESC LIMIT 1"
+            ).fetchone() or (None,)
+        finally:
+            con.close()
+        return None if timestamp is None else pd.Timestamp(timestamp, tz='UTC')
+
+    def fetch_aggregated(self, party_to_group, timings=None):
+        return normalise_aggregated(self._query(
+            aggregate_query(self.table, party_to_group, timestamp_order='julianday(timestamp)', position='rowid'),
+            timings=timings
+        ))
+
+
+class FileSource(DataSource):
+    """
+    The rows in a Parquet or CSV file, read again on each fetch.
+
+    Args:
+        file_format (str): 'parquet' or 'csv'
+    """
+
+    def __init__(self, path, file_format):
+        self.path = path
+        self.name = file_format
+
+    def describe(self):
+        return f'{self.name} {self.path}'
+
+    def _read(self, timings=None):
+        with phase(timings, 'query'):
+            if self.name == 'parquet':
+                election_data = pd.read_parquet(self.path)
+            else:
+                election_data = pd.read_csv(self.path)
+        with phase(timings, 'to_dataframe'):
+            return normalise(election_data)
+
+    def fetch_all(self, timings=None):
+        return self._read(timings)
+
+    def fetch_since(self, since, timings=None):
+        election_data = self._read(timings)
+        return election_data[election_data['timestamp'] > pd.Timestamp(since)].reset_index(drop=True)
+
+    def fetch_max_timestamp(self):
+        timestamp = self._read()['timestamp'].max()
+        return None if pd.isna(timestamp) else timestamp
+
+    def fetch_aggregated(self, party_to_group, timings=None):
+        # The file is queried in place by DuckDB
+        if duckdb is None:
+            raise RuntimeError("QUERY_MODE 'pushdown' on a parquet/csv file needs the duckdb package")
+        # Numbered rows, so the order is the one the 'rows' mode reads
+        if self.name == 'parquet':
+            table = f"read_parquet('{self.path}', file_row_number = true)"
+        else:
+            table = (f"(SELECT *, ROW_NUMBER() OVER () AS file_row_number "
+                     f"FROM read_csv_auto('{self.path}', parallel = false)) AS rows")
+        con = duckdb.connect()
+        try:
+            with phase(timings, 'query'):
+                result = con.execute(aggregate_query(table, party_to_group, position='file_row_number'))
+            with phase(timings, 'to_dataframe'):
+                return normalise_aggregated(result.df())
+        finally:
+            con.close()
+
+
+DATA_SOURCES = ['bigquery', 'duckdb', 'sqlite', 'parquet', 'csv']
+
+
+def make_source(kind=DATA_SOURCE, path=DATA_PATH, dataset=DATASET):
+    """
+    Args:
+        kind (str): one of DATA_SOURCES
+        path (str): file of the local sources (default: <dataset>.<kind>, or
+                    <TABELA>.<kind> for parquet/csv)
+        dataset (str): the election, e.g. 'AR24' (BigQuery dataset)
+    """
+    if kind == 'bigquery':
+        return BigQuerySource(dataset=dataset)
+    if kind == 'duckdb':
+        return DuckDBSource(path or f'{dataset}.duckdb')
+    if kind == 'sqlite':
+        return SQLiteSource(path or f'{dataset}.sqlite')
+    if kind in ('parquet', 'csv'):
+        return FileSource(path or f'{TABELA}.{kind}', kind)
+    raise ValueError(f"unknown DATA_SOURCE: {kind!r} (expected one of {DATA_SOURCES})")
+
+
+def copy_to(election_data, path, table=TABELA):
+    """Writes the rows to a local replica; the format comes from the extension"""
+    extension = os.path.splitext(path)[1].lstrip('.')
+    if extension in ('duckdb', 'sqlite'):
+        election_data = election_data.assign(timestamp=election_data['timestamp'].dt.tz_convert(None))
+    if extension == 'parquet':
+        election_data.to_parquet(path, index=False)
+    elif extension == 'csv':
+        election_data.to_csv(path, index=False)
+    elif extension == 'duckdb':
+        if duckdb is None:
+            raise RuntimeError("copying to .duckdb needs the duckdb package")
+        con = duckdb.connect(path)
+        try:
+            con.register('election_data', election_data)
+            con.execute(f"CREATE OR REPLACE TABLE {table} AS SELECT * FROM election_data")
+        finally:
+            con.close()
+    elif extension == 'sqlite':
+        election_data = election_data.assign(timestamp=election_data['timestamp'].dt.strftime('%Y-%m-%d %H:%M:%S.%f'))
+        con = sqlite3.connect(path)
+        try:
+            election_data.to_sql(table, con, if_exists='replace', index=False)
+        finally:
+            con.close()
+    else:
+        raise ValueError(f"unknown replica format: {path!r}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rows of the configured data source (DATA_SOURCE)")
+    parser.add_argument('--copy-to', help="write a local replica (.duckdb, .sqlite, .parquet or .csv)")
+    args = parser.parse_args()
+
+    source = make_source()
+    timings = {}
+    election_data = source.fetch_all(timings)
+    print(f"{source.describe()}: {len(election_data)} rows, last timestamp {source.fetch_max_timestamp()}")
+    print(', '.join(f"{name} {seconds:.2f} s" for name, seconds in timings.items()))
+    if args.copy_to:
+        copy_to(election_data, args.copy_to)
+        print(f"Copied to {args.copy_to}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,211 @@
+import json
+import random
+import threading
+import time
+from collections import deque
+
+from config import SSE_MAX_SECONDS, SSE_HEARTBEAT_SECONDS, SSE_MAX_CLIENTS, SSE_EVENTS, SSE_RETRY_SECONDS
+from payload import PayloadCache, json_default
+
+
+"""
+    Actualizações em directo por Server-Sent Events (/api/eventos).
+
+    Em vez de cada leitor recarregar / (a página e os dados de todos os
+    distritos), quando o loader publica um snapshot novo o servidor envia
+    só os distritos cujos votos ou mandatos mudaram e os totais nacionais.
+    O delta é calculado e serializado uma única vez por troca, no listener
+    de loader.on_publish, e todos os streams abertos do processo recebem os
+    mesmos bytes (um Condition acorda-os); nenhum leitor faz consultas.
+
+    Cada evento tem como id a versão dos dados e indica a versão de que
+    parte ("anterior"). Os últimos SSE_EVENTS ficam guardados, por isso um
+    browser que volta a ligar com Last-Event-ID recebe o que perdeu; se a
+    versão que tem já não está guardada (ou é de outro worker) recebe um
+    evento "reset" com todos os distritos, gerado uma vez por versão.
+
+    Um stream dura no máximo SSE_MAX_SECONDS (o EventSource volta a ligar
+    sozinho). Cada stream aberto ocupa uma thread do gunicorn até acabar,
+    por isso cada processo só mantém SSE_MAX_CLIENTS abertos, abaixo das
+    threads, e os pedidos normais são sempre servidos. Os outros leitores
+    não recebem um erro (um 503 fecha o EventSource de vez): recebem logo
+    o que lhes falta e um "retry:" de cerca de SSE_RETRY_SECONDS, e a
+    resposta acaba; o browser volta a ligar sozinho, ou seja, passam a
+    fazer polling barato, só com bytes já serializados. O lugar é ocupado
+    e libertado dentro do gerador, por isso uma resposta que nunca é lida
+    (um HEAD) não fica com ele.
+
+    Atrás de um proxy que junta a resposta inteira antes de a enviar, os
+    eventos chegam no fim de cada stream, no máximo SSE_MAX_SECONDS depois.
+
+"""
+
+
+def changed_districts(previous, current):
+    """
+    Args:
+        previous (DistrictResultsView or None): results before the swap
+        current (DistrictResultsView): results after it
+
+    Returns:
+        changed (dict): {district: {name: {'votos', 'mandatos'}}} of the
+                        districts of current that are new or differ
+    """
+    return {
+        district: current[district]
+        for district in current
+        if previous is None or district not in previous or previous[district] != current[district]
+    }
+
+
+def delta_document(previous, snapshot):
+    """
+    The districts that changed since the previous snapshot and the national totals.
+
+    Args:
+        previous (Snapshot or None): None for every district
+        snapshot (Snapshot)
+    """
+    results = snapshot.results
+    before = previous.results if previous is not None else {}
+    return {
+        'version': snapshot.version,
+        'anterior': previous.version if previous is not None else None,
+        'votos': changed_districts(before.get('raw_district_results'), results['raw_district_results']),
+        'votos_colig': changed_districts(before.get('grouped_district_results'), results['grouped_district_results']),
+        'partidos': results['sorted_parties'],
+        'grupos': results['sorted_groups'],
+        'votos_brancos': results['blank_votes'],
+        'votos_nulos': results['null_votes'],
+        'total_votos': results['total_votes'],
+        'total_mandatos': results['total_mandates']
+    }
+
+
+def encode_event(event, version, document):
+    """One SSE message, with the version as its id"""
+    data = json.dumps(document, ensure_ascii=False, separators=(',', ':'), default=json_default)
+    return f'id: {version}\nevent: {event}\ndata: {data}\n\n'.encode('utf-8')
+
+
+class Broadcaster:
+    """
+    Fan-out of the snapshot deltas to every open stream of this process.
+
+    Args:
+        max_events (int): deltas kept for clients that reconnect
+        max_clients (int): open streams allowed
+    """
+
+    def __init__(self, max_events=SSE_EVENTS, max_clients=SSE_MAX_CLIENTS, retry_seconds=SSE_RETRY_SECONDS):
+        self.max_clients = max_clients
+        self.retry_seconds = retry_seconds
+        self.clients = 0
+        self.catch_ups = 0
+        self._events = deque(maxlen=max_events)  # (anterior, version, bytes)
+        self._snapshot = None
+        self._condition = threading.Condition()
+        self._resets = PayloadCache(lambda snapshot: encode_event(
+            'reset', snapshot.version, delta_document(None, snapshot)
+        ))
+
+    def publish(self, snapshot):
+        """loader.on_publish listener: one delta, encoded once, for every stream"""
+        previous = self._snapshot
+        event = None
+        if previous is not None and previous.version != snapshot.version:
+            event = encode_event('delta', snapshot.version, delta_document(previous, snapshot))
+        with self._condition:
+            self._snapshot = snapshot
+            if event is not None:
+                self._events.append((previous.version, snapshot.version, event))
+            self._condition.notify_all()
+
+    def _pending(self, version):
+        """Events after version: [] if it is current, None if it is not kept"""
+        if self._snapshot is None or version == self._snapshot.version:
+            return []
+        for index, (anterior, _, _) in enumerate(self._events):
+            if anterior == version:
+                return list(self._events)[index:]
+        return None
+
+    def _acquire(self):
+        """Takes a stream slot; False when the process already has max_clients"""
+        with self._condition:
+            if self.clients >= self.max_clients:
+                self.catch_ups += 1
+                return False
+            self.clients += 1
+            return True
+
+    def _release(self):
+        with self._condition:
+            self.clients -= 1
+
+    def _next(self, version, timeout):
+        """
+        The events after version, waiting up to timeout seconds for one.
+
+        Returns:
+            events (list): SSE bytes, [] if nothing came
+            version (str or None): the version the client has after them
+        """
+        with self._condition:
+            pending = self._pending(version)
+            if pending == [] and timeout > 0:
+                self._condition.wait(timeout)
+                pending = self._pending(version)
+            snapshot = self._snapshot
+
+        if pending is None:
+            return [self._resets.get(snapshot)], snapshot.version
+        if pending:
+            return [event for _, _, event in pending], pending[-1][1]
+        return [], version
+
+    def stream(self, version, max_seconds=SSE_MAX_SECONDS, heartbeat=SSE_HEARTBEAT_SECONDS):
+        """
+        The events of one client, as SSE bytes.
+
+        The slot is taken on the first iteration and released when the
+        generator ends or is closed, so a response that is never iterated
+        holds nothing. Without a free slot the client gets what it missed
+        and a retry interval, and the stream ends at once.
+
+        Args:
+            version (str or None): version of the data the client has
+            max_seconds (float): the stream ends after this (the browser reconnects)
+            heartbeat (float): idle seconds between comments that keep the connection open
+        """
+        if not self._acquire():
+            events, _ = self._next(version, 0)
+            yield from events
+            # Spread the reconnections of the clients turned away together
+            retry = self.retry_seconds * random.uniform(0.5, 1.5)
+            yield f'retry: {int(retry * 1000)}\n\n'.encode('ascii')
+            return
+
+        deadline = time.monotonic() + max_seconds
+        try:
+            # Back to the usual reconnection delay, after a catch-up set a long one
+            yield b'retry: 3000\n\n'
+            while True:
+                events, version = self._next(version, max(0, min(heartbeat, deadline - time.monotonic())))
+                if events:
+                    yield from events
+                else:
+                    yield b': ping\n\n'
+                if time.monotonic() >= deadline:
+                    return
+        finally:
+            self._release()
+
+    def stats(self):
+        snapshot = self._snapshot
+        return {
+            'clients': self.clients,
+            'catch_ups': self.catch_ups,
+            'events': len(self._events),
+            'version': snapshot.version if snapshot is not None else None
+        }
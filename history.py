@@ -0,0 +1,441 @@
+import argparse
+import glob
+import os
+import re
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from config import DATA_SOURCE, HISTORY_DIR, HISTORY_CACHE_BYTES
+from datasource import COLUMNS, make_source, normalise
+from incremental import KEY_COLUMNS
+from lru import LRUCache
+from results import build_results, print_results
+from snapshot_cache import TIMESTAMP_FORMAT
+
+
+"""
+    Arquivo histórico de várias eleições (AR22, AR24, AR25, ...) e
+    consultas "tal como estava" em qualquer momento da contagem.
+
+    Cada eleição é uma pasta de HISTORY_DIR com segmentos Arrow IPC, um por
+    importação, com o intervalo de tempo no nome, e.g.
+    historico/AR25/20250518T200000-20250518T233000.arrow. Uma importação
+    só acrescenta as linhas mais novas do que as já guardadas, por isso os
+    segmentos não se sobrepõem no tempo; --compact junta-os num só.
+
+    Dentro de cada segmento as linhas estão ordenadas por (distrito,
+    codigo, partido, timestamp), com os nomes em dicionário, e o índice
+    guarda o início de cada (distrito, codigo, partido) e os timestamps
+    distintos (as passagens do scraper). Os resultados num momento t são a
+    última linha de cada (codigo, partido) com timestamp <= t: uma procura
+    binária por chave em cada segmento que começa antes de t, sem percorrer
+    as linhas. Os segmentos que começam depois de t nem são abertos.
+
+    Nada é lido no arranque: um segmento é aberto (memory-mapped) e
+    indexado na primeira consulta que precisa dele, e os índices abertos
+    ficam num cache LRU limitado a HISTORY_CACHE_BYTES, por isso a memória
+    não cresce com o número de eleições guardadas.
+
+    python history.py                                  (eleições e segmentos guardados)
+    python history.py --import AR24                    (linhas novas da tabela AR24 na origem DATA_SOURCE)
+    python history.py --import AR22 --path ar22.parquet  (de um ficheiro .duckdb, .sqlite, .parquet ou .csv)
+    python history.py --compact AR25                   (junta os segmentos da eleição num só)
+    python history.py --as-of AR25 "2025-05-18 21:30"  (resultados nesse momento, em UTC)
+
+"""
+
+SEGMENT_PATTERN = re.compile(r'^(\d{8}T\d{6})-(\d{8}T\d{6})\.arrow$')
+
+ELECTION_PATTERN = re.compile(r'^[A-Za-z0-9_-]+$')
+
+# A segment of an election: its file and the first/last timestamps (to the second) of its rows
+SegmentFile = namedtuple('SegmentFile', ['path', 'first', 'last'])
+
+# A resolved "as of" query: the last timestamp stored up to the time asked,
+# and the segments that hold its rows. Also the cache key of its results
+AsOf = namedtuple('AsOf', ['election', 'timestamp', 'district', 'segments'])
+
+
+class HistoryError(ValueError):
+    """A query the historical store cannot answer"""
+
+
+class UnknownElection(HistoryError):
+    """The election has no segments in the store"""
+
+
+def parse_timestamp(text):
+    """
+    A timestamp given by the client (ISO 8601; UTC when it has no zone).
+
+    Returns:
+        timestamp (pd.Timestamp or None): None if text is empty
+    """
+    if not text:
+        return None
+    try:
+        timestamp = pd.Timestamp(text)
+    except ValueError:
+        raise HistoryError(f"invalid timestamp: {text!r}")
+    if timestamp is pd.NaT:
+        raise HistoryError(f"invalid timestamp: {text!r}")
+    return timestamp.tz_localize('UTC') if timestamp.tzinfo is None else timestamp.tz_convert('UTC')
+
+
+def segment_files(directory):
+    """The segments of one election, oldest first"""
+    segments = []
+    for path in glob.glob(os.path.join(directory, '*.arrow')):
+        match = SEGMENT_PATTERN.match(os.path.basename(path))
+        if match:
+            first, last = (pd.to_datetime(value, format=TIMESTAMP_FORMAT, utc=True) for value in match.groups())
+            segments.append(SegmentFile(path, first, last))
+    return sorted(segments, key=lambda segment: (segment.first, segment.last))
+
+
+def _codes(table, column):
+    """Dictionary indices (np.ndarray) and values (list) of a dictionary column"""
+    array = table.column(column).combine_chunks()
+    return array.indices.to_numpy(zero_copy_only=False).astype(np.int64), array.dictionary.to_pylist()
+
+
+def to_frame(table):
+    """
+    Rows of a segment as a DataFrame with the dtypes of datasource.normalise()
+
+    The names are decoded in Arrow; nothing is parsed again.
+    """
+    for column in ('codigo', 'distrito', 'partido'):
+        table = table.set_column(table.schema.get_field_index(column), column,
+                                 table.column(column).cast(pa.string()))
+    return table.to_pandas(types_mapper={pa.int64(): pd.Int64Dtype()}.get)
+
+
+class Segment:
+    """
+    One memory-mapped segment and its index.
+
+    Attributes:
+        path (str)
+        table (pa.Table): the rows, sorted by (distrito, codigo, partido, timestamp)
+        times (np.ndarray): distinct timestamps of the rows (int64 ns), sorted
+        starts (np.ndarray): first row of each (distrito, codigo, partido) run
+        run_districts (np.ndarray): district code of each run (sorted)
+        positions (np.ndarray): run x len(times) + rank of the timestamp of each
+            row; increasing, so one binary search finds the last row of a run
+            up to a time
+        district_codes (dict): {district: code}
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with pa.memory_map(path, 'r') as source:
+            self.table = pa.ipc.open_file(source).read_all()
+
+        districts, names = _codes(self.table, 'distrito')
+        codes, _ = _codes(self.table, 'codigo')
+        parties, _ = _codes(self.table, 'partido')
+        timestamps = self.table.column('timestamp').cast(pa.timestamp('ns', tz='UTC')).cast(pa.int64()).to_numpy()
+
+        new_run = np.ones(len(timestamps), dtype=bool)
+        new_run[1:] = (np.diff(districts) != 0) | (np.diff(codes) != 0) | (np.diff(parties) != 0)
+        self.starts = np.flatnonzero(new_run)
+        self.run_districts = districts[self.starts]
+        self.times = np.unique(timestamps)
+        self.positions = (np.cumsum(new_run) - 1) * len(self.times) + np.searchsorted(self.times, timestamps)
+        self.district_codes = {name: code for code, name in enumerate(names)}
+
+    @property
+    def nbytes(self):
+        """Memory of the index (the rows stay in the memory map)"""
+        return sum(array.nbytes for array in (self.times, self.starts, self.run_districts, self.positions))
+
+    def last_time(self, timestamp):
+        """Largest timestamp (int64 ns) of the segment up to timestamp, or None"""
+        rank = np.searchsorted(self.times, timestamp, side='right') - 1
+        return int(self.times[rank]) if rank >= 0 else None
+
+    def rows_as_of(self, timestamp, district=None):
+        """
+        Row of the latest state of each (distrito, codigo, partido) up to a time.
+
+        Args:
+            timestamp (int): int64 ns, UTC
+            district (str or None): only the rows of this district
+
+        Returns:
+            rows (np.ndarray): row indices, O(runs x log rows) to find
+        """
+        rank = np.searchsorted(self.times, timestamp, side='right') - 1
+        runs = np.arange(len(self.starts))
+        if district is not None:
+            code = self.district_codes.get(district)
+            if code is None:
+                return np.empty(0, dtype=np.int64)
+            runs = runs[np.searchsorted(self.run_districts, code):np.searchsorted(self.run_districts, code, 'right')]
+        if rank < 0:
+            return np.empty(0, dtype=np.int64)
+        last = np.searchsorted(self.positions, runs * len(self.times) + rank, side='right') - 1
+        return last[last >= self.starts[runs]]
+
+
+def write_segment(election_data, directory):
+    """
+    Writes rows as a new segment (atomically).
+
+    Args:
+        election_data (pd.DataFrame): the columns of datasource.COLUMNS and
+            'linha', the position of each row in the election table
+
+    Returns:
+        path (str): the segment file
+    """
+    os.makedirs(directory, exist_ok=True)
+    frame = election_data.copy()
+    for column in ('distrito', 'codigo', 'partido'):
+        frame[column] = frame[column].astype('category')  # sorted dictionaries
+    frame = frame.sort_values(['distrito', 'codigo', 'partido', 'timestamp'], kind='stable')
+
+    first, last = (pd.Timestamp(value).strftime(TIMESTAMP_FORMAT) for value in
+                   (frame['timestamp'].min(), frame['timestamp'].max()))
+    path = os.path.join(directory, f'{first}-{last}.arrow')
+    if os.path.exists(path):
+        raise FileExistsError(f"segment already stored: {path}")
+
+    table = pa.Table.from_pandas(frame, preserve_index=False)
+    temporary_path = f'{path}.{os.getpid()}.tmp'
+    with pa.OSFile(temporary_path, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(temporary_path, path)
+    return path
+
+
+class HistoryStore:
+    """
+    Partitioned store of the results tables of several elections.
+
+    Only the directory is listed on each query; segments are opened and
+    indexed on first use and kept in an LRU cache.
+
+    Args:
+        directory (str): one subdirectory per election
+        max_bytes (int): memory of the open segment indexes
+    """
+
+    def __init__(self, directory=HISTORY_DIR, max_bytes=HISTORY_CACHE_BYTES):
+        self.directory = directory
+        self.segments = LRUCache(1024, max_bytes, lambda segment: segment.nbytes)
+
+    def elections(self):
+        """{election: [SegmentFile]}, without opening any segment"""
+        if not os.path.isdir(self.directory):
+            return {}
+        elections = {}
+        for election in sorted(os.listdir(self.directory)):
+            segments = segment_files(os.path.join(self.directory, election))
+            if segments and ELECTION_PATTERN.match(election):
+                elections[election] = segments
+        return elections
+
+    def describe(self):
+        """{election: {'segmentos', 'inicio', 'fim'}}, for the API"""
+        return {
+            election: {
+                'segmentos': len(segments),
+                'inicio': segments[0].first.isoformat(),
+                'fim': max(segment.last for segment in segments).isoformat()
+            }
+            for election, segments in self.elections().items()
+        }
+
+    def _segment_files(self, election):
+        if not ELECTION_PATTERN.match(election or ''):
+            raise UnknownElection(f"unknown election: {election!r}")
+        segments = segment_files(os.path.join(self.directory, election))
+        if not segments:
+            raise UnknownElection(f"unknown election: {election!r}")
+        return segments
+
+    def segment(self, path):
+        """The Segment of a file, opened on first use"""
+        return self.segments.get_or_compute(path, lambda: Segment(path))[0]
+
+    def passes(self, election):
+        """Distinct timestamps of an election (the scraper passes), as pd.Timestamps"""
+        times = [self.segment(segment.path).times for segment in self._segment_files(election)]
+        return [pd.Timestamp(value, tz='UTC') for value in np.unique(np.concatenate(times))]
+
+    def as_of(self, election, timestamp=None, district=None):
+        """
+        Resolves a query to the last timestamp stored up to the time asked.
+
+        Args:
+            election (str): e.g. 'AR24'
+            timestamp (pd.Timestamp or None): UTC; None for the last count
+            district (str or None): only one district
+
+        Returns:
+            as_of (AsOf)
+
+        Raises:
+            UnknownElection, HistoryError: nothing stored up to that time
+        """
+        limit = np.iinfo(np.int64).max if timestamp is None else timestamp.value
+        used, resolved = [], None
+        for segment in self._segment_files(election):
+            # A segment that starts later has no rows up to the time: not opened
+            if timestamp is not None and segment.first > timestamp:
+                break
+            last = self.segment(segment.path).last_time(limit)
+            if last is not None:
+                used.append(segment.path)
+                resolved = last if resolved is None else max(resolved, last)
+        if resolved is None:
+            raise HistoryError(f"{election} has no results up to {timestamp}")
+        return AsOf(election, pd.Timestamp(resolved, tz='UTC'), district, tuple(used))
+
+    def latest_rows(self, as_of):
+        """
+        The latest row of each (codigo, partido) up to as_of.timestamp.
+
+        Returns:
+            election_data (pd.DataFrame): as incremental.latest_rows() on the
+                rows stored up to that time, in the order of the table
+        """
+        tables = []
+        for path in as_of.segments:
+            segment = self.segment(path)
+            tables.append(segment.table.take(pa.array(segment.rows_as_of(as_of.timestamp.value, as_of.district))))
+        if sum(table.num_rows for table in tables) == 0:
+            raise HistoryError(f"{as_of.election} has no results for {as_of.district!r}")
+        if len(tables) == 1:
+            return to_frame(tables[0].sort_by('linha').select(COLUMNS))
+
+        # Segments are in time order: a later segment has the newer row of a key
+        election_data = pd.concat([to_frame(table) for table in tables], ignore_index=True)
+        election_data = election_data.drop_duplicates(KEY_COLUMNS, keep='last').sort_values('linha')
+        return election_data[COLUMNS].reset_index(drop=True)
+
+    def results(self, as_of):
+        """Results as of a time (see results.build_results)"""
+        return build_results(self.latest_rows(as_of))
+
+    def read_all(self, election):
+        """Every row stored for an election, in the order of the table, with 'linha'"""
+        frames = [to_frame(self.segment(segment.path).table) for segment in self._segment_files(election)]
+        return pd.concat(frames, ignore_index=True).sort_values('linha').reset_index(drop=True)
+
+    def import_rows(self, election, source):
+        """
+        Appends the rows of the source newer than the ones stored.
+
+        Args:
+            election (str)
+            source (datasource.DataSource): the results table of the election
+
+        Returns:
+            path (str or None): the new segment, None if there was nothing new
+        """
+        if not ELECTION_PATTERN.match(election):
+            raise HistoryError(f"invalid election name: {election!r}")
+        try:
+            segments = self._segment_files(election)
+        except UnknownElection:
+            segments = []
+
+        if segments:
+            stored = [self.segment(segment.path) for segment in segments]
+            since = pd.Timestamp(max(segment.times[-1] for segment in stored), tz='UTC')
+            election_data = source.fetch_since(since)
+            first_row = sum(segment.table.num_rows for segment in stored)
+        else:
+            election_data = source.fetch_all()
+            first_row = 0
+        if election_data.empty:
+            return None
+
+        election_data = normalise(election_data)
+        election_data['linha'] = np.arange(first_row, first_row + len(election_data))
+        return write_segment(election_data, os.path.join(self.directory, election))
+
+    def compact(self, election):
+        """
+        Rewrites the segments of an election as one.
+
+        Returns:
+            path (str or None): the new segment, None if there was only one
+        """
+        segments = self._segment_files(election)
+        if len(segments) < 2:
+            return None
+        election_data = self.read_all(election)
+        directory = os.path.join(self.directory, election)
+        temporary = os.path.join(directory, f'.compact-{os.getpid()}')
+        path = write_segment(election_data, temporary)
+        final_path = os.path.join(directory, os.path.basename(path))
+        # A query between the two steps sees the same rows twice, which
+        # latest_rows() drops, never a missing segment
+        os.replace(path, final_path)
+        os.rmdir(temporary)
+        for segment in segments:
+            if segment.path != final_path:
+                os.remove(segment.path)
+        self.segments.clear()
+        return final_path
+
+
+def results_document(as_of, results):
+    """The JSON of /api/historico/<eleicao>"""
+    return {
+        'eleicao': as_of.election,
+        'em': as_of.timestamp.isoformat(),
+        'distrito': as_of.district,
+        'votos': results['raw_district_results'],
+        'votos_colig': results['grouped_district_results'],
+        'partidos': results['sorted_parties'],
+        'grupos': results['sorted_groups'],
+        'total_votos': results['total_votes'],
+        'total_mandatos': results['total_mandates']
+    }
+
+
+def source_for(election, path=None):
+    """The results table of an election: DATA_SOURCE, or a local file by its extension"""
+    if not path:
+        return make_source(DATA_SOURCE, '', dataset=election)
+    return make_source(os.path.splitext(path)[1].lstrip('.'), path, dataset=election)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Historical store of several elections")
+    parser.add_argument('--import', dest='election', help="append the new rows of an election, e.g. AR24")
+    parser.add_argument('--path', help="read the election from a local file instead of DATA_SOURCE")
+    parser.add_argument('--compact', help="merge the segments of an election")
+    parser.add_argument('--as-of', nargs='+', metavar=('ELECTION', 'TIMESTAMP'),
+                        help="print the results of an election at a time (default: the last count)")
+    args = parser.parse_args()
+
+    store = HistoryStore()
+    if args.election:
+        path = store.import_rows(args.election, source_for(args.election, args.path))
+        print(path or f"{args.election}: nothing new")
+    if args.compact:
+        print(store.compact(args.compact) or f"{args.compact}: nothing to compact")
+    if args.as_of:
+        as_of = store.as_of(args.as_of[0], parse_timestamp(' '.join(args.as_of[1:])))
+        print(f"{as_of.election} as of {as_of.timestamp}")
+        print_results(store.results(as_of))
+        return
+
+    for election, segments in store.elections().items():
+        print(f"{election}: {len(segments)} segments, {segments[0].first} to {segments[-1].last}")
+        for segment in segments:
+            print(f"    {os.path.basename(segment.path)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+import numpy as np
+import pandas as pd
+
+from results import KEY_COLUMNS, aggregate_districts, finish_results, latest_rows
+from timing import phase
+from totals import ElectionTotals
+
+
+"""
+    Actualização incremental dos resultados.
+
+    O scraper acrescenta à tabela uma cópia de todos os distritos a cada
+    passagem. Aqui guarda-se apenas a linha mais recente de cada
+    (codigo, partido) e o maior timestamp já visto (high-water mark); numa
+    actualização só se pedem as linhas mais novas e só se refazem a
+    agregação e o método de Hondt nos distritos cujos números mudaram.
+
+"""
+
+def changed_districts(previous_rows, new_rows):
+    """
+    Districts where a (codigo, partido) is new or its votos/mandatos changed.
+
+    Args:
+        previous_rows (pd.DataFrame): latest rows before the update
+        new_rows (pd.DataFrame): latest rows among the new ones
+
+    Returns:
+        districts (set)
+    """
+    merged = new_rows.merge(
+        previous_rows[KEY_COLUMNS + ['votos', 'mandatos']],
+        on=KEY_COLUMNS, how='left', suffixes=('', '_anterior')
+    )
+    changed = np.zeros(len(merged), dtype=bool)
+    for column in ['votos', 'mandatos']:
+        current = merged[column].to_numpy(dtype=np.int64, na_value=-1)
+        previous = merged[f'{column}_anterior'].to_numpy(dtype=np.int64, na_value=-1)
+        changed |= current != previous
+    return set(merged.loc[changed, 'distrito'])
+
+
+class IncrementalResults:
+    """
+    Per-district results that can be updated with only the newer rows.
+
+    Attributes:
+        latest (pd.DataFrame): latest row of each (codigo, partido)
+        high_water (pd.Timestamp or None): largest timestamp seen
+        raw_district_results, grouped_district_results, district_allocations (dict):
+            per-district results, as returned by results.aggregate_districts
+        totals (ElectionTotals): national totals, updated district by district
+    """
+
+    def __init__(self):
+        self.latest = None
+        self.high_water = None
+        self.raw_district_results = {}
+        self.grouped_district_results = {}
+        self.district_allocations = {}
+        self.totals = ElectionTotals()
+
+    def load(self, election_data, timings=None):
+        """
+        Full load from all the rows of the table.
+
+        Returns:
+            results (dict): see results.finish_results
+        """
+        with phase(timings, 'aggregate'):
+            self.latest = latest_rows(election_data)
+            self.high_water = election_data['timestamp'].max() if len(election_data) else None
+            (self.raw_district_results,
+             self.grouped_district_results,
+             self.district_allocations) = aggregate_districts(self.latest)
+            self.totals = ElectionTotals.from_districts(self.raw_district_results, self.grouped_district_results)
+        return self._finish(timings)
+
+    def update(self, new_rows, timings=None):
+        """
+        Applies rows newer than the high-water mark.
+
+        Args:
+            new_rows (pd.DataFrame): rows with timestamp > high_water
+
+        Returns:
+            results (dict or None): new results, None if nothing changed
+            districts (set): districts that were recomputed
+        """
+        if new_rows.empty:
+            return None, set()
+
+        with phase(timings, 'aggregate'):
+            new_latest = latest_rows(new_rows)
+            districts = changed_districts(self.latest, new_latest)
+            high_water = max(self.high_water, new_rows['timestamp'].max()) \
+                if self.high_water is not None else new_rows['timestamp'].max()
+            latest = latest_rows(pd.concat([self.latest, new_latest], ignore_index=True))
+
+            if not districts:
+                self.high_water = high_water
+                self.latest = latest
+                return None, districts
+
+            # Aggregation and D'Hondt only for the districts that changed
+            raw, grouped, allocations = aggregate_districts(latest[latest['distrito'].isin(districts)])
+            # New dicts and totals, not .update(): the published results still hold the old ones
+            raw_district_results = {**self.raw_district_results, **raw}
+            grouped_district_results = {**self.grouped_district_results, **grouped}
+            district_allocations = {**self.district_allocations, **allocations}
+            totals = self.totals.copy()
+            for district_name in raw:
+                totals.replace_district(district_name, raw[district_name], grouped[district_name])
+
+        results = finish_results(raw_district_results, grouped_district_results, district_allocations,
+                                 timings=timings, totals=totals)
+
+        # Nothing is kept before all of the above succeeded: a failed
+        # update is retried from the same high-water mark
+        self.high_water = high_water
+        self.latest = latest
+        self.raw_district_results = raw_district_results
+        self.grouped_district_results = grouped_district_results
+        self.district_allocations = district_allocations
+        self.totals = totals
+        return results, districts
+
+    def _finish(self, timings):
+        return finish_results(
+            self.raw_district_results,
+            self.grouped_district_results,
+            self.district_allocations,
+            timings=timings,
+            totals=self.totals
+        )
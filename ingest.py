@@ -0,0 +1,116 @@
+import numpy as np
+import pandas as pd
+from collections import defaultdict
+
+
+"""
+    Converte as linhas da tabela resultadosporcirculo nas estruturas por
+    distrito usadas pela aplicação:
+
+        raw_district_results[distrito][partido] = {'votos', 'mandatos'}
+        grouped_district_results[distrito][grupo] = {'votos', 'mandatos'}
+
+    Há dois modos com o mesmo resultado: o ciclo original com iterrows()
+    ('rows') e um modo colunar com NumPy ('columnar').
+
+"""
+
+
+def ingest_rows(election_data, party_to_group):
+    """
+    Builds the per-district tables walking the DataFrame row by row.
+
+    Args:
+        election_data (pd.DataFrame): rows with distrito, partido, votos, mandatos
+        party_to_group (dict): {party: group}
+
+    Returns:
+        raw_district_results (defaultdict): last row seen per district and party
+        grouped_district_results (defaultdict): votes summed per district and group
+    """
+    raw_district_results = defaultdict(lambda: defaultdict(lambda: {'votos': 0, 'mandatos': 0}))
+    grouped_district_results = defaultdict(lambda: defaultdict(lambda: {'votos': 0, 'mandatos': 0}))
+
+    for _, row in election_data.iterrows():
+        district_name = row['distrito']
+        party_name = row['partido']
+        votos = row['votos']
+        mandatos = row.get('mandatos', 0)  # Using get() for safety
+
+        # Store raw party results
+        raw_district_results[district_name][party_name]['votos'] = votos
+        raw_district_results[district_name][party_name]['mandatos'] = mandatos
+
+        # Find which group this party belongs to
+        group_name = party_to_group.get(party_name, party_name)  # Default to party if ungrouped
+
+        # Aggregate votos for the group
+        grouped_district_results[district_name][group_name]['votos'] += votos
+
+    return raw_district_results, grouped_district_results
+
+
+def ingest_columnar(election_data, party_to_group):
+    """
+    Builds the same per-district tables as ingest_rows() with NumPy.
+
+    Districts, parties and groups are coded as integers with pd.factorize()
+    (first-appearance order, so the dict order matches the row loop), the
+    last row of each (district, party) is found with np.unique() and the
+    group votes are summed with np.bincount(). Python only touches the
+    distinct (district, party) pairs, not every row.
+
+    Args:
+        election_data (pd.DataFrame): rows with distrito, partido, votos, mandatos
+        party_to_group (dict): {party: group}
+
+    Returns:
+        raw_district_results (defaultdict): last row seen per district and party
+        grouped_district_results (defaultdict): votes summed per district and group
+    """
+    raw_district_results = defaultdict(lambda: defaultdict(lambda: {'votos': 0, 'mandatos': 0}))
+    grouped_district_results = defaultdict(lambda: defaultdict(lambda: {'votos': 0, 'mandatos': 0}))
+    if election_data.empty:
+        return raw_district_results, grouped_district_results
+
+    district_codes, districts = pd.factorize(election_data['distrito'])
+    party_codes, parties = pd.factorize(election_data['partido'])
+    votos = election_data['votos'].to_numpy(dtype=np.int64, na_value=0)
+    if 'mandatos' in election_data:
+        mandatos = election_data['mandatos'].to_numpy(dtype=np.int64, na_value=0)
+    else:
+        mandatos = np.zeros(len(election_data), dtype=np.int64)
+
+    # Raw party results: the last row of each (district, party) wins
+    pair_codes, pairs = pd.factorize(district_codes * len(parties) + party_codes)
+    reversed_first = np.unique(pair_codes[::-1], return_index=True)[1]
+    last_rows = len(pair_codes) - 1 - reversed_first
+
+    for pair, row in zip(pairs, last_rows):
+        district_name = districts[pair // len(parties)]
+        party_name = parties[pair % len(parties)]
+        raw_district_results[district_name][party_name] = {
+            'votos': int(votos[row]),
+            'mandatos': int(mandatos[row])
+        }
+
+    # Group votes: every row counts, summed per (district, group)
+    group_of_party, groups = pd.factorize(
+        pd.Index([party_to_group.get(party, party) for party in parties])
+    )
+    group_codes = group_of_party[party_codes]
+    district_group_codes, district_groups = pd.factorize(district_codes * len(groups) + group_codes)
+    group_votos = np.bincount(district_group_codes, weights=votos, minlength=len(district_groups))
+
+    for district_group, total in zip(district_groups, group_votos):
+        district_name = districts[district_group // len(groups)]
+        group_name = groups[district_group % len(groups)]
+        grouped_district_results[district_name][group_name] = {'votos': int(total), 'mandatos': 0}
+
+    return raw_district_results, grouped_district_results
+
+
+INGEST_MODES = {
+    'rows': ingest_rows,
+    'columnar': ingest_columnar
+}
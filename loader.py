@@ -0,0 +1,262 @@
+import os
+import threading
+import time
+from collections import namedtuple
+
+import pandas as pd
+
+from config import SNAPSHOT_CACHE, REFRESH_MODE, REFRESH_SECONDS, QUERY_MODE
+from datasource import make_source
+from incremental import IncrementalResults
+from pushdown import aggregate_pushdown
+from results import build_results, finish_results, party_to_group_mapping, print_results
+from snapshot_cache import cached_election_data, save_snapshot, TIMESTAMP_FORMAT
+from timing import phase, print_timings
+
+
+"""
+    Carregamento dos resultados a partir da origem configurada
+    (DATA_SOURCE, ver datasource.py; por omissão o BigQuery).
+
+    No modo 'eager' os dados são carregados durante o import de main.py
+    (comportamento original). No modo 'background' o import não faz
+    consultas: cada worker do gunicorn lança uma thread de carregamento no
+    primeiro pedido que recebe, e até lá a página mostra um estado
+    "a carregar". Com --preload as threads do processo mestre não
+    sobrevivem ao fork, por isso a thread é lançada por processo (pid).
+
+    Depois de carregados, a mesma thread actualiza os resultados de
+    REFRESH_SECONDS em REFRESH_SECONDS, fora do caminho dos pedidos, e
+    publica-os com uma única troca de referência (ver Snapshot).
+
+"""
+
+# The configured data source, shared by the loader thread and the scripts
+source = make_source()
+
+
+def fetch_election_data(timings=None):
+    """
+    Gets all the election rows from the data source.
+
+    Args:
+        timings (dict): optional, receives the 'query' and 'to_dataframe' times
+
+    Returns:
+        election_data (pd.DataFrame)
+    """
+    return source.fetch_all(timings)
+
+
+def fetch_max_timestamp():
+    """MAX(timestamp) of the table, to know if the local snapshot is current"""
+    return source.fetch_max_timestamp()
+
+
+def fetch_new_rows(since, timings=None):
+    """
+    Gets only the rows newer than the high-water mark.
+
+    Args:
+        since (pd.Timestamp): largest timestamp already loaded
+
+    Returns:
+        new_rows (pd.DataFrame)
+    """
+    return source.fetch_since(since, timings)
+
+
+def load_election_data(timings=None, refresh=False):
+    """
+    All the rows of the table, from the local snapshot when possible.
+
+    Args:
+        timings (dict): optional, receives the time of each phase
+        refresh (bool): check the source even if the local snapshot is within its TTL
+    """
+    if not SNAPSHOT_CACHE or not source.remote:
+        return fetch_election_data(timings)
+    election_data, origin = cached_election_data(
+        lambda: fetch_election_data(timings), fetch_max_timestamp, refresh, timings
+    )
+    print(f"Election data from {origin}: {len(election_data)} rows")
+    return election_data
+
+
+def load_aggregated_results(timings=None):
+    """
+    Results from the aggregated query (QUERY_MODE 'pushdown').
+
+    Returns:
+        results (dict): see results.finish_results
+        timestamp: largest timestamp of the rows, the data version
+    """
+    aggregated = source.fetch_aggregated(party_to_group_mapping(), timings)
+    with phase(timings, 'aggregate'):
+        district_results = aggregate_pushdown(aggregated)
+    return finish_results(*district_results, timings=timings), max_timestamp(aggregated)
+
+
+# What requests read: the results and the data version they come from.
+# A new Snapshot is built completely before it is published with a single
+# reference assignment, and published results are never modified again, so
+# a request that took a Snapshot sees one consistent state.
+Snapshot = namedtuple('Snapshot', ['results', 'version', 'timestamp', 'loaded_at'])
+
+
+def data_version(timestamp):
+    """Version of the data: its largest timestamp (the same in every worker)"""
+    if timestamp is None or pd.isna(timestamp):
+        return 'empty'
+    return pd.Timestamp(timestamp).strftime(TIMESTAMP_FORMAT)
+
+
+def max_timestamp(election_data):
+    return election_data['timestamp'].max() if len(election_data) else None
+
+
+class ResultsLoader:
+    """
+    Holds the current results of this process and refreshes them off the
+    request path.
+
+    One background thread per process loads the results (in 'background'
+    startup mode) and then refreshes them every REFRESH_SECONDS. With
+    REFRESH_MODE 'incremental' a refresh asks the source only for the rows
+    newer than the last timestamp seen (see incremental.py); with 'full' it
+    reloads the whole table. With QUERY_MODE 'pushdown' the source does the
+    aggregation (see pushdown.py) and a refresh repeats that query when
+    MAX(timestamp) changed. Only that thread touches the loading state;
+    requests just read `snapshot`.
+
+    Attributes:
+        snapshot (Snapshot or None): current results, swapped atomically
+        timings (dict): seconds per phase of the first load
+        error (str or None): last loading or refresh error, if any
+    """
+
+    def __init__(self, refresh_mode=REFRESH_MODE, refresh_seconds=REFRESH_SECONDS, retry_seconds=10,
+                 query_mode=QUERY_MODE):
+        self.snapshot = None
+        self.timings = {}
+        self.error = None
+        self._pushdown = query_mode == 'pushdown'
+        self._table = IncrementalResults() if refresh_mode == 'incremental' and not self._pushdown else None
+        self._refresh_seconds = refresh_seconds
+        self._retry_seconds = retry_seconds
+        self._lock = threading.Lock()
+        self._pid = None
+        self._listeners = []
+
+    @property
+    def ready(self):
+        return self.snapshot is not None
+
+    @property
+    def results(self):
+        snapshot = self.snapshot
+        return snapshot.results if snapshot is not None else None
+
+    def on_publish(self, listener):
+        """Registers listener(snapshot), called by the loader thread after each swap"""
+        self._listeners.append(listener)
+
+    def _publish(self, results, timestamp):
+        if timestamp is not None and pd.isna(timestamp):
+            timestamp = None
+        snapshot = Snapshot(
+            results,
+            data_version(timestamp),
+            pd.Timestamp(timestamp).to_pydatetime() if timestamp is not None else None,
+            time.time()
+        )
+        self.snapshot = snapshot
+        for listener in self._listeners:
+            try:
+                listener(snapshot)
+            except Exception as e:
+                print(f"Error in publish listener: {type(e).__name__}: {e}")
+
+    def load_now(self):
+        """Loads in the calling thread; raises if the load fails"""
+        timings = dict(self.timings)  # keeps the 'import' phase
+        if self._pushdown:
+            results, timestamp = load_aggregated_results(timings)
+        else:
+            election_data = load_election_data(timings)
+            if self._table is not None:
+                results = self._table.load(election_data, timings)
+            else:
+                results = build_results(election_data, timings)
+            timestamp = max_timestamp(election_data)
+        print_results(results)
+        print_timings(timings)
+        self.timings = timings
+        self.error = None
+        self._publish(results, timestamp)
+        return results
+
+    def refresh(self):
+        """
+        Builds up-to-date results and publishes them if anything changed.
+
+        Returns:
+            changed (bool): whether a new snapshot was published
+        """
+        if self._pushdown:
+            if data_version(fetch_max_timestamp()) == self.snapshot.version:
+                return False
+            self._publish(*load_aggregated_results())
+            return True
+
+        if self._table is None:
+            election_data = load_election_data(refresh=True)
+            timestamp = max_timestamp(election_data)
+            if data_version(timestamp) == self.snapshot.version:
+                return False
+            self._publish(build_results(election_data), timestamp)
+            return True
+
+        new_rows = fetch_new_rows(self._table.high_water)
+        results, districts = self._table.update(new_rows)
+        if results is None:
+            return False
+        if source.remote:
+            save_snapshot(self._table.latest)
+        self._publish(results, self._table.high_water)
+        print(f"Refreshed {len(districts)} districts: {', '.join(sorted(districts))}")
+        return True
+
+    def start_background(self):
+        """
+        Starts the loading/refresh thread of this process, once.
+
+        Called from each request: with gunicorn --preload the threads of the
+        master process do not survive the fork, so every worker starts its own.
+        """
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        threading.Thread(target=self._run, name='results-loader', daemon=True).start()
+
+    def _run(self):
+        while self.snapshot is None:
+            try:
+                self.load_now()
+            except Exception as e:
+                self.error = f"{type(e).__name__}: {e}"
+                print(f"Error loading results: {self.error}")
+                time.sleep(self._retry_seconds)
+
+        while self._refresh_seconds > 0:
+            time.sleep(self._refresh_seconds)
+            try:
+                self.refresh()
+                self.error = None
+            except Exception as e:
+                # Keep serving the last good snapshot
+                self.error = f"{type(e).__name__}: {e}"
+                print(f"Error refreshing results: {self.error}")
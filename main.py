@@ -1,10 +1,22 @@
-from flask import Flask, request, jsonify, abort, render_template, send_file
-import pandas as pd
-import math
-from google.cloud import bigquery
-from collections import defaultdict
+from flask import Flask, request, jsonify, abort, render_template, send_file, stream_with_context
+import json
+import time
 import os
 
+IMPORT_STARTED = time.perf_counter()
+
+from config import DISTRITOS, PARTIDOS, STARTUP_MODE, QUERY_MODE, HISTORY_RESULTS_ENTRIES
+from events import Broadcaster
+from history import HistoryStore, HistoryError, UnknownElection, parse_timestamp, results_document
+from loader import ResultsLoader, source as data_source
+from lru import LRUCache
+from margins import election_margins
+from payload import CompressedPayload, PayloadCache
+from projection import ProjectionCache, ProjectionParameters
+from scenarios import VoteMatrix
+from simulation import SimulationCache, MappingError, parse_mapping, parse_rules
+from sweeps import Sweeper, parse_sweep, stream_sweep
+
 
 """
     Allocates mandates to parties and groups of parties in all districts of Portugal using the Hondt method.
@@ -15,348 +27,244 @@ import os
 
 app = Flask(__name__, static_folder='static')
 
-# Configuração
-PROJECTO = "apps-448519"
-DATASET = "AR25"
-TABELA = "resultadosporcirculo"
-
-DISTRITOS = [
-    "Aveiro",
-    "Beja",
-    "Braga",
-    "Bragança",
-    "Castelo Branco",
-    "Coimbra",
-    "Évora",
-    "Faro",
-    "Guarda",
-    "Leiria",
-    "Lisboa",
-    "Portalegre",
-    "Porto",
-    "Santarém",
-    "Setúbal",
-    "Viana do Castelo",
-    "Vila Real",
-    "Viseu",
-    "Madeira",
-    "Açores",
-    "Europa",
-    "Resto do Mundo"
-]
-
-PARTIDOS = {
-    "Votos em branco": ['Votos em branco'],
-    "Votos nulos": ['Votos nulos'],
-    "PPD/PSD.CDS-PP": ['PPD+CDS+IL'],
-    "PS": ['PS'],
-    "CH": ['CH'],
-    "IL": ['PPD+CDS+IL'],
-    "L": ['L+BE+PCP+PAN'],
-    "B.E.": ['L+BE+PCP+PAN'],
-    "ADN": ['ADN'],
-    "PAN": ['L+BE+PCP+PAN'],
-    "PCP-PEV": ['L+BE+PCP+PAN'],
-    "PCTP/MRPP": ['PCTP/MRPP'],
-    "R.I.R.": ['R.I.R.'],
-    "VP": ['VP'],
-    "E": ['E'],
-    "ND": ['ND'],
-    "NC": ['NC'],
-    "PPM": ['PPM'],
-    "JPP": ['JPP'],
-    "PLS": ['PLS'],
-    "PTP": ['PTP'],
-    "MPT": ['MPT'],
-    "PPD/PSD.CDS-PP.PPM": ['PPD+CDS+IL']
-}
-
-# Get election data from BigQuery table
-client = bigquery.Client(project=PROJECTO)
-query = f"""
-SELECT codigo, distrito, partido, votos, mandatos, timestamp
-FROM {PROJECTO}.{DATASET}.{TABELA}
-"""
-election_data = client.query(query).to_dataframe()
-
-
-# ======================
-# 1. DATA PREPARATION
-# ======================
-
-# Build party-to-group mapping (more efficient lookup)
-party_to_group = {}
-for party_name, group_labels in PARTIDOS.items():
-    # Each party maps to its group label (first/only item in list)
-    group_name = group_labels[0]
-    party_to_group[party_name] = group_name
-
-# Initialize data structures with clear naming
-raw_district_results = defaultdict(lambda: defaultdict(lambda: {'votos': 0, 'mandatos': 0}))
-grouped_district_results = defaultdict(lambda: defaultdict(lambda: {'votos': 0, 'mandatos': 0}))
-
-# ======================
-# 2. PROCESS RAW DATA
-# ======================
-
-for _, row in election_data.iterrows():
-    district_name = row['distrito']
-    party_name = row['partido']
-    votos = row['votos']
-    mandatos = row.get('mandatos', 0)  # Using get() for safety
-    
-    # Store raw party results
-    raw_district_results[district_name][party_name]['votos'] = votos
-    raw_district_results[district_name][party_name]['mandatos'] = mandatos
-    
-    # Skip blank/null votos for group calculations
-    # if party_name in ['Votos em branco', 'Votos nulos']:
-    #    continue
-    
-    # Find which group this party belongs to
-    group_name = party_to_group.get(party_name, party_name)  # Default to party if ungrouped
-    
-    # Aggregate votos for the group
-    grouped_district_results[district_name][group_name]['votos'] += votos
-    
-
-# ======================
-# 3. CALCULATE GROUP mandatos (D'HONDT)
-# ======================
-
-for district_name in grouped_district_results:
-    # Get total mandatos to allocate in this district
-    total_mandatos_in_district = sum(
-        party_data['mandatos']
-        for party_data in raw_district_results[district_name].values()
-    )
-    
-    # Get eligible groups (exclude blanks/nulls)
-    eligible_groups = {
-        group_name: group_data['votos']
-        for group_name, group_data in grouped_district_results[district_name].items()
-        if group_name not in ['Votos em branco', 'Votos nulos']
-    }
-    
-    # Initialize seat allocation
-    group_mandatos = {group: 0 for group in eligible_groups}
-    
-    # D'Hondt allocation
-    for _ in range(total_mandatos_in_district):
-        # Calculate current quotients
-        current_quotients = {
-            group: votos / (group_mandatos[group] + 1)
-            for group, votos in eligible_groups.items()
-        }
-        
-        # Award seat to group with highest quotient
-        winning_group = max(current_quotients.items(), key=lambda x: x[1])[0]
-        group_mandatos[winning_group] += 1
-    
-    # Store results
-    for group_name, mandatos in group_mandatos.items():
-        grouped_district_results[district_name][group_name]['mandatos'] = mandatos
-
-# ------------------------------------
-#
-# Sort parties by votes within each district
-
-for district in raw_district_results:
-    # Convert to list of (party, votes) tuples and sort by votes (descending)
-    sorted_parties = sorted(
-        raw_district_results[district].items(),
-        key=lambda x: x[1]['votos'],
-        reverse=True
-    )
-    
-    # Create new ordered dictionary for this district
-    ordered_parties = {}
-    for party, votes in sorted_parties:
-        ordered_parties[party] = votes
-    
-    # Update the district data
-    raw_district_results[district] = ordered_parties
-
-# Sort groups by votes within each district
-
-for district in grouped_district_results:
-    # Convert to list of (party, votes) tuples and sort by votes (descending)
-    sorted_groups = sorted(
-        grouped_district_results[district].items(),
-        key=lambda x: x[1]['votos'],
-        reverse=True
-    )
-
-    # Create new ordered dictionary for this district
-    ordered_groups = {}
-    for group, votes in sorted_groups:
-        ordered_groups[group] = votes
-    
-    # Update the district data
-    grouped_district_results[district] = ordered_groups
-
-#
-# ------------------------------------
-
-
-# ======================
-# 4. NATIONAL TOTALS
-# ======================
-
-# Initialize national totals as if they were a party
-raw_district_results['Total Nacional'] = defaultdict(lambda: {'votos': 0, 'mandatos': 0})
-grouped_district_results['Total Nacional'] = defaultdict(lambda: {'votos': 0, 'mandatos': 0})
-
-# Calculate nationwide sums for each party/group
-for district_name, groups in grouped_district_results.items():
-    if district_name == 'Total Nacional': 
-        continue
-
-    for group_name, data in groups.items():
-        grouped_district_results['Total Nacional'][group_name]['votos'] += data['votos']
-        grouped_district_results['Total Nacional'][group_name]['mandatos'] += data['mandatos']
-
-# ------------------------------------
-#
-national_totals = defaultdict(lambda: {'votos': 0, 'mandatos': 0})
-for district_data in raw_district_results.values():
-    for party, data in district_data.items():
-        national_totals[party]['votos'] += data['votos']
-        national_totals[party]['mandatos'] += data['mandatos']
-
-# Filter out special categories and sort
-valid_parties = [
-    {'name': k, 'votos': v['votos'], 'mandatos': v['mandatos']}
-    for k, v in national_totals.items()
-    if k not in ['Votos em branco', 'Votos nulos', 'TOTAL']
-]
-
-sorted_parties = sorted(
-    valid_parties,
-    key=lambda x: x['votos'],
-    reverse=True
-)
-
-national_group_totals = defaultdict(lambda: {'votos': 0, 'mandatos': 0})
-for district_data in grouped_district_results.values():
-    for colig, data in district_data.items():
-        national_group_totals[colig]['votos'] += data['votos']
-        national_group_totals[colig]['mandatos'] += data['mandatos']
-
-# Filter out special categories and sort
-valid_groups = [
-    {'name': k, 'votos': v['votos'], 'mandatos': v['mandatos']}
-    for k, v in national_group_totals.items()
-    if k not in ['Votos em branco', 'Votos nulos', 'TOTAL']
-]
-
-sorted_groups = sorted(
-    valid_groups,
-    key=lambda x: x['votos'],
-    reverse=True
-)
-
-#
-# ------------------------------------
-
-
-# ======================
-# 5. PREPARE FINAL RESULTS
-# ======================
-
-# 1. Calculate blank/null votos (if not already done)
-blank_votes = sum(
-    district_data.get('Votos em branco', {}).get('votos', 0)
-    for district_data in raw_district_results.values()
-)
-
-null_votes = sum(
-    district_data.get('Votos nulos', {}).get('votos', 0)
-    for district_data in raw_district_results.values()
-)
-
-# 2. Calculate national group totals (if not already done)
-national_group_totals = defaultdict(lambda: {'votos': 0, 'mandatos': 0})
-for district_data in grouped_district_results.values():
-    for group_name, group_data in district_data.items():
-        national_group_totals[group_name]['votos'] += group_data['votos'] 
-        national_group_totals[group_name]['mandatos'] += group_data['mandatos']
-
-# 3. Create final_group_results with percentages
-total_valid_votos = sum(
-    data['votos'] 
-    for name, data in national_group_totals.items()
-    if name not in ['Votos em branco', 'Votos nulos']
-) 
-
-final_group_results = [
-    {
-        'name': name,
-        'votos': data['votos'],
-        'mandatos': data['mandatos'],
-        'vote_share': round((data['votos'] / total_valid_votos * 100), 2)
-    }
-    for name, data in national_group_totals.items()
-    if name not in ['Votos em branco', 'Votos nulos']
-]
-
-# Sort by votos descending
-final_group_results.sort(key=lambda x: x['votos'], reverse=True)
-
-
-# ======================
-# 6. PRINT FORMATTED RESULTS
-# ======================
-
-print("\n=== ELECTION RESULTS BY GROUP ===")
-print(f"{'Group':<25} | {'votos':>12} | {'Vote %':>7} | {'mandatos':>6}")
-print("-" * 60)
-
-for group in final_group_results:
-    print(
-        f"{group['name']:<25} | "
-        f"{group['votos'] / 2:>12,} | " # to exclude 'Total nacional'
-        f"{group['vote_share']:>6.2f}% | "
-        f"{group['mandatos'] / 2:>6}" # to exclude 'Total nacional'
-    )
-
-# Calculate totals using CORRECT key names
-total_votes = sum(
-    party['votos']  # Using 'votos' not 'votes'
-    for district in raw_district_results.values() 
-    for party in district.values()
-) # / 2 # adjusting to exclude 'district' Total nacional
-
-total_mandates = sum(
-    party['mandatos']  # Using 'mandatos' not 'seats'
-    for district in raw_district_results.values() 
-    for party in district.values()
-)
-print (total_votes, total_mandates)
-
-# Print special categories
-print("\n=== SPECIAL CATEGORIES ===")
-print(f"Blank votos: {blank_votes:,}")
-print(f"Null votos: {null_votes:,}")
-print(f"Total valid votos: {total_votes-blank_votes-null_votes:,}")
+# Results of this process (see loader.py for the startup modes)
+loader = ResultsLoader()
+
+# Custom coalitions already simulated for the current data version
+simulations = SimulationCache()
+
+# Process pool of /api/sweep, started by the first sweep
+sweeper = Sweeper()
+
+# Monte-Carlo projections already run for the current data version
+projections = ProjectionCache()
+
+# Deltas of every new snapshot, sent to the open /api/eventos streams
+broadcaster = Broadcaster()
+
+# Earlier elections and earlier counts, opened on the first query (see history.py)
+history = HistoryStore()
+
+# Results "as of" a time, serialised and compressed once per resolved query
+history_payloads = LRUCache(HISTORY_RESULTS_ENTRIES, 0,
+                            lambda payload: sum(len(body) for body in payload.bodies.values()))
+
+def render_index(snapshot):
+    """Renders the page of a snapshot; the result is cached per data version"""
+    results = snapshot.results
+    total_votes = results['total_votes']
+    blank_votes = results['blank_votes']
+    null_votes = results['null_votes']
+    # A request context of its own, so the page can also be rendered by the loader thread
+    with app.test_request_context('/'):
+        html = render_template(
+            'index.html',
+            partidos=PARTIDOS,
+            partidos_sorted=results['sorted_parties'],
+            coligs_sorted=results['sorted_groups'],
+            blank_votes=blank_votes,
+            null_votes=null_votes,
+            total_valid=total_votes - blank_votes - null_votes,
+            total_mandates=results['total_mandates'],
+            total_all=total_votes,
+            distritos=DISTRITOS,
+            versao=snapshot.version
+        )
+    return CompressedPayload(html.encode('utf-8'), 'text/html', snapshot.timestamp)
+
+
+# The page, rendered and compressed once per data version
+index_page = PayloadCache(render_index)
+
+# Per-district data for the page, serialised and compressed once per version
+district_data = PayloadCache(lambda snapshot: CompressedPayload.from_json({
+    'version': snapshot.version,
+    'votos': snapshot.results['raw_district_results'],
+    'votos_colig': snapshot.results['grouped_district_results']
+}, snapshot.timestamp))
+
+# Seat margins of every district, computed once per version
+seat_margins = PayloadCache(lambda snapshot: CompressedPayload.from_json(
+    dict(election_margins(snapshot.results), version=snapshot.version), snapshot.timestamp
+))
+
+# Build them as soon as the loader swaps in a new snapshot, not on a request;
+# the open streams get their delta first
+loader.on_publish(broadcaster.publish)
+loader.on_publish(index_page.get)
+loader.on_publish(district_data.get)
+loader.on_publish(seat_margins.get)
+
+
+def send_payload(payload):
+    """Sends a CompressedPayload, or 304 if the client already has it"""
+    encoding = payload.choose_encoding(request.accept_encodings)
+    response = app.response_class(payload.bodies[encoding], mimetype=payload.mimetype)
+    if encoding != 'identity':
+        response.headers['Content-Encoding'] = encoding
+    # Weak ETag: the same validator for every encoding of the same document
+    response.set_etag(payload.etag, weak=True)
+    response.last_modified = payload.last_modified
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = 'public, no-cache'
+    # 304 for a matching If-None-Match / If-Modified-Since
+    return response.make_conditional(request)
+
+
+@app.before_request
+def start_loading():
+    # Each worker starts its loading/refresh thread on its first request;
+    # requests never wait for it and only read loader.snapshot
+    loader.start_background()
 
 
 @app.route('/')
 def serve_index():
-    
-    return render_template(
-        'index.html',
-        partidos=PARTIDOS,
-        partidos_sorted=sorted_parties,
-        coligs_sorted=sorted_groups,
-        blank_votes=blank_votes,
-        null_votes=null_votes,
-        total_valid=total_votes - blank_votes - null_votes,
-        total_mandates=total_mandates,
-        total_all=total_votes,
-        distritos=DISTRITOS,
-        votos=raw_district_results,  # Now with correct key names
-        votos_colig=grouped_district_results
+    snapshot = loader.snapshot  # one consistent version for the whole request
+    if snapshot is None:
+        return render_template('loading.html', error=loader.error), 503, {'Retry-After': '5'}
+    return send_payload(index_page.get(snapshot))
+
+@app.route('/api/dados')
+def serve_district_data():
+    """Per-district results by party (votos) and by group (votos_colig)"""
+    snapshot = loader.snapshot
+    if snapshot is None:
+        return jsonify(error='loading'), 503, {'Retry-After': '5'}
+    return send_payload(district_data.get(snapshot))
+
+@app.route('/api/margins')
+def serve_seat_margins():
+    """Last mandate won, first one lost and votes needed per district (see margins.py)"""
+    snapshot = loader.snapshot
+    if snapshot is None:
+        return jsonify(error='loading'), 503, {'Retry-After': '5'}
+    return send_payload(seat_margins.get(snapshot))
+
+@app.route('/api/eventos', methods=['GET'])
+def stream_events():
+    """
+    Server-Sent Events with the districts that changed and the national
+    totals of every new snapshot (see events.py); Last-Event-ID or ?versao=
+    is the version the client already has
+    """
+    version = request.headers.get('Last-Event-ID') or request.args.get('versao')
+    response = app.response_class(broadcaster.stream(version), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # no buffering in front of the app
+    return response
+
+@app.route('/api/simulate', methods=['POST'])
+def simulate_coalitions():
+    """
+    Group votes and mandates per district for a {party: [group]} mapping;
+    ?metodo=, ?limiar= and ?limiar_ambito= choose the rules (see simulation.py)
+    """
+    snapshot = loader.snapshot
+    if snapshot is None:
+        return jsonify(error='loading'), 503, {'Retry-After': '5'}
+    try:
+        party_to_group = parse_mapping(request.get_json(silent=True))
+        rules = parse_rules(request.args, snapshot.results['total_mandates'])
+    except MappingError as e:
+        return jsonify(error=str(e)), 400
+
+    results, cached = simulations.get_or_simulate(snapshot, party_to_group, rules)
+    return jsonify(version=snapshot.version, cached=cached, regras=rules._asdict(), resultados=results)
+
+@app.route('/api/sweep', methods=['POST'])
+def sweep_coalitions():
+    """
+    National mandates of many coalition scenarios, in the process pool.
+
+    The response is NDJSON: one progress line per finished task, then the
+    ranking of the merges or the results of the mappings (see sweeps.py).
+    """
+    snapshot = loader.snapshot
+    if snapshot is None:
+        return jsonify(error='loading'), 503, {'Retry-After': '5'}
+    matrix = VoteMatrix.from_results(snapshot.results)
+    try:
+        merges, mappings, top = parse_sweep(request.get_json(silent=True), matrix.parties)
+    except MappingError as e:
+        return jsonify(error=str(e)), 400
+
+    def lines():
+        yield json.dumps({'version': snapshot.version}) + '\n'
+        for line in stream_sweep(sweeper, matrix, merges, mappings, top):
+            yield json.dumps(line, ensure_ascii=False) + '\n'
+
+    return app.response_class(stream_with_context(lines()), mimetype='application/x-ndjson')
+
+@app.route('/api/projection', methods=['GET', 'POST'])
+def project_seats():
+    """
+    Distribution of the final mandates, sampling the votes still to count.
+
+    The POST body gives the fraction counted per district and the other
+    parameters (see projection.ProjectionParameters); GET uses the defaults.
+    """
+    snapshot = loader.snapshot
+    if snapshot is None:
+        return jsonify(error='loading'), 503, {'Retry-After': '5'}
+    try:
+        parameters = ProjectionParameters.parse(
+            request.get_json(silent=True) if request.method == 'POST' else None,
+            list(snapshot.results['raw_district_results']), PARTIDOS
+        )
+    except MappingError as e:
+        return jsonify(error=str(e)), 400
+
+    projection, cached = projections.get_or_project(snapshot, parameters)
+    return jsonify(version=snapshot.version, cached=cached, projecao=projection)
+
+@app.route('/api/historico')
+def list_elections():
+    """Elections in the historical store and the time each one covers"""
+    return jsonify(eleicoes=history.describe())
+
+@app.route('/api/historico/<eleicao>')
+def results_as_of(eleicao):
+    """
+    Results of an election as they stood at ?em= (ISO 8601, UTC when it has
+    no zone; the last count if missing), of one ?distrito= or of all
+    """
+    try:
+        as_of = history.as_of(eleicao, parse_timestamp(request.args.get('em')), request.args.get('distrito'))
+        payload, _ = history_payloads.get_or_compute(as_of, lambda: CompressedPayload.from_json(
+            results_document(as_of, history.results(as_of)), as_of.timestamp.to_pydatetime()
+        ))
+    except UnknownElection as e:
+        return jsonify(error=str(e)), 404
+    except HistoryError as e:
+        return jsonify(error=str(e)), 400
+    return send_payload(payload)
+
+@app.route('/api/historico/<eleicao>/passagens')
+def list_passes(eleicao):
+    """Timestamps of the counts stored for an election, to replay the night"""
+    try:
+        passes = history.passes(eleicao)
+    except UnknownElection as e:
+        return jsonify(error=str(e)), 404
+    return jsonify(eleicao=eleicao, passagens=[timestamp.isoformat() for timestamp in passes])
+
+@app.route('/api/status')
+def status():
+    snapshot = loader.snapshot
+    return jsonify(
+        ready=snapshot is not None,
+        mode=STARTUP_MODE,
+        source=data_source.describe(),
+        query_mode=QUERY_MODE,
+        version=snapshot.version if snapshot else None,
+        loaded_at=snapshot.loaded_at if snapshot else None,
+        error=loader.error,
+        timings=loader.timings,
+        simulation_cache=simulations.stats(),
+        projection_cache=projections.stats(),
+        history_cache=history.segments.stats(),
+        events=broadcaster.stats()
     )
 
 @app.route('/_ah/health')
@@ -368,6 +276,10 @@ def health_check():
 def create_app():
     return app
 
+loader.timings['import'] = time.perf_counter() - IMPORT_STARTED
+if STARTUP_MODE == 'eager':
+    loader.load_now()
+
 if __name__ == '__main__':
     # app.run(debug=True, host='0.0.0.0', port=int(os.environ.get('PORT', 8080)))
     port = int(os.environ.get('PORT', 8080))  # GAE uses 8080 by default
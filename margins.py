@@ -0,0 +1,121 @@
+from fractions import Fraction
+
+from allocation import allocate_hondt, EXCLUDED_GROUPS
+
+
+"""
+    Margens dos mandatos: quantos votos faltaram para ganhar mais um
+    mandato, ou sobravam antes de perder um, em cada distrito.
+
+    Com os votos dos outros fixos, um grupo só ganha um mandato quando o
+    seu quociente seguinte, votos / (mandatos + 1), passa o mandato ganho
+    mais fraco dos outros; e só perde um quando o seu último quociente,
+    votos / mandatos, fica abaixo do melhor quociente perdido dos outros.
+    Basta por isso ordenar uma vez os quocientes ganhos e os perdidos de
+    cada distrito (O(grupos log grupos)) e ler para cada grupo o primeiro
+    que não é dele. As contas são feitas com inteiros e fracções exactas e
+    seguem o desempate de allocation.allocate_hondt (o grupo que vem
+    primeiro ganha).
+
+"""
+
+
+def _quotient(quotient):
+    """A Quotient of HondtAllocation.ranking as JSON, or None"""
+    if quotient is None:
+        return None
+    return {'name': quotient.group, 'divisor': quotient.divisor, 'quociente': round(quotient.quotient, 2)}
+
+
+def seat_margins(votes, mandatos):
+    """
+    Votes each group needed to win one more mandate or to lose one.
+
+    Args:
+        votes (dict): {group: votes}, in the order given to allocate_hondt
+        mandatos (dict): {group: mandates won}
+
+    Returns:
+        margins (dict): {group: {'votos', 'mandatos',
+                                 'para_ganhar': votes short of one more mandate,
+                                 'ganha_a': group that would lose it,
+                                 'para_perder': votes it has to lose to lose a mandate,
+                                 'perde_para': group that would take it}};
+                        None where there is no such mandate
+    """
+    position = {group: index for index, group in enumerate(votes)}
+    # Weakest won quotient first (a later group loses a tie), best lost quotient first
+    won = sorted((group for group in votes if mandatos[group] > 0),
+                 key=lambda group: (Fraction(votes[group], mandatos[group]), -position[group]))
+    lost = sorted(votes, key=lambda group: (-Fraction(votes[group], mandatos[group] + 1), position[group]))
+
+    margins = {}
+    for group, group_votes in votes.items():
+        seats = mandatos[group]
+        margin = {'votos': group_votes, 'mandatos': seats,
+                  'para_ganhar': None, 'ganha_a': None, 'para_perder': None, 'perde_para': None}
+
+        rival = next((other for other in won if other != group), None)
+        if rival is not None:
+            # Win: votes x rival's mandates > rival's votes x (seats + 1), or equal when group comes first
+            needed, remainder = divmod(votes[rival] * (seats + 1), mandatos[rival])
+            if remainder or position[group] > position[rival]:
+                needed += 1
+            margin['para_ganhar'] = needed - group_votes
+            margin['ganha_a'] = rival
+
+        rival = next((other for other in lost if other != group), None)
+        if seats > 0 and rival is not None:
+            # Lose: votes x (rival's mandates + 1) < rival's votes x seats, or equal when rival comes first
+            loses, remainder = divmod(votes[rival] * seats, mandatos[rival] + 1)
+            if not remainder and position[rival] > position[group]:
+                loses -= 1
+            if loses >= 0:
+                margin['para_perder'] = group_votes - loses
+                margin['perde_para'] = rival
+
+        margins[group] = margin
+    return margins
+
+
+def district_margins(votes, allocation):
+    """
+    Args:
+        votes (dict): {group: votes} of one district, blank/null votes included
+        allocation (HondtAllocation): the allocation of those votes
+
+    Returns:
+        margins (dict): the last mandate won, the first one lost and the
+                        margins of every group (see seat_margins), by votes
+    """
+    margins = seat_margins({group: votes[group] for group in allocation.mandatos}, allocation.mandatos)
+    return {
+        'mandatos': allocation.seats,
+        'ultimo_mandato': _quotient(allocation.last_seat),
+        'primeiro_perdido': _quotient(allocation.next_seat),
+        'margens': dict(sorted(margins.items(), key=lambda x: x[1]['votos'], reverse=True))
+    }
+
+
+def election_margins(results):
+    """
+    Margins of every district, by party and by group.
+
+    The groups reuse the allocations of the results; the parties are
+    allocated here as if each ran alone, with the mandates of the district.
+
+    Returns:
+        margins (dict): {'partidos': {district: ...}, 'grupos': {district: ...}}
+    """
+    parties, groups = {}, {}
+    for district_name, allocation in results['district_allocations'].items():
+        group_votes = {group: data['votos'] for group, data in results['grouped_district_results'][district_name].items()}
+        groups[district_name] = district_margins(group_votes, allocation)
+
+        party_votes = {party: data['votos'] for party, data in results['raw_district_results'][district_name].items()}
+        party_allocation = allocate_hondt(
+            {party: votos for party, votos in party_votes.items() if party not in EXCLUDED_GROUPS},
+            allocation.seats
+        )
+        parties[district_name] = district_margins(party_votes, party_allocation)
+    return {'partidos': parties, 'grupos': groups}
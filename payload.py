@@ -0,0 +1,86 @@
+import gzip
+import hashlib
+import json
+import threading
+from collections.abc import Mapping
+
+try:
+    import brotli
+except ImportError:  # Brotli is optional; gzip is always available
+    brotli = None
+
+
+"""
+    Corpo pré-comprimido das respostas que só mudam com a versão dos dados
+    (a página / e /api/dados). O corpo é gerado e comprimido uma vez por
+    versão, e servido com ETag, Last-Modified, Vary: Accept-Encoding e
+    resposta 304 aos pedidos condicionais.
+
+"""
+
+
+def json_default(value):
+    """Read-only mappings (store.DistrictResultsView) and NumPy integers"""
+    if isinstance(value, Mapping):
+        return dict(value)
+    return int(value)
+
+
+class CompressedPayload:
+    """
+    One response body in identity, gzip and (if available) brotli encodings.
+
+    Attributes:
+        etag (str): validator derived from the content
+        bodies (dict): {encoding: bytes}, 'identity' always present
+        mimetype (str)
+        last_modified (datetime or None): time of the data it shows
+    """
+
+    def __init__(self, body, mimetype, last_modified=None):
+        self.mimetype = mimetype
+        self.last_modified = last_modified
+        self.etag = hashlib.sha256(body).hexdigest()[:32]
+        self.bodies = {'identity': body, 'gzip': gzip.compress(body, compresslevel=9)}
+        if brotli is not None:
+            self.bodies['br'] = brotli.compress(body, quality=11)
+
+    @classmethod
+    def from_json(cls, document, last_modified=None):
+        body = json.dumps(document, ensure_ascii=False, separators=(',', ':'), default=json_default).encode('utf-8')
+        return cls(body, 'application/json', last_modified)
+
+    def choose_encoding(self, accept_encodings):
+        """Best encoding the client accepts (werkzeug's request.accept_encodings)"""
+        for encoding in ('br', 'gzip'):
+            if encoding in self.bodies and accept_encodings[encoding]:
+                return encoding
+        return 'identity'
+
+
+class PayloadCache:
+    """
+    Builds a CompressedPayload once per data version.
+
+    A new data version replaces the stored payload, so nothing built from an
+    older snapshot is served after the swap.
+
+    Args:
+        build (callable): snapshot -> CompressedPayload
+    """
+
+    def __init__(self, build):
+        self._build = build
+        self._current = (None, None)  # (version, CompressedPayload), swapped as one
+        self._lock = threading.Lock()
+
+    def get(self, snapshot):
+        version, payload = self._current
+        if version == snapshot.version:
+            return payload
+        with self._lock:
+            version, payload = self._current
+            if version != snapshot.version:
+                payload = self._build(snapshot)
+                self._current = (snapshot.version, payload)
+            return payload
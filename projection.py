@@ -0,0 +1,273 @@
+import numpy as np
+
+from config import PROJECTION_DRAWS, PROJECTION_CONCENTRATION, PROJECTION_CACHE_ENTRIES, PROJECTION_SEATS
+from lru import LRUCache
+from scenarios import VoteMatrix, allocate_scenarios, mapping_labels
+from simulation import MappingError, is_integer, is_number, mapping_key, parse_mapping
+
+
+"""
+    Projecção dos mandatos a partir de resultados parciais (Monte-Carlo).
+
+    Em cada distrito os votos já contados ficam fixos e só os que faltam
+    contar são sorteados: o total que falta é votos contados x (1 - c) / c,
+    onde c é a fracção já contada, e a sua divisão pelos partidos segue
+    uma Dirichlet centrada nas percentagens já contadas (amostrada com
+    variáveis gama). A incerteza é por isso proporcional ao que falta
+    contar, e um distrito todo contado não varia.
+
+    As N simulações x distritos x partidos são uma matriz NumPy, e os
+    mandatos de todas saem do método de Hondt vectorizado de scenarios.py,
+    por partido e por grupo; os distritos já todos contados só são
+    calculados uma vez. O resultado fica em cache por versão dos dados
+    e parâmetros.
+
+    A tabela de resultados não guarda a fracção contada de cada distrito:
+    vem no pedido ("contados"); os distritos que não a indicam contam como
+    completos.
+
+    Também não guarda quantos mandatos elege cada distrito: a soma dos
+    'mandatos' das suas linhas só fica completa quando o distrito é
+    declarado, e até lá é zero ou menos. A magnitude vem do pedido
+    ("mandatos"), senão de PROJECTION_SEATS (o mapa oficial da eleição),
+    e só por fim dos dados; os distritos com votos que ficam sem mandatos
+    vêm em "sem_mandatos", porque a projecção nacional fica curta.
+
+"""
+
+
+class ProjectionParameters:
+    """
+    Validated parameters of a projection.
+
+    Attributes:
+        counted (dict): {district: fraction counted, in (0, 1]}
+        seats (dict): {district: mandates}, overriding PROJECTION_SEATS and the data
+        party_to_group (dict): normalised mapping (see simulation.parse_mapping)
+        draws (int), concentration (float), interval (float), seed (int)
+    """
+
+    def __init__(self, counted=None, seats=None, party_to_group=None, draws=PROJECTION_DRAWS,
+                 concentration=PROJECTION_CONCENTRATION, interval=0.9, seed=0):
+        self.counted = counted or {}
+        self.seats = seats or {}
+        self.party_to_group = party_to_group or {}
+        self.draws = draws
+        self.concentration = concentration
+        self.interval = interval
+        self.seed = seed
+
+    @classmethod
+    def parse(cls, body, districts, partidos, max_draws=10 * PROJECTION_DRAWS):
+        """
+        Args:
+            body (dict): {"contados": {district: fraction} or a fraction for all,
+                          "mandatos": {district: n}, "mapeamento": {party: [group]},
+                          "simulacoes": n, "concentracao": k, "intervalo": 0.9,
+                          "semente": n}; every key is optional
+            districts (list): districts of the data
+            partidos (dict): the mapping of the groups when "mapeamento" is missing
+
+        Raises:
+            MappingError: invalid parameters
+        """
+        body = body or {}
+        if not isinstance(body, dict):
+            raise MappingError("expected an object")
+
+        counted = body.get('contados', {})
+        if is_number(counted):
+            counted = {district: counted for district in districts}
+        if not isinstance(counted, dict):
+            raise MappingError("'contados' must be a fraction or {district: fraction}")
+        for district, fraction in counted.items():
+            if district not in districts:
+                raise MappingError(f"unknown district {district!r}")
+            if not is_number(fraction) or not 0 < fraction <= 1:
+                raise MappingError(f"the fraction counted in {district!r} must be in (0, 1]")
+
+        seats = body.get('mandatos', {})
+        if not isinstance(seats, dict) or not all(
+            district in districts and is_integer(n) and n >= 1 for district, n in seats.items()
+        ):
+            raise MappingError("'mandatos' must be {district: mandates}, at least 1 each")
+
+        party_to_group = parse_mapping(body.get('mapeamento', partidos))
+
+        draws = body.get('simulacoes', PROJECTION_DRAWS)
+        if not is_integer(draws) or not 1 <= draws <= max_draws:
+            raise MappingError(f"'simulacoes' must be between 1 and {max_draws:,}")
+        concentration = body.get('concentracao', PROJECTION_CONCENTRATION)
+        if not is_number(concentration) or concentration <= 0:
+            raise MappingError("'concentracao' must be positive")
+        interval = body.get('intervalo', 0.9)
+        if not is_number(interval) or not 0 < interval < 1:
+            raise MappingError("'intervalo' must be in (0, 1)")
+        seed = body.get('semente', 0)
+        if not is_integer(seed):
+            raise MappingError("'semente' must be an integer")
+
+        return cls(counted, seats, party_to_group, draws, concentration, interval, seed)
+
+    def key(self):
+        """Canonical key of the parameters, for the cache"""
+        return (
+            tuple(sorted(self.counted.items())), tuple(sorted(self.seats.items())),
+            mapping_key(self.party_to_group), self.draws, self.concentration, self.interval, self.seed
+        )
+
+
+def sample_final_votes(votes, counted, n_draws, concentration, rng):
+    """
+    Plausible final votes of every district.
+
+    Args:
+        votes (np.ndarray): counted votes, district x party
+        counted (np.ndarray): fraction counted of each district
+        n_draws (int): draws to sample
+        concentration (float): Dirichlet concentration; the higher, the
+                               closer the uncounted votes split like the counted ones
+        rng (np.random.Generator)
+
+    Returns:
+        final (np.ndarray): int64, draw x district x party
+    """
+    totals = votes.sum(axis=1)
+    remaining = totals * (1 - counted) / counted                  # votes still to count
+    shares = votes / np.maximum(totals, 1)[:, None]
+    # Dirichlet(concentration x shares) from normalised gamma draws; parties with
+    # no votes yet keep none (a zero shape parameter gives zero)
+    gamma = rng.standard_gamma(concentration * shares, size=(n_draws,) + votes.shape)
+    split = gamma / np.maximum(gamma.sum(axis=2, keepdims=True), np.finfo(float).tiny)
+    return votes + np.rint(split * remaining[:, None]).astype(np.int64)
+
+
+def seat_summary(national, names, current, interval):
+    """
+    Distribution of the national mandates of each party or group.
+
+    Args:
+        national (np.ndarray): draw x column
+        names (dict): {column: name}
+        current (dict): {name: mandates with the counted votes}
+        interval (float): probability of the reported interval
+
+    Returns:
+        summary (list): [{'name', 'atual', 'media', 'mediana', 'inferior', 'superior',
+                          'distribuicao': {mandates: probability}}], by mean
+    """
+    columns = list(names)
+    low, median, high = np.percentile(
+        national[:, columns], [50 * (1 - interval), 50, 50 * (1 + interval)], axis=0, method='nearest'
+    )
+    means = national[:, columns].mean(axis=0)
+    summary = []
+    for index, column in enumerate(columns):
+        values, counts = np.unique(national[:, column], return_counts=True)
+        summary.append({
+            'name': names[column],
+            'atual': current.get(names[column], 0),
+            'media': round(float(means[index]), 2),
+            'mediana': int(median[index]),
+            'inferior': int(low[index]),
+            'superior': int(high[index]),
+            'distribuicao': {int(value): round(count / len(national), 4) for value, count in zip(values, counts)}
+        })
+    summary.sort(key=lambda x: x['media'], reverse=True)
+    return summary
+
+
+def project(matrix, parameters, chunk_size=1000):
+    """
+    Monte-Carlo projection of the mandates of parties and groups.
+
+    Args:
+        matrix (VoteMatrix): counted votes; its seats are the magnitudes of
+                             the districts missing from parameters.seats
+                             and PROJECTION_SEATS
+        parameters (ProjectionParameters)
+        chunk_size (int): draws allocated at a time
+
+    Returns:
+        projection (dict): 'partidos' and 'grupos' (see seat_summary), the
+                           fraction counted and the mandates of each district,
+                           and 'sem_mandatos', the districts with votes but
+                           no mandates to allocate
+    """
+    rng = np.random.default_rng(parameters.seed)
+    counted = np.array([parameters.counted.get(district, 1.0) for district in matrix.districts])
+    seats = np.array([parameters.seats.get(district, PROJECTION_SEATS.get(district, int(matrix.seats[row])))
+                      for row, district in enumerate(matrix.districts)], dtype=np.int64)
+
+    party_labels = mapping_labels(matrix.parties, [{}])[0]
+    group_labels = mapping_labels(matrix.parties, [parameters.party_to_group])[0]
+    one_hot = [
+        (labels[:, None] == np.arange(len(matrix.parties))).astype(np.int64)  # party x group
+        for labels in (party_labels, group_labels)
+    ]
+
+    # Fully counted districts give the same mandates in every draw: allocated once
+    current = [allocate_scenarios((matrix.votes @ groups)[None], seats)[0] for groups in one_hot]
+    varying = counted < 1
+    national = [
+        np.tile(allocation[~varying].sum(axis=0), (parameters.draws, 1))
+        for allocation in current
+    ]
+    for start in range(0, parameters.draws if varying.any() else 0, chunk_size):
+        n_draws = min(chunk_size, parameters.draws - start)
+        final = sample_final_votes(matrix.votes[varying], counted[varying], n_draws, parameters.concentration, rng)
+        for table, groups in zip(national, one_hot):
+            table[start:start + n_draws] += allocate_scenarios(final @ groups, seats[varying]).sum(axis=1)
+
+    summaries = []
+    for labels, mapping, table, now in zip((party_labels, group_labels), ({}, parameters.party_to_group),
+                                           national, current):
+        names = {
+            column: mapping.get(party, party)
+            for column, party in enumerate(matrix.parties)
+            if labels[column] == column
+        }
+        now = now.sum(axis=0)
+        summaries.append(seat_summary(table, names, {names[column]: int(now[column]) for column in names},
+                                      parameters.interval))
+
+    return {
+        'simulacoes': parameters.draws,
+        'intervalo': parameters.interval,
+        'partidos': summaries[0],
+        'grupos': summaries[1],
+        'distritos': {
+            district: {'contado': float(counted[row]), 'mandatos': int(seats[row])}
+            for row, district in enumerate(matrix.districts)
+        },
+        'sem_mandatos': [
+            district for row, district in enumerate(matrix.districts)
+            if seats[row] == 0 and matrix.votes[row].any()
+        ]
+    }
+
+
+def projection_size(projection):
+    """Approximate memory of a projection: about 100 bytes per distribution entry"""
+    return 100 * sum(len(entry['distribuicao']) + 8 for key in ('partidos', 'grupos') for entry in projection[key])
+
+
+class ProjectionCache:
+    """Memoised project(): an LRU cache keyed by (data version, parameters)"""
+
+    def __init__(self, max_entries=PROJECTION_CACHE_ENTRIES):
+        self.cache = LRUCache(max_entries, 0, projection_size)
+
+    def get_or_project(self, snapshot, parameters):
+        """
+        Returns:
+            projection (dict): see project()
+            cached (bool): whether it came from the cache
+        """
+        return self.cache.get_or_compute(
+            (snapshot.version, parameters.key()),
+            lambda: project(VoteMatrix.from_results(snapshot.results), parameters)
+        )
+
+    def stats(self):
+        return self.cache.stats()
@@ -0,0 +1,143 @@
+from collections import defaultdict
+
+import numpy as np
+
+from results import allocate_districts
+
+
+"""
+    Agregação feita na própria consulta (QUERY_MODE 'pushdown').
+
+    Em vez de descarregar todas as linhas de todas as passagens do scraper,
+    a consulta escolhe a linha mais recente de cada (codigo, partido) com
+    ROW_NUMBER(), junta o grupo de cada partido (PARTIDOS, escrito na
+    consulta como uma tabela de valores) e calcula com funções de janela os
+    votos de cada grupo e os votos e mandatos de cada distrito. Só passam
+    na rede as ~450 linhas (distrito, partido) já agregadas; o método de
+    Hondt continua em Python (allocation.py).
+
+    O resultado é o mesmo do pipeline em Python sobre as linhas mais
+    recentes (incremental.latest_rows), incluindo a ordem: distritos e
+    partidos vêm pela posição na tabela da sua linha mais recente (rowid,
+    ou o número da linha no ficheiro), como no modo 'rows', e o método de
+    Hondt desempata pela ordem. O BigQuery não tem ordem das linhas; aí
+    a ordem é a dos nomes. A consulta usa só SQL comum a BigQuery, DuckDB
+    e SQLite.
+
+"""
+
+AGGREGATE_COLUMNS = [
+    'distrito', 'partido', 'grupo', 'votos', 'mandatos',
+    'votos_grupo', 'votos_distrito', 'mandatos_distrito', 'timestamp'
+]
+
+
+def sql_string(value):
+    """A string literal valid in BigQuery, DuckDB and SQLite"""
+    # Their escapes differ (\\' in BigQuery, '' in the others), so refuse both
+    if "'" in value or '\\' in value:
+        raise ValueError(f"party or group name not supported in the query: {value!r}")
+    return f"'{value}'"
+
+
+def aggregate_query(table, party_to_group, timestamp_order='timestamp', position=None):
+    """
+    The query that returns the latest (district, party) rows, already aggregated.
+
+    Args:
+        table (str): table name as the source writes it in a FROM clause
+        party_to_group (dict): {party: group}; unknown parties stand alone
+        timestamp_order (str): SQL expression that orders the timestamps
+            (SQLite keeps them as text: 'julianday(timestamp)')
+        position (str or None): SQL expression of the place of a row in the
+            table ('rowid'); None when the table has no order (BigQuery)
+
+    Returns:
+        query (str): one row per (distrito, partido), with the AGGREGATE_COLUMNS,
+            in the order of the table as in the 'rows' mode, or of the names
+            without a position
+    """
+    if party_to_group:
+        party_groups = '\n            UNION ALL '.join(
+            f"SELECT {sql_string(party)} AS partido, {sql_string(group)} AS grupo"
+            for party, group in party_to_group.items()
+        )
+    else:
+        party_groups = "SELECT partido, partido AS grupo FROM latest WHERE 1 = 0"
+
+    # Of rows with the same timestamp the last one in the table wins, as in latest_rows()
+    recency_order = f"{timestamp_order} DESC" + (f", {position} DESC" if position else '')
+
+    return f"""
+        WITH latest AS (
+            SELECT codigo, distrito, partido, COALESCE(votos, 0) AS votos,
+                   COALESCE(mandatos, 0) AS mandatos, timestamp, {position or 0} AS posicao,
+                   ROW_NUMBER() OVER (PARTITION BY codigo, partido ORDER BY {recency_order}) AS recency
+            FROM {table}
+        ),
+        party_groups AS (
+            {party_groups}
+        ),
+        latest_rows AS (
+            SELECT l.distrito, l.partido, COALESCE(g.grupo, l.partido) AS grupo,
+                   l.votos, l.mandatos, l.timestamp, l.posicao
+            FROM latest AS l
+            LEFT JOIN party_groups AS g ON g.partido = l.partido
+            WHERE l.recency = 1
+        ),
+        aggregated AS (
+            SELECT distrito, partido, grupo, votos, mandatos,
+                   SUM(votos) OVER (PARTITION BY distrito, grupo) AS votos_grupo,
+                   SUM(votos) OVER (PARTITION BY distrito) AS votos_distrito,
+                   SUM(mandatos) OVER (PARTITION BY distrito) AS mandatos_distrito,
+                   timestamp, posicao,
+                   MIN(posicao) OVER (PARTITION BY distrito) AS posicao_distrito
+            FROM latest_rows
+        )
+        SELECT distrito, partido, grupo, votos, mandatos,
+               votos_grupo, votos_distrito, mandatos_distrito, timestamp
+        FROM aggregated
+        ORDER BY posicao_distrito, distrito, posicao, partido
+    """
+
+
+def ingest_aggregated(aggregated):
+    """
+    The per-district tables of ingest.py, from the aggregated rows.
+
+    Args:
+        aggregated (pd.DataFrame): result of aggregate_query()
+
+    Returns:
+        raw_district_results (defaultdict): {district: {party: {'votos', 'mandatos'}}}
+        grouped_district_results (defaultdict): {district: {group: {'votos', 'mandatos'}}}
+        district_seats (dict): {district: seats}
+    """
+    raw_district_results = defaultdict(lambda: defaultdict(lambda: {'votos': 0, 'mandatos': 0}))
+    grouped_district_results = defaultdict(lambda: defaultdict(lambda: {'votos': 0, 'mandatos': 0}))
+    district_seats = {}
+
+    columns = [
+        aggregated[column].to_numpy(dtype=np.int64, na_value=0).tolist()
+        for column in ['votos', 'mandatos', 'votos_grupo', 'mandatos_distrito']
+    ]
+    for district_name, party_name, group_name, votos, mandatos, votos_grupo, mandatos_distrito in zip(
+        aggregated['distrito'], aggregated['partido'], aggregated['grupo'], *columns
+    ):
+        raw_district_results[district_name][party_name] = {'votos': votos, 'mandatos': mandatos}
+        grouped_district_results[district_name][group_name] = {'votos': votos_grupo, 'mandatos': 0}
+        district_seats[district_name] = mandatos_distrito
+
+    return raw_district_results, grouped_district_results, district_seats
+
+
+def aggregate_pushdown(aggregated):
+    """
+    Same as results.aggregate_districts(), from the aggregated rows.
+
+    Returns:
+        raw_district_results, grouped_district_results, district_allocations
+    """
+    raw_district_results, grouped_district_results, district_seats = ingest_aggregated(aggregated)
+    district_allocations = allocate_districts(raw_district_results, grouped_district_results, district_seats)
+    return raw_district_results, grouped_district_results, district_allocations
@@ -0,0 +1,234 @@
+import numpy as np
+
+from allocation import allocate_hondt, EXCLUDED_GROUPS
+from config import PARTIDOS, INGEST_MODE
+from ingest import INGEST_MODES
+from store import CodedResults, DistrictResultsView
+from timing import phase
+from totals import ElectionTotals
+
+
+"""
+    Agregação dos resultados da tabela resultadosporcirculo: votos por
+    partido e por grupo em cada distrito, mandatos dos grupos pelo método
+    de Hondt e totais nacionais.
+
+"""
+
+KEY_COLUMNS = ['codigo', 'partido']
+
+
+def latest_rows(election_data):
+    """
+    Keeps the most recent row of each (codigo, partido).
+
+    The rows kept stay in their original relative order, so districts and
+    parties keep the order in which they appear in the table.
+    """
+    newest_first = election_data.sort_values('timestamp', kind='stable')
+    kept = newest_first.drop_duplicates(KEY_COLUMNS, keep='last').index
+    return election_data.loc[np.sort(kept)].reset_index(drop=True)
+
+
+def build_results(election_data, timings=None):
+    """
+    Runs the whole aggregation pipeline over the rows of the results table.
+
+    Only the latest row of each (codigo, partido) counts, as in the
+    incremental and pushdown modes: the scraper appends a copy of every
+    district on each sweep.
+
+    Args:
+        election_data (pd.DataFrame): rows with codigo, distrito, partido, votos, mandatos, timestamp
+        timings (dict): optional, receives the 'aggregate' and 'sort' times
+
+    Returns:
+        results (dict): everything the page and the printout need
+    """
+    with phase(timings, 'aggregate'):
+        district_results = aggregate_districts(latest_rows(election_data))
+    return finish_results(*district_results, timings=timings)
+
+
+def aggregate_districts(election_data):
+    """
+    Votes per party and group and group mandates of each district in the rows.
+
+    Args:
+        election_data (pd.DataFrame): rows with distrito, partido, votos, mandatos
+
+    Returns:
+        raw_district_results (dict): {district: {party: {'votos', 'mandatos'}}}
+        grouped_district_results (dict): {district: {group: {'votos', 'mandatos'}}}
+        district_allocations (dict): {district: HondtAllocation}
+    """
+
+    # ======================
+    # 1. DATA PREPARATION
+    # ======================
+
+    party_to_group = party_to_group_mapping()
+
+    # ======================
+    # 2. PROCESS RAW DATA
+    # ======================
+
+    # Raw party results per district and group votos per district
+    # ('columnar' by default, 'rows' for the original iterrows() loop)
+    raw_district_results, grouped_district_results = INGEST_MODES[INGEST_MODE](
+        election_data, party_to_group
+    )
+
+    district_allocations = allocate_districts(raw_district_results, grouped_district_results)
+    return raw_district_results, grouped_district_results, district_allocations
+
+
+def party_to_group_mapping(partidos=PARTIDOS):
+    """{party: group} from a mapping with the shape of PARTIDOS"""
+    # Build party-to-group mapping (more efficient lookup)
+    party_to_group = {}
+    for party_name, group_labels in partidos.items():
+        # Each party maps to its group label (first/only item in list)
+        group_name = group_labels[0]
+        party_to_group[party_name] = group_name
+    return party_to_group
+
+
+def allocate_districts(raw_district_results, grouped_district_results, district_seats=None):
+    """
+    D'Hondt allocation of the group mandates of each district.
+
+    Fills in the 'mandatos' of grouped_district_results.
+
+    Args:
+        district_seats (dict or None): {district: seats}; by default the sum
+            of the party mandatos of the district
+
+    Returns:
+        district_allocations (dict): {district: HondtAllocation}
+    """
+
+    # ======================
+    # 3. CALCULATE GROUP mandatos (D'HONDT)
+    # ======================
+
+    # Full allocation per district, with the ordered quotients for the
+    # "last seat" / "next seat" margins
+    district_allocations = {}
+
+    for district_name in grouped_district_results:
+        # Get total mandatos to allocate in this district
+        if district_seats is not None:
+            total_mandatos_in_district = district_seats[district_name]
+        else:
+            total_mandatos_in_district = sum(
+                party_data['mandatos']
+                for party_data in raw_district_results[district_name].values()
+            )
+
+        # Get eligible groups (exclude blanks/nulls)
+        eligible_groups = {
+            group_name: group_data['votos']
+            for group_name, group_data in grouped_district_results[district_name].items()
+            if group_name not in EXCLUDED_GROUPS
+        }
+
+        # D'Hondt allocation (priority queue, same tie-breaking as max())
+        allocation = allocate_hondt(eligible_groups, total_mandatos_in_district)
+        district_allocations[district_name] = allocation
+        group_mandatos = allocation.mandatos
+
+        # Store results
+        for group_name, mandatos in group_mandatos.items():
+            grouped_district_results[district_name][group_name]['mandatos'] = mandatos
+
+    return district_allocations
+
+
+def finish_results(raw_district_results, grouped_district_results, district_allocations, timings=None,
+                   totals=None):
+    """
+    Sorts the districts and adds the national totals.
+
+    The per-district tables are coded into dense arrays (see store.py); the
+    results hold those and present them as read-only views, and a copy of
+    district_allocations. The dicts passed in are neither modified nor
+    shared with the results, so they can be kept and updated district by
+    district (see incremental.py).
+
+    Args:
+        totals (ElectionTotals or None): totals already kept up to date
+            district by district; computed here in one pass if None
+
+    Returns:
+        results (dict): everything the page and the printout need
+    """
+    with phase(timings, 'aggregate'):
+
+        # ======================
+        # 4. NATIONAL TOTALS
+        # ======================
+
+        # Party and group sums, blank/null votes and district totals, in one
+        # pass over the districts (no national row counted back in)
+        if totals is None:
+            totals = ElectionTotals.from_districts(raw_district_results, grouped_district_results)
+
+    with phase(timings, 'sort'):
+
+        # Sort parties and groups by votes within each district
+        raw_district_results = DistrictResultsView(CodedResults.from_nested(raw_district_results))
+        grouped_district_results = DistrictResultsView(CodedResults.from_nested(grouped_district_results))
+
+        # ======================
+        # 5. PREPARE FINAL RESULTS
+        # ======================
+
+        # Sorted by votes, without blank/null votes, with the vote shares
+        sorted_parties = totals.ranking(totals.parties)
+        sorted_groups = totals.ranking(totals.groups)
+
+    return {
+        'raw_district_results': raw_district_results,
+        'grouped_district_results': grouped_district_results,
+        'district_allocations': dict(district_allocations),
+        'district_totals': totals.district_shares(),
+        'sorted_parties': sorted_parties,
+        'sorted_groups': sorted_groups,
+        'final_group_results': sorted_groups,
+        'blank_votes': totals.blank_votes,
+        'null_votes': totals.null_votes,
+        'total_votes': totals.total_votes,
+        'total_mandates': totals.total_mandates
+    }
+
+
+def print_results(results):
+    """Prints the national results by group and the special categories"""
+
+    # ======================
+    # 6. PRINT FORMATTED RESULTS
+    # ======================
+
+    print("\n=== ELECTION RESULTS BY GROUP ===")
+    print(f"{'Group':<25} | {'votos':>12} | {'Vote %':>7} | {'mandatos':>6}")
+    print("-" * 60)
+
+    for group in results['final_group_results']:
+        print(
+            f"{group['name']:<25} | "
+            f"{group['votos']:>12,} | "
+            f"{group['vote_share']:>6.2f}% | "
+            f"{group['mandatos']:>6}"
+        )
+
+    total_votes = results['total_votes']
+    blank_votes = results['blank_votes']
+    null_votes = results['null_votes']
+    print (total_votes, results['total_mandates'])
+
+    # Print special categories
+    print("\n=== SPECIAL CATEGORIES ===")
+    print(f"Blank votos: {blank_votes:,}")
+    print(f"Null votos: {null_votes:,}")
+    print(f"Total valid votos: {total_votes-blank_votes-null_votes:,}")
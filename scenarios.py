@@ -0,0 +1,259 @@
+import argparse
+import itertools
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from allocation import EXCLUDED_GROUPS
+
+
+"""
+    Avaliação em lote de muitos cenários de coligação.
+
+    Um cenário diz a que grupo pertence cada partido: uma linha de uma
+    matriz de rótulos (cenário x partido, -1 para os votos em branco e
+    nulos). Os votos dos grupos saem de uma só multiplicação de matrizes
+    (cenário x distrito x grupo) e os mandatos do método de Hondt de
+    operações vectoriais sobre todo o bloco: cada grupo recebe primeiro a
+    sua quota inteira e os poucos mandatos que faltam são dados ronda a
+    ronda ao maior quociente seguinte de cada par (cenário, distrito); os
+    empates vão para o grupo que vem primeiro, como em
+    allocation.allocate_hondt. Os cenários são
+    processados em blocos e os resultados saem bloco a bloco (gerador),
+    sem guardar tudo em memória.
+
+    python scenarios.py --sizes 2 3 --top 20   (melhores fusões de 2 ou 3 partidos)
+    python scenarios.py --sizes 2 3 4 --workers 8   (vários processos, ver sweeps.py)
+
+"""
+
+# One block of evaluated scenarios
+ScenarioChunk = namedtuple('ScenarioChunk', ['start', 'labels', 'group_votes', 'seats'])
+
+
+class VoteMatrix:
+    """
+    Read-only votes of every (district, party), as the scenarios need them.
+
+    Attributes:
+        districts (list), parties (list): names of the rows and columns
+        votes (np.ndarray): int64, district x party
+        seats (np.ndarray): int64, mandates of each district
+    """
+
+    def __init__(self, districts, parties, votes, seats):
+        self.districts = districts
+        self.parties = parties
+        self.votes = votes
+        self.seats = seats
+
+    @classmethod
+    def from_results(cls, results):
+        """From the results of a snapshot (their raw_district_results view, see store.py)"""
+        coded = results['raw_district_results'].coded
+        return cls(coded.districts, coded.names, coded.votes, coded.seats.sum(axis=1))
+
+
+def mapping_labels(parties, mappings):
+    """
+    Label matrix of party -> group mappings.
+
+    Args:
+        parties (list): column order (VoteMatrix.parties)
+        mappings (list): [{party: group}]; parties left out stand alone
+
+    Returns:
+        labels (np.ndarray): int, scenario x party; a group's label is the
+            column of its first party, blank/null votes get -1
+    """
+    labels = np.empty((len(mappings), len(parties)), dtype=np.int64)
+    for row, party_to_group in enumerate(mappings):
+        group_ids = {}
+        for column, party in enumerate(parties):
+            if party in EXCLUDED_GROUPS:
+                labels[row, column] = -1
+            else:
+                labels[row, column] = group_ids.setdefault(party_to_group.get(party, party), column)
+    return labels
+
+
+def merge_labels(parties, merges):
+    """
+    Label matrix where, in each scenario, one set of parties runs together
+    and every other party stands alone.
+
+    Args:
+        merges (list): [tuple of party names]
+    """
+    base = np.where(np.isin(parties, EXCLUDED_GROUPS), -1, np.arange(len(parties)))
+    labels = np.tile(base, (len(merges), 1))
+    column = {party: index for index, party in enumerate(parties)}
+    for row, merged in enumerate(merges):
+        columns = [column[party] for party in merged]
+        if columns:
+            labels[row, columns] = min(columns)
+    return labels
+
+
+def party_merges(parties, sizes=(2, 3)):
+    """Every set of `size` parties (blank/null votes left out), for each size"""
+    eligible = [party for party in parties if party not in EXCLUDED_GROUPS]
+    return [merged for size in sizes for merged in itertools.combinations(eligible, size)]
+
+
+def group_votes(votes, labels):
+    """
+    Votes of each group in each district, for a block of scenarios.
+
+    Args:
+        votes (np.ndarray): district x party
+        labels (np.ndarray): scenario x party
+
+    Returns:
+        group_votes (np.ndarray): int64, scenario x district x group, where
+            group g collects the parties labelled g
+    """
+    n_parties = votes.shape[1]
+    one_hot = labels[:, :, None] == np.arange(n_parties)  # scenario x party x group
+    return np.einsum('dp,npg->ndg', votes, one_hot.astype(np.int64))
+
+
+def allocate_scenarios(group_votes, seats):
+    """
+    D'Hondt mandates of every scenario and district at once.
+
+    Every group first gets its lower quota, floor(votes x seats / total),
+    which D'Hondt never goes below. The few mandates still free (fewer than
+    the number of groups) are then handed out one round at a time: in each
+    round every (scenario, district) pair with a free mandate gives it to
+    the group with the largest next quotient votes / (mandates + 1). argmax
+    picks the first group on ties, as allocation.allocate_hondt does.
+
+    Args:
+        group_votes (np.ndarray): scenario x district x group
+        seats (np.ndarray): mandates of each district
+
+    Returns:
+        mandates (np.ndarray): int64, scenario x district x group
+    """
+    seats = np.asarray(seats, dtype=np.int64)[None, :]
+    totals = group_votes.sum(axis=2)
+    mandates = group_votes * seats[:, :, None] // np.maximum(totals, 1)[:, :, None]
+    free = seats - mandates.sum(axis=2)
+
+    for _ in range(int(free.max(initial=0))):
+        quotients = group_votes / (mandates + 1)
+        best = quotients.argmax(axis=2)[:, :, None]
+        # Zero quotients never win: columns of the one-hot that no party maps to hold zeros
+        wins = (free[:, :, None] > 0) & (np.take_along_axis(quotients, best, axis=2) > 0)
+        np.put_along_axis(mandates, best, np.take_along_axis(mandates, best, axis=2) + wins, axis=2)
+        free = free - wins[:, :, 0]
+    return mandates
+
+
+def evaluate_scenarios(matrix, labels, chunk_size=256):
+    """
+    Evaluates the scenarios block by block.
+
+    Args:
+        matrix (VoteMatrix)
+        labels (np.ndarray): scenario x party, see mapping_labels / merge_labels
+        chunk_size (int): scenarios per block (memory grows with it)
+
+    Yields:
+        ScenarioChunk: start row, labels, group votes and mandates of the block
+    """
+    for start in range(0, len(labels), chunk_size):
+        block = labels[start:start + chunk_size]
+        votes = group_votes(matrix.votes, block)
+        yield ScenarioChunk(start, block, votes, allocate_scenarios(votes, matrix.seats))
+
+
+def national_seats(matrix, labels, chunk_size=256):
+    """
+    National mandates of every scenario.
+
+    Returns:
+        seats (np.ndarray): int64, scenario x group (the label of the group)
+    """
+    national = np.zeros(labels.shape, dtype=np.int64)
+    for chunk in evaluate_scenarios(matrix, labels, chunk_size):
+        national[chunk.start:chunk.start + len(chunk.labels)] = chunk.seats.sum(axis=1)
+    return national
+
+
+def rank_merges(matrix, sizes=(2, 3), chunk_size=256, engine=national_seats):
+    """
+    National mandates gained by every merge of `sizes` parties.
+
+    Args:
+        engine (callable): (matrix, labels, chunk_size) -> national seats,
+            national_seats() or a process pool (see sweeps.py)
+
+    Returns:
+        ranking (list): [(parties, mandates together, mandates apart)], most gained first
+    """
+    merges = party_merges(matrix.parties, sizes)
+    return merge_ranking(matrix, merges, engine(matrix, merge_labels(matrix.parties, merges), chunk_size))
+
+
+def merge_ranking(matrix, merges, national):
+    """
+    Args:
+        merges (list): [tuple of party names]
+        national (np.ndarray): national seats of merge_labels(matrix.parties, merges)
+
+    Returns:
+        ranking (list): see rank_merges()
+    """
+    base = national_seats(matrix, merge_labels(matrix.parties, [()]))[0]
+    column = {party: index for index, party in enumerate(matrix.parties)}
+
+    ranking = []
+    for row, merged in enumerate(merges):
+        columns = [column[party] for party in merged]
+        ranking.append((merged, int(national[row, min(columns)]), int(base[columns].sum())))
+    ranking.sort(key=lambda entry: entry[1] - entry[2], reverse=True)
+    return ranking
+
+
+def print_ranking(ranking, top):
+    print(f"\n{'Merge':<40} | {'together':>8} | {'apart':>5} | {'gain':>4}")
+    print("-" * 66)
+    for merged, together, apart in ranking[:top]:
+        print(f"{' + '.join(merged):<40} | {together:>8} | {apart:>5} | {together - apart:>+4}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mandates gained by merging parties")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[2, 3], help="parties per merge")
+    parser.add_argument('--top', type=int, default=20)
+    parser.add_argument('--chunk-size', type=int, default=256)
+    parser.add_argument('--workers', type=int, default=1, help="processes; more than 1 uses sweeps.py")
+    args = parser.parse_args()
+
+    from loader import ResultsLoader
+    matrix = VoteMatrix.from_results(ResultsLoader(refresh_seconds=0).load_now())
+
+    if args.workers > 1:
+        from sweeps import Sweeper
+        sweeper = Sweeper(args.workers)
+
+        def engine(matrix, labels, chunk_size):
+            return sweeper.national_seats(
+                matrix, labels, chunk_size,
+                progress=lambda done, total: print(f"\r{done:,} / {total:,} scenarios", end='', flush=True)
+            )
+    else:
+        engine = national_seats
+
+    start = time.perf_counter()
+    ranking = rank_merges(matrix, args.sizes, args.chunk_size, engine)
+    elapsed = time.perf_counter() - start
+    print(f"\n{len(ranking):,} merges in {elapsed:.2f} s ({len(ranking) / elapsed:,.0f} scenarios/s)")
+    print_ranking(ranking, args.top)
+
+
+if __name__ == '__main__':
+    main()
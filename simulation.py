@@ -0,0 +1,336 @@
+import hashlib
+import json
+from collections import namedtuple
+
+from allocation import allocate, METHODS, QUOTA_METHODS, EXCLUDED_GROUPS
+from config import SIMULATION_CACHE_ENTRIES, SIMULATION_CACHE_BYTES
+from lru import LRUCache
+
+
+"""
+    Simulação de coligações no servidor (POST /api/simulate).
+
+    Recebe um mapeamento partido -> grupo com o formato de PARTIDOS, agrega
+    os votos de cada distrito por grupo e atribui os mandatos com o mesmo
+    motor do resto da aplicação. O método (Hondt por omissão, ver
+    allocation.METHODS), um limiar legal, por distrito ou nacional, e o
+    modelo de círculos vêm na query string. Os resultados ficam num cache
+    LRU, indexados pela versão dos dados, por um hash canónico do
+    mapeamento e pelas regras.
+
+    Modelos: 'distritos' (só os círculos distritais), 'nacional' (um só
+    círculo nacional com todos os mandatos) e 'compensacao' (dois níveis:
+    os distritos perdem, em proporção, os mandatos de um círculo nacional
+    de compensação, que os reparte continuando a ordenação nacional de
+    cada grupo a partir dos mandatos que ele já ganhou nos distritos).
+    A fase distrital (votos por grupo e ordenação dos quocientes de cada
+    distrito) fica em cache à parte e serve todos os modelos: com um método
+    de divisores, um distrito com menos mandatos é só o início da mesma
+    ordenação.
+
+"""
+
+NATIONAL_KEY = 'Total nacional'  # the key static/js/app.js reads
+
+COMPENSATION_KEY = 'Círculo de compensação'
+NATIONAL_CIRCLE_KEY = 'Círculo nacional'
+
+# Electoral rules of a simulation: a method of allocation.METHODS, the share
+# of the valid votes ('distrito' or 'nacional') a group needs to run, the
+# model of the circles and the mandates of the compensation circle
+Rules = namedtuple('Rules', ['method', 'threshold', 'scope', 'model', 'compensation'])
+DEFAULT_RULES = Rules('dhondt', 0.0, 'distrito', 'distritos', 0)
+THRESHOLD_SCOPES = ('distrito', 'nacional')
+MODELS = ('distritos', 'compensacao', 'nacional')
+
+
+class MappingError(ValueError):
+    """The mapping sent by the client does not have the shape of PARTIDOS"""
+
+
+def is_number(value):
+    """int or float, but not bool (json true/false would pass as 1/0)"""
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def is_integer(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def parse_mapping(mapping):
+    """
+    Validates a mapping with the shape of PARTIDOS and reduces it to a
+    normalised {party: group}.
+
+    Normalisation makes equivalent mappings equal: labels are trimmed, empty
+    or null groups mean the party stands alone, blank and null votes always
+    stay on their own (they never take part in the allocation), and parties
+    that stand alone are left out, since unknown parties stand alone anyway.
+
+    Args:
+        mapping (dict): {party: [group]} (a plain string or null is also accepted)
+
+    Returns:
+        party_to_group (dict): only the parties that join a group
+    """
+    if not isinstance(mapping, dict) or not mapping:
+        raise MappingError("expected a non-empty object {party: [group]}")
+
+    party_to_group = {}
+    for party, groups in mapping.items():
+        if isinstance(groups, list):
+            groups = groups[0] if groups else None
+        if groups is None:
+            groups = ''
+        if not isinstance(groups, str):
+            raise MappingError(f"invalid group for {party!r}")
+        group = groups.strip()
+        if party in EXCLUDED_GROUPS or not group or group == party:
+            continue
+        party_to_group[party] = group
+    return party_to_group
+
+
+def parse_rules(args, total_seats=None):
+    """
+    Electoral rules from the query string of a request.
+
+    Args:
+        args (dict): 'metodo' (a key of METHODS), 'limiar' (a fraction of
+                     the valid votes), 'limiar_ambito' ('distrito' or
+                     'nacional'), 'modelo' (one of MODELS) and 'compensacao'
+                     (mandates of the compensation circle)
+        total_seats (int or None): mandates of the election; the compensation
+                                   circle must leave at least one to the districts
+
+    Returns:
+        Rules
+    """
+    method = args.get('metodo', DEFAULT_RULES.method)
+    if method not in METHODS:
+        raise MappingError(f"unknown method {method!r}; expected one of {', '.join(METHODS)}")
+    try:
+        threshold = float(args.get('limiar', DEFAULT_RULES.threshold))
+    except ValueError:
+        raise MappingError("'limiar' must be a number")
+    if not 0 <= threshold < 1:
+        raise MappingError("'limiar' must be in [0, 1)")
+    scope = args.get('limiar_ambito', DEFAULT_RULES.scope)
+    if scope not in THRESHOLD_SCOPES:
+        raise MappingError(f"'limiar_ambito' must be one of {', '.join(THRESHOLD_SCOPES)}")
+    model = args.get('modelo', DEFAULT_RULES.model)
+    if model not in MODELS:
+        raise MappingError(f"'modelo' must be one of {', '.join(MODELS)}")
+    compensation = 0
+    if model == 'compensacao':
+        try:
+            compensation = int(args.get('compensacao', 0))
+        except ValueError:
+            raise MappingError("'compensacao' must be an integer")
+        if compensation < 1:
+            raise MappingError("the 'compensacao' model needs 'compensacao' >= 1 mandates")
+        if total_seats is not None and compensation >= total_seats:
+            raise MappingError(f"'compensacao' must be less than the {total_seats} mandates of the election")
+    return Rules(method, threshold, scope, model, compensation)
+
+
+def eligible_groups(group_votes, rules, national_votes=None):
+    """
+    Groups that take part in the allocation of a district.
+
+    Args:
+        group_votes (dict): {group: votes} of the district
+        national_votes (dict): {group: votes} over all districts, for a national threshold
+
+    Returns:
+        eligible (dict): {group: votes}, without blank/null votes and the
+                         groups below the threshold, in the input order
+    """
+    eligible = {group: votos for group, votos in group_votes.items() if group not in EXCLUDED_GROUPS}
+    if not rules.threshold:
+        return eligible
+    if rules.scope == 'nacional':
+        valid = sum(votos for group, votos in national_votes.items() if group not in EXCLUDED_GROUPS)
+        return {group: votos for group, votos in eligible.items()
+                if national_votes[group] >= rules.threshold * valid}
+    valid = sum(eligible.values())
+    return {group: votos for group, votos in eligible.items() if votos >= rules.threshold * valid}
+
+
+def mapping_key(party_to_group):
+    """Canonical hash of a normalised mapping: independent of key order"""
+    canonical = json.dumps(sorted(party_to_group.items()), ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+# Everything the models share for a (mapping, method, threshold)
+DistrictStage = namedtuple('DistrictStage', ['votes', 'seats', 'national_votes', 'allocations'])
+
+
+def district_stage(raw_district_results, party_to_group, rules=DEFAULT_RULES):
+    """
+    Group votes of every district and their allocation with all the
+    district's mandates.
+
+    Args:
+        raw_district_results (dict): {district: {party: {'votos', 'mandatos'}}}
+        party_to_group (dict): {party: group}; unknown parties stand alone
+        rules (Rules): only the method and the threshold are used
+
+    Returns:
+        DistrictStage: votes ({district: {group: votes}}), seats ({district:
+            mandates}), national_votes ({group: votes}) and allocations
+            ({district: HondtAllocation})
+    """
+    district_votes = {}
+    district_seats = {}
+    national_votes = {}
+
+    for district_name, parties in raw_district_results.items():
+        if not parties:
+            continue  # A district without rows
+
+        group_votes = {}
+        total_mandatos_in_district = 0
+        for party_name, party_data in parties.items():
+            group_name = party_to_group.get(party_name, party_name)
+            group_votes[group_name] = group_votes.get(group_name, 0) + party_data['votos']
+            total_mandatos_in_district += party_data['mandatos']
+            national_votes[group_name] = national_votes.get(group_name, 0) + party_data['votos']
+
+        district_votes[district_name] = group_votes
+        district_seats[district_name] = total_mandatos_in_district
+
+    # A national threshold needs every district before any allocation
+    allocations = {
+        district_name: allocate(
+            eligible_groups(group_votes, rules, national_votes), district_seats[district_name], rules.method
+        )
+        for district_name, group_votes in district_votes.items()
+    }
+    return DistrictStage(district_votes, district_seats, national_votes, allocations)
+
+
+def tier_seats(stage, rules=DEFAULT_RULES):
+    """
+    Mandates of every district, and of the national circle, under a model.
+
+    Returns:
+        district_mandates (dict): {district: {group: mandates}}
+        national_circle (dict or None): {group: mandates} of the national or
+                                        compensation circle
+    """
+    if rules.model == 'distritos':
+        return {name: allocation.mandatos for name, allocation in stage.allocations.items()}, None
+
+    total_seats = sum(stage.seats.values())
+    national_rules = rules._replace(scope='nacional')
+    national_eligible = eligible_groups(stage.national_votes, national_rules, stage.national_votes)
+    if rules.model == 'nacional':
+        circle = allocate(national_eligible, total_seats, rules.method, 0).mandatos
+        return {name: {} for name in stage.allocations}, circle
+
+    # The districts keep total - compensation mandates, split in proportion to their size
+    district_total = max(total_seats - rules.compensation, 0)
+    reduced = allocate(stage.seats, district_total, 'hare', 0).mandatos if stage.seats else {}
+    district_mandates = {}
+    for name, allocation in stage.allocations.items():
+        if rules.method in QUOTA_METHODS:  # the quota changes with the mandates: a new allocation
+            eligible = eligible_groups(stage.votes[name], rules, stage.national_votes)
+            district_mandates[name] = allocate(eligible, reduced[name], rules.method, 0).mandatos
+        else:
+            district_mandates[name] = allocation.first(reduced[name])
+
+    won = {}
+    for mandatos in district_mandates.values():
+        for group, seats in mandatos.items():
+            won[group] = won.get(group, 0) + seats
+    circle = allocate(national_eligible, total_seats - district_total, rules.method, 0,
+                      won=won, total_seats=total_seats).mandatos
+    return district_mandates, circle
+
+
+def tier_results(stage, rules=DEFAULT_RULES):
+    """
+    Results of a model, in the format of simulate().
+    """
+    district_mandates, circle = tier_seats(stage, rules)
+    national = {}
+    results = {}
+    for district_name, group_votes in stage.votes.items():
+        mandatos_in_district = district_mandates[district_name]
+        district_result = {}
+        for group_name, votos in sorted(group_votes.items(), key=lambda x: x[1], reverse=True):
+            mandatos = mandatos_in_district.get(group_name, 0)
+            district_result[group_name] = {'votos': votos, 'mandatos': mandatos}
+            national_group = national.setdefault(group_name, {'votos': 0, 'mandatos': 0})
+            national_group['votos'] += votos
+            national_group['mandatos'] += mandatos
+        results[district_name] = district_result
+
+    if circle is not None:
+        results[NATIONAL_CIRCLE_KEY if rules.model == 'nacional' else COMPENSATION_KEY] = {
+            group_name: {'votos': stage.national_votes[group_name], 'mandatos': mandatos}
+            for group_name, mandatos in sorted(circle.items(), key=lambda x: x[1], reverse=True)
+            if mandatos
+        }
+        for group_name, mandatos in circle.items():
+            national[group_name]['mandatos'] += mandatos
+
+    results[NATIONAL_KEY] = dict(sorted(national.items(), key=lambda x: x[1]['votos'], reverse=True))
+    return results
+
+
+def simulate(raw_district_results, party_to_group, rules=DEFAULT_RULES):
+    """
+    Group votes and mandates of every district for a party -> group mapping.
+
+    Args:
+        raw_district_results (dict): {district: {party: {'votos', 'mandatos'}}}
+        party_to_group (dict): {party: group}; unknown parties stand alone
+        rules (Rules): method, threshold and model
+
+    Returns:
+        results (dict): {district: {group: {'votos', 'mandatos'}}}, sorted by
+                        votes, the national or compensation circle when the
+                        model has one, and the national totals under 'Total nacional'
+    """
+    return tier_results(district_stage(raw_district_results, party_to_group, rules), rules)
+
+
+def results_size(results):
+    """Approximate memory of a simulation: about 200 bytes per district/group entry"""
+    return 200 * sum(len(groups) for groups in results.values())
+
+
+class SimulationCache:
+    """
+    Memoised simulate(): an LRU cache keyed by (data version, mapping hash, rules).
+
+    Entries of older data versions are never hit again and age out of the LRU.
+    """
+
+    def __init__(self, max_entries=SIMULATION_CACHE_ENTRIES, max_bytes=SIMULATION_CACHE_BYTES):
+        self.cache = LRUCache(max_entries, max_bytes, results_size)
+        self.stages = LRUCache(max(1, max_entries // 4))
+
+    def get_or_simulate(self, snapshot, party_to_group, rules=DEFAULT_RULES):
+        """
+        Returns:
+            results (dict): see simulate()
+            cached (bool): whether the results came from the cache
+        """
+        key = mapping_key(party_to_group)
+
+        def compute():
+            # Models with the same method and threshold share the district stage
+            stage, _ = self.stages.get_or_compute(
+                (snapshot.version, key, rules.method, rules.threshold, rules.scope),
+                lambda: district_stage(snapshot.results['raw_district_results'], party_to_group, rules)
+            )
+            return tier_results(stage, rules)
+
+        return self.cache.get_or_compute((snapshot.version, key, rules), compute)
+
+    def stats(self):
+        return self.cache.stats()
@@ -0,0 +1,155 @@
+import argparse
+import glob
+import os
+import time
+
+import pandas as pd
+import pyarrow as pa
+
+from config import SNAPSHOT_CACHE, SNAPSHOT_DIR, SNAPSHOT_TTL, SNAPSHOT_OFFLINE, TABELA
+from timing import phase
+
+
+"""
+    Cache local da tabela resultadosporcirculo em ficheiros Arrow IPC.
+
+    Cada ficheiro guarda o resultado completo da consulta e tem no nome o
+    maior timestamp da tabela, e.g. resultadosporcirculo-20250518T233000.arrow.
+    No arranque lê-se o ficheiro mais recente (memory-mapped). Enquanto for
+    mais novo do que SNAPSHOT_TTL segundos não se contacta o BigQuery;
+    depois disso só se descarrega a tabela de novo se MAX(timestamp) mudou.
+    Com SNAPSHOT_OFFLINE=1 a aplicação usa apenas o cache.
+
+    python snapshot_cache.py             (mostra o ficheiro em uso)
+    python snapshot_cache.py --refresh   (força uma cópia nova)
+
+"""
+
+TIMESTAMP_FORMAT = '%Y%m%dT%H%M%S'
+
+
+def snapshot_key(election_data):
+    """Max timestamp of the rows, as used in the file name"""
+    if election_data.empty:
+        return 'empty'
+    return pd.Timestamp(election_data['timestamp'].max()).strftime(TIMESTAMP_FORMAT)
+
+
+def snapshot_path(key, directory=SNAPSHOT_DIR):
+    return os.path.join(directory, f'{TABELA}-{key}.arrow')
+
+
+def latest_snapshot_path(directory=SNAPSHOT_DIR):
+    """Path of the snapshot with the highest key, or None"""
+    paths = sorted(glob.glob(os.path.join(directory, f'{TABELA}-*.arrow')))
+    return paths[-1] if paths else None
+
+
+def snapshot_age(path):
+    """Seconds since the snapshot was written or last confirmed current"""
+    return time.time() - os.path.getmtime(path)
+
+
+def read_snapshot(path):
+    """
+    Reads a snapshot file through a memory map.
+
+    Returns:
+        election_data (pd.DataFrame): same columns and dtypes as the BigQuery download
+    """
+    with pa.memory_map(path, 'r') as source:
+        table = pa.ipc.open_file(source).read_all()
+    return table.to_pandas(types_mapper={pa.int64(): pd.Int64Dtype()}.get)
+
+
+def write_snapshot(election_data, directory=SNAPSHOT_DIR):
+    """
+    Writes the rows to a new snapshot file (atomically) and removes older ones.
+
+    Returns:
+        path (str): the snapshot file
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = snapshot_path(snapshot_key(election_data), directory)
+    table = pa.Table.from_pandas(election_data, preserve_index=False)
+
+    temporary_path = f'{path}.{os.getpid()}.tmp'
+    with pa.OSFile(temporary_path, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(temporary_path, path)
+
+    for old_path in glob.glob(os.path.join(directory, f'{TABELA}-*.arrow')):
+        if old_path != path:
+            os.remove(old_path)
+    return path
+
+
+def save_snapshot(election_data):
+    """write_snapshot() for callers that must not fail on a read-only disk"""
+    if not SNAPSHOT_CACHE:
+        return None
+    try:
+        return write_snapshot(election_data)
+    except OSError as e:
+        print(f"Could not write snapshot: {e}")
+        return None
+
+
+def mark_current(path):
+    """Restarts the TTL of a snapshot that is still up to date"""
+    os.utime(path)
+
+
+def cached_election_data(fetch, fetch_max_timestamp, refresh=False, timings=None):
+    """
+    Returns the election rows, from the local snapshot when possible.
+
+    Args:
+        fetch (callable): downloads the whole table, returns a DataFrame
+        fetch_max_timestamp (callable): returns MAX(timestamp) of the table
+        refresh (bool): ignore the TTL and check the table now
+        timings (dict): optional, receives the 'snapshot' read time
+
+    Returns:
+        election_data (pd.DataFrame)
+        source (str): 'cache', 'cache (confirmed)' or 'bigquery'
+    """
+    path = latest_snapshot_path()
+
+    if path and (SNAPSHOT_OFFLINE or (not refresh and snapshot_age(path) < SNAPSHOT_TTL)):
+        with phase(timings, 'snapshot'):
+            return read_snapshot(path), 'cache'
+    if SNAPSHOT_OFFLINE:
+        raise FileNotFoundError(f"SNAPSHOT_OFFLINE is set but there is no snapshot in {SNAPSHOT_DIR}")
+
+    if path:
+        max_timestamp = fetch_max_timestamp()
+        if max_timestamp is not None and path == snapshot_path(pd.Timestamp(max_timestamp).strftime(TIMESTAMP_FORMAT)):
+            mark_current(path)
+            with phase(timings, 'snapshot'):
+                return read_snapshot(path), 'cache (confirmed)'
+
+    election_data = fetch()
+    save_snapshot(election_data)  # A read-only disk must not stop the app from serving
+    return election_data, 'bigquery'
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local snapshot of the results table")
+    parser.add_argument('--refresh', action='store_true', help="download the table and write a new snapshot")
+    args = parser.parse_args()
+
+    if args.refresh:
+        from loader import fetch_election_data
+        print(write_snapshot(fetch_election_data()))
+
+    path = latest_snapshot_path()
+    if path is None:
+        print(f"No snapshot in {SNAPSHOT_DIR}")
+    else:
+        print(f"{path}: {len(read_snapshot(path))} rows, {snapshot_age(path):.0f} s old")
+
+
+if __name__ == '__main__':
+    main()
@@ -6,6 +6,25 @@ if (document.getElementById('coligs').classList.contains('visible-table')) {
 
 let results = {};
 
+let electionDataRequest = null;
+
+function loadElectionData() {
+    // Per-district data from /api/dados, fetched once and only when needed
+    // (the browser revalidates it with its ETag)
+    if (!electionDataRequest) {
+        electionDataRequest = fetch('/api/dados')
+            .then(response => {
+                if (!response.ok) throw new Error(`HTTP ${response.status}`);
+                return response.json();
+            })
+            .catch(error => {
+                electionDataRequest = null;  // Try again next time
+                throw error;
+            });
+    }
+    return electionDataRequest;
+}
+
 
 document.getElementById('coligs-btn').addEventListener('click', () => {
     window.location.reload(true);
@@ -35,7 +54,7 @@ document.getElementById('coligs-btn').addEventListener('click', () => {
 });
 
 
-document.getElementById('resultados-btn').addEventListener('click', () => {
+document.getElementById('resultados-btn').addEventListener('click', async () => {
     const inputs = document.querySelectorAll('.group-input');
     const partidos_novo = {};
     
@@ -48,14 +67,18 @@ document.getElementById('resultados-btn').addEventListener('click', () => {
     partidos_novo['Votos nulos'] = ['Votos nulos'];
     partidos = partidos_novo;
     
-    const baseData = {
-        partidos: partidos,
-        districts: JSON.parse(document.getElementById('election-data').dataset.districts),
-    };
-    let calculator = new ElectionCalculator(baseData);
-    calculator.updateParties(partidos_novo);
-    
-    results = calculator.getFullResults();
+    results = await simulateOnServer(partidos_novo);
+    if (!results) {
+        // Fallback: compute in the browser
+        const baseData = {
+            partidos: partidos,
+            districts: await getElectionData(),
+        };
+        let calculator = new ElectionCalculator(baseData);
+        calculator.updateParties(partidos_novo);
+        
+        results = calculator.getFullResults();
+    }
     
     // Send updated data to the server (example: console.log for now)
     // console.log(compareSorted(partidos, partidos_novo));
@@ -96,13 +119,31 @@ document.getElementById('resultados-btn').addEventListener('click', () => {
     }
 });
 
+async function simulateOnServer(partidosNovo) {
+    // Group votes and D'Hondt mandates computed (and cached) by the server;
+    // ?metodo=, ?limiar= and ?limiar_ambito= in the page URL choose other rules
+    try {
+        const response = await fetch('/api/simulate' + window.location.search, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify(partidosNovo)
+        });
+        if (!response.ok) throw new Error(`HTTP ${response.status}`);
+        const data = await response.json();
+        return data.resultados;
+    } catch (error) {
+        console.error('Server simulation failed, computing in the browser:', error);
+        return null;
+    }
+}
+
 function compareSorted(a, b) {
     const sortedA = Object.entries(a).sort();
     const sortedB = Object.entries(b).sort();
     return JSON.stringify(sortedA) === JSON.stringify(sortedB);
 }
 
-document.getElementById('distrito').addEventListener('change', function() {
+document.getElementById('distrito').addEventListener('change', async function() {
     const selectedDistrict = this.value;
     const nacionalDiv = document.getElementById('resultados');
     const districtDiv = document.getElementById('district-results-container');
@@ -148,14 +189,14 @@ document.getElementById('distrito').addEventListener('change', function() {
         document.getElementById('distrito').textContent = selectedDistrict;
         
         if (document.getElementsByName('paroucolig')[0].checked) {
-            const districtData = getDistrictData(selectedDistrict);
+            const districtData = await getDistrictData(selectedDistrict);
             updateDistrictTable(districtData);
             districtDiv.classList.remove('hidden');
             districtDiv.classList.add('visible-block');
         } else {
             const districtGroupData = typeof results !== 'undefined' 
                 ? results[selectedDistrict]
-                : getDistrictGroupData(selectedDistrict);
+                : await getDistrictGroupData(selectedDistrict);
             updateDistrictGroupTable(districtGroupData);
             districtGroupDiv.classList.remove('hidden');
             districtGroupDiv.classList.add('visible-block');
@@ -163,18 +204,9 @@ document.getElementById('distrito').addEventListener('change', function() {
     }
 });
 
-function getDistrictData(selectedDistrict) {
+async function getDistrictData(selectedDistrict) {
     // Process and display district data by party
-    // Get the raw encoded data
-    const rawData = document.getElementById('election-data').getAttribute('data-districts');
-
-    // Decode HTML entities first
-    const decodedData = new DOMParser()
-    .parseFromString(rawData, 'text/html')
-    .documentElement.textContent;
-
-    // Then parse JSON
-    const districtData = getElectionData()[selectedDistrict] || {};
+    const districtData = (await getElectionData())[selectedDistrict] || {};
     return districtData;
 }
 
@@ -265,16 +297,10 @@ function updateDistrictTable(data) {
     table.classList.add('visible-table');
 }
 
-function getElectionData() {
+async function getElectionData() {
     try {
-      const container = document.getElementById('election-data');
-      if (!container) throw new Error('Data container not found');
-      
-      const raw = container.getAttribute('data-districts');
-      if (!raw) throw new Error('No data attribute found');
-      
-      const decoded = new DOMParser().parseFromString(raw, 'text/html').documentElement.textContent;
-      return JSON.parse(decoded);
+      const data = await loadElectionData();
+      return data.votos;
     } catch (error) {
       console.error('Failed to load election data:', error);
       return {}; // Return empty object as fallback
@@ -366,30 +392,31 @@ function updateDistrictGroupTable(data) {
     table.classList.remove('hidden');
 }
 
-function getDistrictGroupData(selectedDistrict) {
-    // Get the raw encoded data for GROUPS
-    const rawGroupData = document.getElementById('election-group-data').getAttribute('data-district-groups');
-    
-    // Decode HTML entities and parse JSON
-    const decodedGroupData = new DOMParser()
-        .parseFromString(rawGroupData, 'text/html')
-        .documentElement.textContent;
-    
-    const electionGroupData = JSON.parse(decodedGroupData);
-    return electionGroupData[selectedDistrict] || {};
+async function getDistrictGroupData(selectedDistrict) {
+    // Per-district data for GROUPS
+    try {
+        const data = await loadElectionData();
+        return data.votos_colig[selectedDistrict] || {};
+    } catch (error) {
+        console.error('Failed to load election data:', error);
+        return {};
+    }
 }
 
-document.addEventListener('DOMContentLoaded', () => {
+document.addEventListener('DOMContentLoaded', async () => {
+    const groupSelects = document.querySelectorAll('.group-select');
+    if (groupSelects.length === 0) return;  // Nothing to set up, no data to load
+
     // Initialize calculator
     const baseData = {
-        partidos: JSON.parse(document.getElementById('election-data').dataset.partidos),
-        districts: JSON.parse(document.getElementById('election-data').dataset.districts)
+        partidos: window.partidos,
+        districts: await getElectionData()
     };
     
     const calculator = new ElectionCalculator(baseData);
     
     // Event handlers
-    document.querySelectorAll('.group-select').forEach(select => {
+    groupSelects.forEach(select => {
         select.addEventListener('change', (e) => {
             const party = e.target.closest('.party-group').dataset.party;
             calculator.currentAllocations[party] = e.target.value;
@@ -404,7 +431,7 @@ document.addEventListener('DOMContentLoaded', function() {
     
     // Add change event listener to each radio button
     radioButtons.forEach(radio => {
-        radio.addEventListener('change', function() {
+        radio.addEventListener('change', async function() {
             if (this.checked) {
                 // Execute different code based on selected value
                 const selectedDistrict = document.getElementById('distrito').value;
@@ -428,7 +455,7 @@ document.addEventListener('DOMContentLoaded', function() {
                         document.getElementById('district-group-results-container').classList.remove('visible-block');
                         document.getElementById('rescolig').classList.add('hidden');
                         document.getElementById('rescolig').classList.remove ('visible-block');
-                        const districtData = getDistrictData(selectedDistrict);
+                        const districtData = await getDistrictData(selectedDistrict);
                         updateDistrictTable(districtData);
                         document.getElementById('district-results-container').classList.remove('hidden');
                         document.getElementById('district-results-container').classList.add('visible-block');
@@ -458,7 +485,7 @@ document.addEventListener('DOMContentLoaded', function() {
                         document.getElementById('rescolig').classList.remove ('visible-block');
                         const districtData = typeof results !== 'undefined' 
                             ? results[selectedDistrict]
-                            : getDistrictGroupData(selectedDistrict);
+                            : await getDistrictGroupData(selectedDistrict);
                         updateDistrictGroupTable(districtData);
                     }
                 }
@@ -467,3 +494,117 @@ document.addEventListener('DOMContentLoaded', function() {
     });
     
 });
+
+
+// Live updates: /api/eventos pushes the districts that changed and the
+// national totals on every new snapshot (see events.py); they are applied
+// to the data already loaded and to the tables on screen, with no reload
+let liveUpdates = Promise.resolve();
+
+function openEventStream() {
+    if (!window.EventSource) return;
+    const source = new EventSource('/api/eventos?versao=' + encodeURIComponent(window.versao || ''));
+    const onEvent = reset => event => {
+        const delta = JSON.parse(event.data);
+        // One update at a time, in the order they arrive
+        liveUpdates = liveUpdates
+            .then(() => applyDelta(delta, reset))
+            .catch(error => console.error('Live update failed:', error));
+    };
+    source.addEventListener('delta', onEvent(false));
+    source.addEventListener('reset', onEvent(true));
+    source.onerror = () => {
+        // The browser reconnects by itself when a stream ends (a busy server
+        // ends it at once with a longer retry); an error response closes it,
+        // so try again later
+        if (source.readyState === EventSource.CLOSED) {
+            setTimeout(openEventStream, 60000);
+        }
+    };
+}
+
+async function applyDelta(delta, reset) {
+    window.versao = delta.version;
+
+    if (electionDataRequest) {
+        let data = null;
+        try {
+            data = await electionDataRequest;
+        } catch (error) {
+            // Fetched again when needed
+        }
+        if (data && (reset || data.version === delta.anterior)) {
+            if (reset) {
+                data.votos = {};
+                data.votos_colig = {};
+            }
+            Object.assign(data.votos, delta.votos);
+            Object.assign(data.votos_colig, delta.votos_colig);
+            data.version = delta.version;
+        } else {
+            electionDataRequest = null;  // Out of step: fetched again when needed
+        }
+    }
+
+    updateNationalTable(document.querySelector('#resultados tbody'), delta.partidos, delta);
+    updateNationalTable(document.querySelector('#rescolig tbody'), delta.grupos, delta);
+
+    const selectedDistrict = document.getElementById('distrito').value;
+    if (!document.getElementById('district-results-container').classList.contains('hidden')) {
+        updateDistrictTable(await getDistrictData(selectedDistrict));
+    }
+    if (Object.keys(results).length > 0) {
+        // The coalitions on screen are simulated again with the new votes
+        const simulated = await simulateOnServer(window.partidos);
+        if (simulated) {
+            results = simulated;
+            if (!document.getElementById('district-group-results-container').classList.contains('hidden')
+                && results[selectedDistrict]) {
+                updateDistrictGroupTable(results[selectedDistrict]);
+            }
+        }
+    }
+}
+
+function updateNationalTable(tbody, entries, totals) {
+    // Same rows as the national tables of index.html
+    const format = (value, digits = 0) => value.toLocaleString('en-US', { maximumFractionDigits: digits });
+    const totalAll = totals.total_votos;
+    const totalValid = totalAll - totals.votos_brancos - totals.votos_nulos;
+    const share = (votos, total) => (total > 0 ? votos / total * 100 : 0).toFixed(2);
+
+    const rows = entries.map(({name, votos, mandatos}) => `
+        <tr>
+            <td style="padding: 4px;">${name}</td>
+            <td style="padding: 4px; text-align: right;">${format(votos)}</td>
+            <td style="padding: 4px; text-align: right;">${share(votos, totalValid)}%</td>
+            <td style="padding: 4px; text-align: right;">${mandatos > 0 ? mandatos : ''}</td>
+            <td style="padding: 4px; text-align: right;">${mandatos > 0 ? format(votos / mandatos) : ''}</td>
+        </tr>`);
+    rows.push(`
+        <tr style="font-weight: bold; background-color: #e6f7e6; border-top: 2px solid #dbcfcf;">
+            <td style="padding: 8px;">Votos válidos</td>
+            <td style="padding: 8px; text-align: right;">${format(totalValid)}</td>
+            <td style="padding: 8px; text-align: right;">100.00%</td>
+            <td style="padding: 8px; text-align: right;">${format(totals.total_mandatos)}</td>
+            <td style="padding: 8px; text-align: right;">${totals.total_mandatos > 0 ? format(totalValid / totals.total_mandatos) : ''}</td>
+        </tr>
+        <tr style="background-color: white;">
+            <td style="padding: 8px;">Votos em branco</td>
+            <td style="padding: 8px; text-align: right;">${format(totals.votos_brancos)}</td>
+            <td style="padding: 8px; text-align: right;">${share(totals.votos_brancos, totalAll)}%</td>
+        </tr>
+        <tr style="background-color: white;">
+            <td style="padding: 8px;">Votos nulos</td>
+            <td style="padding: 8px; text-align: right;">${format(totals.votos_nulos)}</td>
+            <td style="padding: 8px; text-align: right;">${share(totals.votos_nulos, totalAll)}%</td>
+        </tr>
+        <tr style="font-weight: bold; background-color: #e6f7e6; border-top: 2px solid #000;">
+            <td style="padding: 8px;">TOTAL</td>
+            <td style="padding: 8px; text-align: right;">${format(totalAll)}</td>
+            <td style="padding: 8px; text-align: right;">100.00%</td>
+        </tr>`);
+    tbody.innerHTML = rows.join('');
+}
+
+document.addEventListener('DOMContentLoaded', openEventStream);
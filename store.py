@@ -0,0 +1,113 @@
+from collections.abc import Mapping
+
+import numpy as np
+
+
+"""
+    Representação compacta dos resultados por distrito.
+
+    Em vez de dict -> dict -> {'votos', 'mandatos'} por distrito, os nomes
+    dos distritos e dos partidos (ou grupos) passam a ids inteiros e os
+    votos e mandatos ficam em matrizes NumPy densas distrito x partido.
+    A ordenação por votos dentro de cada distrito é uma operação
+    vectorial, e cada snapshot guarda só estas matrizes (os totais vêm de
+    totals.py).
+
+    DistrictResultsView apresenta a mesma tabela com o formato antigo
+    ({distrito: {partido: {'votos', 'mandatos'}}}, partidos ordenados por
+    votos), para o JSON de /api/dados, as simulações e os scripts.
+
+"""
+
+
+class CodedResults:
+    """
+    Votes and mandates of every (district, name) in dense arrays.
+
+    A name is a party or a group. Names that did not run in a district are
+    marked absent and hold zeros.
+
+    Attributes:
+        districts (list): district name of each row
+        names (list): party/group name of each column
+        votes, seats (np.ndarray): int64, district x name
+        present (np.ndarray): bool, district x name
+        rows, columns (np.ndarray): the present entries, sorted by district
+            and then by votes (descending); equal votes keep the input order
+        offsets (np.ndarray): entries of district d are offsets[d]:offsets[d + 1]
+    """
+
+    def __init__(self, districts, names, votes, seats, present, insertion):
+        self.districts = districts
+        self.names = names
+        self.votes = votes
+        self.seats = seats
+        self.present = present
+
+        # Sort the entries by (district, -votes, input order)
+        rows, columns = np.nonzero(present)
+        order = np.lexsort((insertion[rows, columns], -votes[rows, columns], rows))
+        self.rows = rows[order]
+        self.columns = columns[order]
+        self.offsets = np.searchsorted(self.rows, np.arange(len(districts) + 1))
+
+    @classmethod
+    def from_nested(cls, nested):
+        """
+        Args:
+            nested (dict): {district: {name: {'votos', 'mandatos'}}}
+        """
+        districts = list(nested)
+        name_ids = {}
+        entries = []
+        for row, entries_of_district in enumerate(nested.values()):
+            for position, (name, data) in enumerate(entries_of_district.items()):
+                column = name_ids.setdefault(name, len(name_ids))
+                entries.append((row, column, position, data['votos'], data['mandatos']))
+
+        shape = (len(districts), len(name_ids))
+        votes = np.zeros(shape, dtype=np.int64)
+        seats = np.zeros(shape, dtype=np.int64)
+        present = np.zeros(shape, dtype=bool)
+        insertion = np.zeros(shape, dtype=np.int64)
+        if entries:
+            row, column, position, votos, mandatos = (np.array(values, dtype=np.int64) for values in zip(*entries))
+            votes[row, column] = votos
+            seats[row, column] = mandatos
+            present[row, column] = True
+            insertion[row, column] = position
+        return cls(districts, list(name_ids), votes, seats, present, insertion)
+
+    def district(self, row):
+        """The sorted {name: {'votos', 'mandatos'}} of one district"""
+        columns = self.columns[self.offsets[row]:self.offsets[row + 1]]
+        votes = self.votes[row, columns].tolist()
+        seats = self.seats[row, columns].tolist()
+        return {
+            self.names[column]: {'votos': votos, 'mandatos': mandatos}
+            for column, votos, mandatos in zip(columns.tolist(), votes, seats)
+        }
+
+
+class DistrictResultsView(Mapping):
+    """
+    Read-only {district: {name: {'votos', 'mandatos'}}} over a CodedResults.
+
+    The dict of a district is built when it is read.
+    """
+
+    def __init__(self, coded):
+        self.coded = coded
+        self._rows = {district: row for row, district in enumerate(coded.districts)}
+
+    def __getitem__(self, district):
+        return self.coded.district(self._rows[district])
+
+    def __iter__(self):
+        return iter(self.coded.districts)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def to_dict(self):
+        return {district: self[district] for district in self}
@@ -0,0 +1,276 @@
+import math
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from allocation import EXCLUDED_GROUPS
+from config import SWEEP_WORKERS, SWEEP_START_METHOD, SWEEP_MAX_SCENARIOS
+from scenarios import (VoteMatrix, national_seats, merge_labels, merge_ranking, mapping_labels,
+                       party_merges)
+from simulation import MappingError, is_integer, parse_mapping
+
+
+"""
+    Varrimentos de cenários em vários processos.
+
+    A matriz de votos, os mandatos por distrito e a matriz de rótulos dos
+    cenários vão para memória partilhada (multiprocessing.shared_memory)
+    uma vez por varrimento; cada tarefa do ProcessPoolExecutor recebe só
+    os nomes desses blocos e um intervalo de cenários, e devolve os
+    mandatos nacionais desse intervalo. Os processos guardam os blocos
+    abertos entre tarefas e o pool é criado uma vez por processo e
+    reutilizado, por isso o custo fixo de um varrimento é só copiar as
+    matrizes para a memória partilhada.
+
+    POST /api/sweep faz o mesmo no servidor e envia o progresso em NDJSON
+    (ver stream_sweep).
+
+    python scenarios.py --workers 4 --sizes 2 3 4
+
+"""
+
+
+class SharedArrays:
+    """
+    NumPy arrays copied to shared memory blocks, one per array.
+
+    Attributes:
+        descriptor (dict): {name: (block name, shape, dtype)}, what the
+                           workers receive instead of the arrays
+    """
+
+    def __init__(self, arrays):
+        self.blocks = []
+        self.descriptor = {}
+        try:
+            for name, array in arrays.items():
+                array = np.ascontiguousarray(array)
+                block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+                self.blocks.append(block)
+                np.ndarray(array.shape, array.dtype, buffer=block.buf)[...] = array
+                self.descriptor[name] = (block.name, array.shape, array.dtype.str)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        """Frees the blocks; workers that still map them keep their pages until they let go"""
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# Blocks the worker process has open: (descriptor items, blocks, arrays)
+_attached = None
+
+
+def _attach(descriptor):
+    """The arrays of a descriptor, opened once per sweep in each worker"""
+    global _attached
+    key = tuple(sorted((name, block_name) for name, (block_name, _, _) in descriptor.items()))
+    if _attached is None or _attached[0] != key:
+        if _attached is not None:
+            for block in _attached[1]:
+                block.close()
+        blocks, arrays = [], {}
+        for name, (block_name, shape, dtype) in descriptor.items():
+            block = shared_memory.SharedMemory(name=block_name)
+            blocks.append(block)
+            arrays[name] = np.ndarray(shape, np.dtype(dtype), buffer=block.buf)
+        _attached = (key, blocks, arrays)
+    return _attached[2]
+
+
+def _sweep_range(descriptor, districts, parties, start, stop, chunk_size):
+    """Task of a worker: national mandates of the scenarios start:stop"""
+    arrays = _attach(descriptor)
+    matrix = VoteMatrix(districts, parties, arrays['votes'], arrays['seats'])
+    return start, national_seats(matrix, arrays['labels'][start:stop], chunk_size)
+
+
+class Sweeper:
+    """
+    Evaluates blocks of scenarios in a process pool.
+
+    The pool starts on the first sweep and stays up for the next ones;
+    if a worker dies, that sweep fails and the next one starts a new pool.
+    Its national_seats() has the signature of scenarios.national_seats,
+    so it can be passed as the engine of scenarios.rank_merges.
+    """
+
+    def __init__(self, workers=SWEEP_WORKERS, start_method=SWEEP_START_METHOD, tasks_per_worker=4):
+        self.workers = max(1, workers)
+        self.start_method = start_method
+        self.tasks_per_worker = tasks_per_worker
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    self.workers, mp_context=multiprocessing.get_context(self.start_method)
+                )
+            return self._executor
+
+    def _discard(self, pool):
+        """Drops a broken pool, so the next sweep starts a new one"""
+        with self._lock:
+            if self._executor is pool:
+                self._executor = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+    def sweep(self, matrix, labels, chunk_size=256):
+        """
+        Shards the scenarios across the workers.
+
+        Args:
+            matrix (VoteMatrix)
+            labels (np.ndarray): scenario x party, see scenarios.py
+            chunk_size (int): scenarios per block inside a task
+
+        Yields:
+            (start, seats): national mandates (scenario x group) of the
+                            scenarios start:start + len(seats), in the
+                            order the tasks finish
+        """
+        n_scenarios = len(labels)
+        if n_scenarios == 0:
+            return
+        # A few tasks per worker, so a slow one does not hold up the end of the sweep
+        shard = max(chunk_size, math.ceil(n_scenarios / (self.workers * self.tasks_per_worker)))
+        pool = self._pool()
+        with SharedArrays({'votes': matrix.votes, 'seats': matrix.seats, 'labels': labels}) as shared:
+            futures = []
+            try:
+                for start in range(0, n_scenarios, shard):
+                    futures.append(pool.submit(_sweep_range, shared.descriptor, matrix.districts, matrix.parties,
+                                               start, min(start + shard, n_scenarios), chunk_size))
+                for future in as_completed(futures):
+                    yield future.result()
+            except BrokenProcessPool:
+                # A worker died (killed, out of memory): this sweep fails, the next one gets a new pool
+                self._discard(pool)
+                raise
+            finally:
+                for future in futures:
+                    future.cancel()
+                # Let running tasks finish before the blocks are unlinked
+                for future in futures:
+                    if not future.cancelled():
+                        future.exception()
+
+    def national_seats(self, matrix, labels, chunk_size=256, progress=None):
+        """
+        The merged results of sweep().
+
+        Args:
+            progress (callable): called with (scenarios done, total) after each task
+
+        Returns:
+            seats (np.ndarray): int64, scenario x group, as scenarios.national_seats
+        """
+        national = np.zeros(labels.shape, dtype=np.int64)
+        done = 0
+        for start, seats in self.sweep(matrix, labels, chunk_size):
+            national[start:start + len(seats)] = seats
+            done += len(seats)
+            if progress is not None:
+                progress(done, len(labels))
+        return national
+
+
+def parse_sweep(body, parties, max_scenarios=SWEEP_MAX_SCENARIOS):
+    """
+    Validates the body of POST /api/sweep.
+
+    Args:
+        body (dict): {"sizes": [2, 3], "top": 20} for every merge of 2 or 3
+                     parties, or {"mappings": [{party: [group]}]}
+        parties (list): VoteMatrix.parties
+
+    Returns:
+        merges (list): tuples of parties, or None
+        mappings (list): normalised {party: group} (see simulation.parse_mapping), or None
+        top (int): ranking entries to return
+    """
+    if not isinstance(body, dict):
+        raise MappingError("expected an object with 'sizes' or 'mappings'")
+    top = body.get('top', 20)
+    if not is_integer(top) or top < 0:
+        raise MappingError("'top' must be a non-negative integer")
+
+    if 'mappings' in body:
+        mappings = body['mappings']
+        if not isinstance(mappings, list) or not mappings:
+            raise MappingError("'mappings' must be a non-empty list")
+        if len(mappings) > max_scenarios:
+            raise MappingError(f"at most {max_scenarios:,} scenarios per sweep")
+        return None, [parse_mapping(mapping) for mapping in mappings], top
+
+    sizes = body.get('sizes', [2, 3])
+    if not isinstance(sizes, list) or not sizes or not all(is_integer(size) and size >= 2 for size in sizes):
+        raise MappingError("'sizes' must be a list of integers >= 2")
+    eligible = sum(party not in EXCLUDED_GROUPS for party in parties)
+    if sum(math.comb(eligible, size) for size in set(sizes)) > max_scenarios:
+        raise MappingError(f"at most {max_scenarios:,} scenarios per sweep")
+    return party_merges(parties, sorted(set(sizes))), None, top
+
+
+def mapping_results(matrix, mappings, national):
+    """[{group: mandates}] of each mapping, groups with mandates only"""
+    results = []
+    for party_to_group, row in zip(mappings, national):
+        groups = {}
+        for column, party in enumerate(matrix.parties):
+            if row[column]:
+                groups[party_to_group.get(party, party)] = int(row[column])
+        results.append(dict(sorted(groups.items(), key=lambda x: x[1], reverse=True)))
+    return results
+
+
+def stream_sweep(sweeper, matrix, merges=None, mappings=None, top=20):
+    """
+    Runs a sweep and reports it as it goes.
+
+    Yields:
+        {'feitos', 'total'} after each task, then
+        {'ranking': [{'partidos', 'mandatos', 'separados', 'ganho'}]} for merges
+        or {'resultados': [{group: mandates}]} for mappings
+    """
+    if merges is not None:
+        labels = merge_labels(matrix.parties, merges)
+    else:
+        labels = mapping_labels(matrix.parties, mappings)
+
+    national = np.zeros(labels.shape, dtype=np.int64)
+    done = 0
+    for start, seats in sweeper.sweep(matrix, labels):
+        national[start:start + len(seats)] = seats
+        done += len(seats)
+        yield {'feitos': done, 'total': len(labels)}
+
+    if merges is not None:
+        yield {'ranking': [
+            {'partidos': list(merged), 'mandatos': together, 'separados': apart, 'ganho': together - apart}
+            for merged, together, apart in merge_ranking(matrix, merges, national)[:top]
+        ]}
+    else:
+        yield {'resultados': mapping_results(matrix, mappings, national)}
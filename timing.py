@@ -0,0 +1,33 @@
+import time
+from contextlib import contextmanager
+
+
+"""
+    Medição do tempo de arranque por fase (import, query, to_dataframe,
+    aggregate, sort).
+
+"""
+
+
+@contextmanager
+def phase(timings, name):
+    """
+    Adds the wall time of the block to timings[name] (in seconds).
+
+    Args:
+        timings (dict or None): where to accumulate; None disables timing
+        name (str): phase name
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + time.perf_counter() - start
+
+
+def print_timings(timings):
+    """Prints one line per phase, in the order they were first recorded"""
+    print("\n=== STARTUP TIMES ===")
+    for name, seconds in timings.items():
+        print(f"{name:<15} {seconds:>8.3f} s")
@@ -0,0 +1,162 @@
+from allocation import EXCLUDED_GROUPS
+
+
+"""
+    Totais nacionais e por distrito numa só passagem.
+
+    Cada par (distrito, partido) e (distrito, grupo) é lido uma vez e soma
+    ao mesmo tempo os totais nacionais por partido e por grupo, os votos
+    em branco e nulos e os totais de cada distrito. Os totais nacionais
+    nunca são guardados no meio dos distritos, por isso nada é contado duas
+    vezes. Quando um distrito muda, replace_district() retira o que ele
+    tinha somado e soma os números novos, sem voltar a ler os outros.
+
+"""
+
+BLANK = 'Votos em branco'
+NULL = 'Votos nulos'
+
+
+class ElectionTotals:
+    """
+    National and per-district sums of the party and group tables.
+
+    Attributes:
+        parties, groups (dict): {name: {'votos', 'mandatos'}} over all districts
+        districts (dict): {district: {'votos', 'validos', 'brancos', 'nulos', 'mandatos'}}
+        blank_votes, null_votes, total_votes, total_mandates (int)
+    """
+
+    def __init__(self):
+        self.parties = {}
+        self.groups = {}
+        self.districts = {}
+        self.blank_votes = 0
+        self.null_votes = 0
+        self.total_votes = 0
+        self.total_mandates = 0
+        self._contributions = {}  # district -> (parties, groups) it added
+        self._counts = ({}, {})     # districts where each party / group appears
+
+    @classmethod
+    def from_districts(cls, raw_district_results, grouped_district_results):
+        """One pass over {district: {party: ...}} and {district: {group: ...}}"""
+        totals = cls()
+        for district_name, parties in raw_district_results.items():
+            totals.replace_district(district_name, parties, grouped_district_results.get(district_name, {}))
+        return totals
+
+    def copy(self):
+        """An independent copy, to replace districts in without touching this one"""
+        totals = ElectionTotals()
+        # The district sums and contributions are replaced, never changed in place
+        totals.parties = {name: dict(data) for name, data in self.parties.items()}
+        totals.groups = {name: dict(data) for name, data in self.groups.items()}
+        totals.districts = dict(self.districts)
+        totals.blank_votes = self.blank_votes
+        totals.null_votes = self.null_votes
+        totals.total_votes = self.total_votes
+        totals.total_mandates = self.total_mandates
+        totals._contributions = dict(self._contributions)
+        totals._counts = tuple(dict(counts) for counts in self._counts)
+        return totals
+
+    def replace_district(self, district_name, parties, groups):
+        """
+        Sets the numbers of one district, replacing what it added before.
+
+        Args:
+            parties (dict): {party: {'votos', 'mandatos'}} of the district
+            groups (dict): {group: {'votos', 'mandatos'}} of the district
+        """
+        self.remove_district(district_name)
+        contribution = (
+            {party: (data['votos'], data['mandatos']) for party, data in parties.items()},
+            {group: (data['votos'], data['mandatos']) for group, data in groups.items()}
+        )
+        self._contributions[district_name] = contribution
+        self._add(district_name, contribution, 1)
+
+    def remove_district(self, district_name):
+        contribution = self._contributions.pop(district_name, None)
+        if contribution is not None:
+            self._add(district_name, contribution, -1)
+            del self.districts[district_name]
+
+    def _add(self, district_name, contribution, sign):
+        party_numbers, group_numbers = contribution
+        district = {'votos': 0, 'validos': 0, 'brancos': 0, 'nulos': 0, 'mandatos': 0}
+
+        for party, (votos, mandatos) in party_numbers.items():
+            self._count(self.parties, 0, party, votos, mandatos, sign)
+            district['votos'] += votos
+            district['mandatos'] += mandatos
+            if party == BLANK:
+                district['brancos'] += votos
+            elif party == NULL:
+                district['nulos'] += votos
+        district['validos'] = district['votos'] - district['brancos'] - district['nulos']
+
+        for group, (votos, mandatos) in group_numbers.items():
+            self._count(self.groups, 1, group, votos, mandatos, sign)
+
+        if sign > 0:
+            self.districts[district_name] = district
+        self.blank_votes += sign * district['brancos']
+        self.null_votes += sign * district['nulos']
+        self.total_votes += sign * district['votos']
+        self.total_mandates += sign * district['mandatos']
+
+    def _count(self, table, index, name, votos, mandatos, sign):
+        national = table.setdefault(name, {'votos': 0, 'mandatos': 0})
+        national['votos'] += sign * votos
+        national['mandatos'] += sign * mandatos
+        counts = self._counts[index]
+        counts[name] = counts.get(name, 0) + sign
+        if counts[name] == 0:  # No district has it any more
+            del counts[name]
+            del table[name]
+
+    @property
+    def valid_votes(self):
+        return self.total_votes - self.blank_votes - self.null_votes
+
+    def ranking(self, table):
+        """
+        Parties or groups sorted by votes, without blank/null votes, with
+        their share of the valid votes of the table.
+
+        Args:
+            table (dict): self.parties or self.groups
+
+        Returns:
+            ranking (list): [{'name', 'votos', 'mandatos', 'vote_share'}]
+        """
+        valid_votes = sum(data['votos'] for name, data in table.items() if name not in EXCLUDED_GROUPS)
+        ranking = [
+            {
+                'name': name,
+                'votos': data['votos'],
+                'mandatos': data['mandatos'],
+                'vote_share': round(data['votos'] / valid_votes * 100, 2) if valid_votes else 0.0
+            }
+            for name, data in table.items()
+            if name not in EXCLUDED_GROUPS + ('TOTAL',)
+        ]
+        ranking.sort(key=lambda x: x['votos'], reverse=True)
+        return ranking
+
+    def district_shares(self):
+        """
+        Returns:
+            districts (dict): copy of self.districts, with the share of blank
+                              and null votes in each district
+        """
+        return {
+            district_name: dict(
+                district,
+                brancos_pct=round(district['brancos'] / district['votos'] * 100, 2) if district['votos'] else 0.0,
+                nulos_pct=round(district['nulos'] / district['votos'] * 100, 2) if district['votos'] else 0.0
+            )
+            for district_name, district in self.districts.items()
+        }